@@ -13,14 +13,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import os
+
 from django.contrib import admin
 from django.urls import include, path
 from django.conf import settings
 from django.conf.urls.static import static
+from django.views.decorators.cache import cache_control
+from django.views.static import serve
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from store.renditions import IMMUTABLE_MAX_AGE
+
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -44,4 +50,11 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
+    # Rendition names are content-hashed, so browsers may cache them forever;
+    # production servers should send the same header for media/renditions/.
+    urlpatterns += static(
+        settings.MEDIA_URL + 'renditions/',
+        cache_control(public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)(serve),
+        document_root=os.path.join(settings.MEDIA_ROOT, 'renditions'),
+    )
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
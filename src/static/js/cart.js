@@ -15,10 +15,34 @@ for (i = 0; i < updateBtns.length; i++) {
 	})
 }
 
+// Rapid clicks are coalesced into per-product deltas and sent as one batch.
+var pendingChanges = {}
+var flushTimer = null
+var FLUSH_DELAY = 300
+
 function updateUserOrder(productId, action){
-	console.log('User is authenticated, sending data...')
+	console.log('User is authenticated, queueing change...')
+
+	var delta = action == 'add' ? 1 : -1
+	pendingChanges[productId] = (pendingChanges[productId] || 0) + delta
+
+	clearTimeout(flushTimer)
+	flushTimer = setTimeout(flushCartChanges, FLUSH_DELAY)
+}
+
+function flushCartChanges(){
+	var changes = []
+	for (var productId in pendingChanges){
+		if (pendingChanges[productId] != 0){
+			changes.push({'productId':productId, 'delta':pendingChanges[productId]})
+		}
+	}
+	pendingChanges = {}
+	if (changes.length == 0){
+		return
+	}
 
-	var url = '/update_item/'
+	var url = '/update_cart/'
 
 	fetch(url, {
 		method:'POST',
@@ -26,7 +50,7 @@ function updateUserOrder(productId, action){
 			'Content-Type':'application/json',
 			'X-CSRFToken':csrftoken,
 		},
-		body:JSON.stringify({'productId':productId, 'action':action})
+		body:JSON.stringify({'changes':changes})
 	})
 	.then((response) => {
 	   return response.json();
@@ -1,11 +1,27 @@
 from django.contrib import admin
 from .models import *
+from .order_export import export_response
 # Register your models here.
 
 
+def order_export_action(file_format, rows):
+    """An admin action streaming the selected orders, see store.order_export."""
+    def export(modeladmin, request, queryset):
+        return export_response(file_format, queryset, rows)
+
+    what = 'orders' if rows == 'orders' else 'order lines'
+    export.__name__ = f'export_{rows}_{file_format}'
+    export.short_description = f'Export selected {what} as {file_format.upper()}'
+    return export
+
+
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'customer', 'price', 'complete', 'shipping_status', 'created_at')
     readonly_fields = ('price',)
+    actions = [
+        order_export_action(file_format, rows)
+        for rows in ('orders', 'items') for file_format in ('csv', 'jsonl')
+    ]
 
     def save_model(self, request, obj, form, change):
         """Override save_model to handle ManyToMany relationships."""
@@ -15,7 +31,7 @@ class OrderAdmin(admin.ModelAdmin):
 
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'category')
+    list_display = ('name', 'price', 'effective_price', 'category')
 
 
 class DiscountAdmin(admin.ModelAdmin):
@@ -30,9 +46,21 @@ class OrderItemAdmin(admin.ModelAdmin):
     list_display = ('id', 'product', 'order', 'quantity')
 
 
+class ShippingZoneAdmin(admin.ModelAdmin):
+    list_display = ('name', 'base_cost', 'per_item_cost', 'multiplier', 'is_default')
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'updated_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('result', 'last_error', 'lock_token', 'locked_until')
+
+
 admin.site.register(Category)
 admin.site.register(Discount, DiscountAdmin)
 admin.site.register(Product, ProductAdmin)
 admin.site.register(ShippingInfo, ShippingInfoAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
+admin.site.register(ShippingZone, ShippingZoneAdmin)
+admin.site.register(Job, JobAdmin)
@@ -1,9 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .viewsets import ProductViewSet, OrderViewSet, ShippingInfoViewSet, ReviewViewSet
+from .viewsets import CatalogViewSet, CategoryViewSet, ProductViewSet, OrderViewSet, ShippingInfoViewSet, ReviewViewSet
 
 router = DefaultRouter()
+router.register(r'catalog', CatalogViewSet, basename='catalog')
+router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'products', ProductViewSet, basename='product')
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'shipping-info', ShippingInfoViewSet, basename='shipping-info')
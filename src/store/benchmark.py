@@ -0,0 +1,323 @@
+"""
+Latency benchmark of the storefront and API hot paths.
+
+``seed_dataset()`` fills the database with a synthetic catalog and order
+history through ``bulk_create``, then derives the denormalized columns with
+the same management commands used to repair them in production (effective
+prices, ratings, order totals, category counts and the search index).
+``run_benchmark()`` drives every endpoint through the Django test client and
+reports, per endpoint, p50/p95/p99 latency, queries per request and peak
+memory allocated per request (from ``tracemalloc``, on separate requests so
+tracing does not slow the timed ones).
+
+Results are plain JSON, so runs can be stored and compared with
+``compare_results()``. Run it with ``manage.py benchmark`` (which works in a
+throwaway test database), or with ``STORE_BENCHMARK=1`` through the test
+suite (``store.tests.BenchmarkTest``).
+"""
+import math
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .cart import compute_cart_summary, get_active_order, update_cart
+from .models import Category, Discount, Order, OrderItem, Product, Review, ShippingInfo
+from .page_cache import invalidate_catalog
+from .renditions import failed_renditions
+
+DATASET_DEFAULTS = {
+    'categories': 20,
+    'products': 2000,
+    'discounts': 10,
+    'users': 200,
+    'orders': 1000,
+    'items_per_order': 3,
+    'reviews': 5000,
+}
+BATCH_SIZE = 1000
+CART_SIZE = 3
+
+ADJECTIVES = ('Compact', 'Classic', 'Deluxe', 'Rugged', 'Smart', 'Vintage', 'Wireless', 'Organic', 'Modern', 'Portable')
+MATERIALS = ('Steel', 'Oak', 'Cotton', 'Ceramic', 'Leather', 'Glass', 'Bamboo', 'Copper')
+NOUNS = ('Lamp', 'Chair', 'Kettle', 'Backpack', 'Speaker', 'Notebook', 'Blanket', 'Mug', 'Watch', 'Planter')
+
+Dataset = namedtuple('Dataset', ['user', 'product', 'order', 'shipping_info', 'review', 'search', 'category'])
+Endpoint = namedtuple('Endpoint', ['name', 'method', 'url', 'data', 'signed_in', 'prepare'], defaults=(None, False, None))
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def _batches(objects):
+    for start in range(0, len(objects), BATCH_SIZE):
+        yield objects[start:start + BATCH_SIZE]
+
+
+def seed_dataset(sizes=None, seed=0):
+    """
+    Create the synthetic dataset described by ``sizes`` (see
+    ``DATASET_DEFAULTS``) and return the ``Dataset`` the endpoints use.
+    The same ``seed`` always produces the same data.
+    """
+    sizes = {**DATASET_DEFAULTS, **(sizes or {})}
+    rng = random.Random(seed)
+    today = timezone.localdate()
+
+    categories = Category.objects.bulk_create(
+        [Category(name=f'Category {n}', slug=f'category-{n}') for n in range(sizes['categories'])],
+        batch_size=BATCH_SIZE,
+    )
+    products = []
+    for n in range(sizes['products']):
+        name = f'{rng.choice(ADJECTIVES)} {rng.choice(MATERIALS)} {rng.choice(NOUNS)} {n}'
+        price = Decimal(rng.randrange(199, 49999)).scaleb(-2)
+        products.append(Product(
+            name=name, slug=slugify(name), description=f'{name}, {rng.choice(ADJECTIVES).lower()} and built to last.',
+            price=price, effective_price=price, category=rng.choice(categories) if categories else None,
+            digital=rng.random() < 0.1, stock=rng.choice((0, 5, 50, 500)),
+        ))
+    products = Product.objects.bulk_create(products, batch_size=BATCH_SIZE)
+    # As if already rendered; pages would otherwise queue rendition jobs while timed.
+    Product.objects.update(renditions=failed_renditions(Product._meta.get_field('image').default, 'Benchmark'))
+
+    discounts = Discount.objects.bulk_create([
+        Discount(name=f'Discount {n}', percentage=Decimal(rng.choice((5, 10, 15, 25))), active=True,
+                 expired_date=today + timedelta(days=rng.randrange(1, 60)))
+        for n in range(sizes['discounts'])
+    ])
+    if discounts:
+        Through = Product.discount.through
+        Through.objects.bulk_create(
+            [Through(product=product, discount=rng.choice(discounts)) for product in products if rng.random() < 0.2],
+            batch_size=BATCH_SIZE,
+        )
+
+    password = make_password(None)
+    users = User.objects.bulk_create(
+        [User(username=f'shopper{n}', email=f'shopper{n}@example.com', password=password)
+         for n in range(max(sizes['users'], 1))],
+        batch_size=BATCH_SIZE,
+    )
+    addresses = ShippingInfo.objects.bulk_create([
+        ShippingInfo(customer=user, country='US', city='Springfield', state='IL', zipcode=62701,
+                     address=f'{n} Main St', phone='2175550100', is_default=True)
+        for n, user in enumerate(users)
+    ], batch_size=BATCH_SIZE)
+    address_of = {address.customer_id: address for address in addresses}
+
+    orders = Order.objects.bulk_create([
+        Order(customer=customer, shipping_info=address_of[customer.id], complete=True,
+              transaction_id=f'benchmark-{n}', shipping_status='Delivered', payment_status='Completed')
+        for n, customer in ((n, rng.choice(users)) for n in range(sizes['orders']))
+    ], batch_size=BATCH_SIZE)
+    items = []
+    for order in orders:
+        for product in rng.sample(products, min(sizes['items_per_order'], len(products))):
+            items.append(OrderItem(order=order, product=product, quantity=rng.randint(1, 3),
+                                   price_at_purchase=product.price))
+    for batch in _batches(items):
+        OrderItem.objects.bulk_create(batch)
+
+    pairs = rng.sample(range(len(products) * len(users)), min(sizes['reviews'], len(products) * len(users)))
+    reviews = [
+        Review(product=products[pair % len(products)], user=users[pair // len(products)],
+               rating=rng.randint(1, 5), comment='Synthetic review.')
+        for pair in pairs
+    ]
+    for batch in _batches(reviews):
+        Review.objects.bulk_create(batch)
+
+    for command in ('rebuild_effective_prices', 'reconcile_ratings', 'repair_order_totals',
+                    'reconcile_category_counts', 'rebuild_search_index'):
+        call_command(command, stdout=StringIO())
+    invalidate_catalog()
+
+    user = users[0]
+    product = Product.objects.filter(stock__gt=0, digital=False).order_by('pk').first() or products[0]
+    order = Order.objects.filter(customer=user).order_by('pk').first()
+    return Dataset(
+        user=user,
+        product=product,
+        order=order,
+        shipping_info=address_of[user.id],
+        review=Review.objects.order_by('pk').first(),
+        search=product.name.split()[2],
+        category=product.category,
+    )
+
+
+def _fill_cart(dataset):
+    """Give the benchmark user an open cart of ``CART_SIZE`` items with a shipping address."""
+    order, _ = get_active_order(dataset.user)
+    if not order.item_count:
+        products = Product.objects.filter(stock__gt=0).order_by('pk').values_list('pk', flat=True)[:CART_SIZE]
+        update_cart(order, [(pk, 1) for pk in products])
+    Order.objects.filter(pk=order.pk).update(shipping_info=dataset.shipping_info)
+    # Restock so repeated orders never run the catalog dry.
+    Product.objects.filter(pk__in=order.orderitem_set.values('product')).update(stock=10 ** 6)
+    return order
+
+
+def build_endpoints(dataset):
+    """The endpoints to measure, in order; ``prepare`` builds fresh request data per iteration."""
+    product, order = dataset.product, dataset.order or _fill_cart(dataset)
+    category = f'&category={dataset.category.slug}' if dataset.category else ''
+
+    def toggle_item(iteration):
+        return {'productId': product.pk, 'action': 'add' if iteration % 2 == 0 else 'remove'}
+
+    def place_order(iteration):
+        cart = _fill_cart(dataset)
+        return {'form': {'total': str(compute_cart_summary(cart).total)}}
+
+    return [
+        Endpoint('catalog', 'get', reverse('store:store')),
+        Endpoint('catalog_filtered', 'get', f"{reverse('store:store')}?sort=price{category}&in_stock=1"),
+        Endpoint('catalog_search', 'get', f"{reverse('store:store')}?search={dataset.search}"),
+        Endpoint('catalog_signed_in', 'get', reverse('store:store'), signed_in=True),
+        Endpoint('product_detail', 'get', reverse('store:product_detail', args=[product.slug])),
+        Endpoint('product_detail_signed_in', 'get', reverse('store:product_detail', args=[product.slug]),
+                 signed_in=True),
+        Endpoint('cart', 'get', reverse('store:cart'), signed_in=True),
+        Endpoint('checkout', 'get', reverse('store:checkout'), signed_in=True),
+        Endpoint('update_item', 'post', reverse('store:update_item'), signed_in=True, prepare=toggle_item),
+        Endpoint('process_order', 'post', reverse('store:process_order'), signed_in=True, prepare=place_order),
+        Endpoint('api_root', 'get', reverse('store:api-root')),
+        Endpoint('api_categories', 'get', reverse('store:category-list')),
+        Endpoint('api_products', 'get', reverse('store:product-list')),
+        Endpoint('api_products_facets', 'get', f"{reverse('store:product-list')}?facets=1"),
+        Endpoint('api_product_detail', 'get', reverse('store:product-detail', args=[product.slug])),
+        Endpoint('api_product_reviews', 'get', reverse('store:product-reviews', args=[product.slug])),
+        Endpoint('api_orders', 'get', reverse('store:order-list'), signed_in=True),
+        Endpoint('api_order_detail', 'get', reverse('store:order-detail', args=[order.pk]), signed_in=True),
+        Endpoint('api_order_shipping_quotes', 'get',
+                 f"{reverse('store:order-shipping-quotes', args=[order.pk])}?country=US,CA,DE", signed_in=True),
+        Endpoint('api_shipping_info', 'get', reverse('store:shipping-info-list'), signed_in=True),
+        Endpoint('api_shipping_info_detail', 'get',
+                 reverse('store:shipping-info-detail', args=[dataset.shipping_info.pk]), signed_in=True),
+        Endpoint('api_reviews', 'get', reverse('store:review-list')),
+    ] + ([
+        Endpoint('api_review_detail', 'get', reverse('store:review-detail', args=[dataset.review.pk])),
+    ] if dataset.review else [])
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, ``q`` in 0..100."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def _request(client, endpoint, iteration):
+    """Send one request; ``prepare`` runs first, outside whatever the caller measures."""
+    data = endpoint.prepare(iteration) if endpoint.prepare else endpoint.data
+    if endpoint.method == 'get':
+        return lambda: client.get(endpoint.url, data)
+    return lambda: client.post(endpoint.url, data, content_type='application/json')
+
+
+def measure(endpoint, client, iterations, warmup=2, traced=3, cold=False):
+    """Time ``iterations`` requests to ``endpoint`` after ``warmup`` untimed ones."""
+    for iteration in range(warmup):
+        _request(client, endpoint, iteration)()
+
+    latencies, queries = [], []
+    for iteration in range(iterations):
+        send = _request(client, endpoint, iteration)
+        if cold:
+            invalidate_catalog()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = send()
+            latencies.append(time.perf_counter() - start)
+        queries.append(len(captured.captured_queries))
+        if response.status_code != 200:
+            raise BenchmarkError(f'{endpoint.name}: {endpoint.method.upper()} {endpoint.url} '
+                                 f'answered {response.status_code}')
+
+    peaks = []
+    for iteration in range(traced):
+        send = _request(client, endpoint, iteration)
+        if cold:
+            invalidate_catalog()
+        tracemalloc.start()
+        try:
+            send()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'method': endpoint.method.upper(),
+        'url': endpoint.url,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'queries': statistics.median_low(queries),
+        'queries_max': max(queries),
+        'alloc_peak_kib': round(statistics.median(peaks) / 1024, 1) if peaks else None,
+    }
+
+
+def run_benchmark(dataset, iterations=50, warmup=2, traced=3, cold=False, only=None, sizes=None):
+    """Measure every endpoint (or those named in ``only``) and return the JSON-ready results."""
+    anonymous, signed_in = Client(), Client()
+    signed_in.force_login(dataset.user)
+    _fill_cart(dataset)
+
+    endpoints = {}
+    for endpoint in build_endpoints(dataset):
+        if only and endpoint.name not in only:
+            continue
+        client = signed_in if endpoint.signed_in else anonymous
+        endpoints[endpoint.name] = measure(endpoint, client, iterations, warmup, traced, cold)
+
+    return {
+        'meta': {
+            'created': timezone.now().isoformat(),
+            'dataset': {**DATASET_DEFAULTS, **(sizes or {})},
+            'iterations': iterations,
+            'warmup': warmup,
+            'cold': cold,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        },
+        'endpoints': endpoints,
+    }
+
+
+def compare_results(results, baseline, tolerance=0.2):
+    """
+    Compare ``results`` with a ``baseline`` run. Returns a list of
+    ``(endpoint, metric, baseline value, current value)`` regressions: p95
+    latency more than ``tolerance`` slower, or any extra query.
+    """
+    regressions = []
+    for name, current in results['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if before is None:
+            continue
+        if current['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append((name, 'p95_ms', before['p95_ms'], current['p95_ms']))
+        if current['queries'] > before['queries']:
+            regressions.append((name, 'queries', before['queries'], current['queries']))
+    return regressions
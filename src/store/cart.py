@@ -0,0 +1,213 @@
+"""
+Cart service.
+
+``get_request_cart(request)`` returns a ``CartSummary`` (count, subtotal,
+shipping, total) that is computed at most once per request and cached across
+requests under the order id, guarded by a version that every cart mutation
+bumps.
+
+``update_cart(order, changes)`` is the only mutation path: each change is a
+conditional ``UPDATE ... SET quantity = quantity + n`` that checks stock in
+the same statement, and the new totals are read back from the order's
+denormalized columns instead of being re-aggregated.
+"""
+import time
+import uuid
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Subquery, Sum, Value
+
+from .models import Order, OrderItem, Product
+
+CART_SUMMARY_TIMEOUT = 15 * 60
+
+
+def get_active_order(user):
+    """Return (order, created) for the user's current open cart."""
+    return Order.objects.get_or_create(
+        customer=user,
+        complete=False,
+        defaults={'transaction_id': str(uuid.uuid4())}
+    )
+
+
+def cart_version_key(order_id):
+    return f'cart_{order_id}_version'
+
+
+def cart_summary_key(order_id):
+    return f'cart_{order_id}_summary'
+
+
+def bump_cart_version(order_id):
+    """Invalidate the cached summary of ``order_id``."""
+    try:
+        cache.incr(cart_version_key(order_id))
+    except ValueError:
+        cache.set(cart_version_key(order_id), time.time_ns() // 1000, CART_SUMMARY_TIMEOUT)
+
+
+class CartSummary:
+    def __init__(self, order=None, count=0, subtotal=Decimal('0.00'),
+                 shipping=Decimal('0.00'), physical_lines=0):
+        self.order = order
+        self.count = count
+        self.subtotal = subtotal
+        self.shipping = shipping
+        self.physical_lines = physical_lines
+
+    @property
+    def total(self):
+        return self.subtotal + self.shipping
+
+    @property
+    def requires_shipping(self):
+        return self.physical_lines > 0
+
+    def as_tuple(self):
+        return self.count, self.subtotal, self.shipping, self.physical_lines
+
+
+def compute_cart_summary(order):
+    """Aggregate the whole summary of ``order`` in one query."""
+    result = order.orderitem_set.aggregate(
+        count=Sum('quantity'),
+        subtotal=Sum(F('price_at_purchase') * F('quantity')),
+        physical_lines=Count('id', filter=Q(product__digital=False)),
+    )
+    return CartSummary(
+        order=order,
+        count=result['count'] or 0,
+        subtotal=result['subtotal'] or Decimal('0.00'),
+        shipping=order.shipping_cost,
+        physical_lines=result['physical_lines'],
+    )
+
+
+def get_cart_summary(order):
+    """Return the summary of ``order``, from the cache when its version still matches."""
+    version_key, summary_key = cart_version_key(order.id), cart_summary_key(order.id)
+    cached = cache.get_many([version_key, summary_key])
+    version = cached.get(version_key)
+    if summary_key in cached and cached[summary_key][0] == version:
+        return CartSummary(order, *cached[summary_key][1])
+
+    summary = compute_cart_summary(order)
+    cache.set(summary_key, (version, summary.as_tuple()), CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def get_request_cart(request):
+    """Return the cart summary for ``request``, computing it at most once."""
+    cart = getattr(request, '_cart_summary', None)
+    if cart is None:
+        if request.user.is_authenticated:
+            order, _ = get_active_order(request.user)
+            cart = get_cart_summary(order)
+        else:
+            cart = CartSummary()
+        request._cart_summary = cart
+    return cart
+
+
+OUT_OF_STOCK = 'out_of_stock'
+NOT_FOUND = 'not_found'
+
+
+class CartTotals(namedtuple('CartTotals', ['count', 'subtotal', 'shipping'])):
+    __slots__ = ()
+
+    @property
+    def total(self):
+        return self.subtotal + self.shipping
+
+
+CartUpdate = namedtuple('CartUpdate', ['totals', 'rejected'])
+
+
+def _shift_line(order, product_id, delta):
+    """
+    Move an existing line's quantity by ``delta`` in one conditional UPDATE
+    (additions must fit in stock, removals must leave at least one) and
+    shift the order totals to match. Returns whether a row changed.
+    """
+    lines = OrderItem.objects.filter(order=order, product_id=product_id)
+    if delta > 0:
+        condition = Q(product__stock__gte=F('quantity') + delta)
+    else:
+        condition = Q(quantity__gt=-delta)
+    if not lines.filter(condition).update(quantity=F('quantity') + delta):
+        return False
+    line_price = Subquery(lines.values('price_at_purchase')[:1])
+    Order.objects.filter(pk=order.pk).update(
+        item_count=F('item_count') + delta,
+        items_subtotal=F('items_subtotal') + line_price * Value(delta),
+    )
+    return True
+
+
+def _add(order, product_id, delta):
+    if _shift_line(order, product_id, delta):
+        return None
+    if OrderItem.objects.filter(order=order, product_id=product_id).exists():
+        return OUT_OF_STOCK
+
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None:
+        return NOT_FOUND
+    if product.stock < delta:
+        return OUT_OF_STOCK
+    try:
+        with transaction.atomic():
+            OrderItem.objects.create(order=order, product=product, quantity=delta)
+    except IntegrityError:
+        # A concurrent request created the line first; increment it instead.
+        if not _shift_line(order, product_id, delta):
+            return OUT_OF_STOCK
+    return None
+
+
+def _remove(order, product_id, delta):
+    if _shift_line(order, product_id, delta):
+        return None
+    # Removing the whole quantity drops the line; the post_delete receiver
+    # releases its share of the order totals.
+    for line in OrderItem.objects.select_for_update().filter(order=order, product_id=product_id):
+        line.delete()
+    return None
+
+
+def update_cart(order, changes):
+    """
+    Apply ``(product_id, delta)`` changes to ``order`` in one transaction.
+
+    Deltas for the same product are merged first. Additions that would exceed
+    stock and unknown products are skipped and reported in ``rejected``
+    (``{product_id: reason}``); the rest still apply.
+    """
+    merged = defaultdict(int)
+    for product_id, delta in changes:
+        merged[product_id] += delta
+
+    rejected = {}
+    with transaction.atomic():
+        # A fixed order keeps concurrent batches from deadlocking on row locks.
+        for product_id in sorted(merged):
+            delta = merged[product_id]
+            if delta > 0:
+                reason = _add(order, product_id, delta)
+            elif delta < 0:
+                reason = _remove(order, product_id, delta)
+            else:
+                continue
+            if reason:
+                rejected[product_id] = reason
+        totals = CartTotals(*Order.objects.values_list(
+            'item_count', 'items_subtotal', 'shipping_cost'
+        ).get(pk=order.pk))
+
+    bump_cart_version(order.id)
+    return CartUpdate(totals, rejected)
@@ -0,0 +1,383 @@
+"""
+Bulk catalog import and export as CSV or JSON Lines.
+
+One row per product, keyed by ``slug`` (derived from ``name`` when absent)::
+
+    slug,name,description,price,category,digital,stock,discounts
+    oak-desk,Oak Desk,Solid oak.,249.00,Furniture,false,12,Spring Sale|Clearance
+
+Imports read the stream lazily and work through it in batches of
+``batch_size`` rows, so memory stays constant however large the file is.
+Each batch is one transaction:
+
+- categories named in the batch are created if missing;
+- products are upserted with ``bulk_create(update_conflicts=True)`` on
+  ``slug``; a column missing from a row leaves that field of an existing
+  product alone (a CSV's header decides it for the whole file), so
+  ``slug,stock`` is a valid stock update. New products need a ``name`` and
+  a ``price``;
+- a ``discounts`` column replaces the product's discount links (by discount
+  name; ``|`` separated);
+- effective prices and the search index are refreshed for the batch's
+  products with one statement each.
+
+``Product.save()`` and the model signals never run. What they would have
+done per product happens once at the end instead: category counts are
+recounted for the categories touched, and every cached price and catalog
+page is expired by bumping the pricing generation and catalog version.
+
+A row that does not validate is skipped and reported with its line number;
+the rest of the import goes on.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import validate_slug
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+
+from .models import (
+    Category, Discount, Product, bump_pricing_generation, recount_categories, refresh_effective_prices,
+)
+from .page_cache import invalidate_catalog
+from .search import get_search_backend
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+COLUMNS = ('slug', 'name', 'description', 'price', 'category', 'digital', 'stock', 'discounts')
+DISCOUNT_SEPARATOR = '|'
+DEFAULT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 100
+
+_TRUE = {'1', 'true', 'yes', 'y', 't'}
+_FALSE = {'0', 'false', 'no', 'n', 'f', ''}
+
+
+class CatalogFormatError(Exception):
+    pass
+
+
+def format_for(filename, default='csv'):
+    """Guess the format from a file name's extension."""
+    for file_format in FORMATS:
+        if filename.lower().endswith(f'.{file_format}'):
+            return file_format
+    if filename.lower().endswith(('.ndjson', '.json')):
+        return 'jsonl'
+    return default
+
+
+def read_rows(stream, file_format):
+    """Yield ``(line number, row dict)`` from a text stream, one row at a time."""
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        unknown = set(reader.fieldnames or ()) - set(COLUMNS)
+        if unknown:
+            raise CatalogFormatError(f'Unknown column(s): {", ".join(sorted(unknown))}')
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield number, exc
+                continue
+            yield number, row
+    else:
+        raise CatalogFormatError(f'Unknown format {file_format!r}; use one of {", ".join(FORMATS)}.')
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f'not a boolean: {value!r}')
+
+
+def clean_row(row):
+    """
+    Validate one row; returns ``(fields, category name, discount names)``
+    where ``fields`` only holds the product columns present in the row.
+    """
+    if not isinstance(row, dict):
+        raise ValueError('expected an object')
+    unknown = set(row) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f'unknown field(s): {", ".join(sorted(unknown))}')
+
+    fields = {}
+    if 'name' in row:
+        name = str(row['name'] or '').strip()
+        if not name or len(name) > Product._meta.get_field('name').max_length:
+            raise ValueError('name cannot be blank and is at most 100 characters')
+        fields['name'] = name
+    fields['slug'] = str(row.get('slug') or '').strip() or slugify(fields.get('name', ''))
+    if not fields['slug']:
+        raise ValueError('a slug or a name is required')
+    try:
+        validate_slug(fields['slug'])
+    except ValidationError:
+        raise ValueError(f'invalid slug {fields["slug"]!r}')
+
+    if 'description' in row:
+        fields['description'] = str(row['description'] or '')[:Product._meta.get_field('description').max_length]
+    if 'price' in row:
+        try:
+            price = Decimal(str(row['price']).strip())
+        except InvalidOperation:
+            raise ValueError(f'invalid price {row["price"]!r}')
+        if not price.is_finite() or price < 0 or price >= Decimal('1000000'):
+            raise ValueError(f'price out of range: {price}')
+        fields['price'] = price.quantize(Decimal('0.01'))
+    if 'digital' in row:
+        fields['digital'] = _boolean(row['digital'])
+    if 'stock' in row:
+        stock = int(str(row['stock'] or 0).strip())
+        if stock < 0:
+            raise ValueError('stock cannot be negative')
+        fields['stock'] = stock
+
+    category = None
+    if 'category' in row:
+        category = str(row['category'] or '').strip()
+        if len(category) > Category._meta.get_field('name').max_length:
+            raise ValueError('category names are at most 50 characters')
+        fields['category'] = category
+    discounts = None
+    if 'discounts' in row:
+        value = row['discounts'] or []
+        if isinstance(value, str):
+            value = value.split(DISCOUNT_SEPARATOR)
+        discounts = [str(name).strip() for name in value if str(name).strip()]
+    return fields, category, discounts
+
+
+class CatalogImport:
+    """State of one import: counters, reported errors and the categories it touched."""
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.touched_categories = set()
+        self.search = get_search_backend()
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def summary(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+    def run(self, rows):
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            self.import_batch(batch)
+        self.finish()
+        return self.summary()
+
+    def import_batch(self, batch):
+        cleaned = {}
+        for line, row in batch:
+            try:
+                if isinstance(row, Exception):
+                    raise ValueError(f'invalid JSON: {row}')
+                fields, category, discounts = clean_row(row)
+            except (TypeError, ValueError) as exc:
+                self.error(line, str(exc))
+                continue
+            # The last row for a slug wins, as if the rows were applied in order.
+            cleaned[fields['slug']] = (line, fields, category, discounts)
+        if not cleaned:
+            return
+
+        try:
+            with transaction.atomic():
+                self._apply(cleaned)
+        except IntegrityError as exc:
+            # Typically a name already used by a product under another slug.
+            for line, *_ in cleaned.values():
+                self.error(line, f'batch rejected: {exc}')
+
+    def _apply(self, cleaned):
+        categories = self._category_ids({category for _, _, category, _ in cleaned.values() if category})
+        discount_names = {name for _, _, _, names in cleaned.values() for name in names or ()}
+        discounts = dict(Discount.objects.filter(name__in=discount_names).order_by('pk').values_list('name', 'pk'))
+
+        names = [fields['name'] for _, fields, _, _ in cleaned.values() if 'name' in fields]
+        taken = dict(
+            Product.objects.filter(name__in=names).exclude(slug__in=cleaned).values_list('name', 'slug')
+        )
+        existing = {
+            slug: (category_id, name, price) for slug, category_id, name, price in
+            Product.objects.filter(slug__in=cleaned).values_list('slug', 'category_id', 'name', 'price')
+        }
+
+        groups = {}
+        for slug, (line, fields, category, names) in list(cleaned.items()):
+            problem = None
+            if slug not in existing and not {'name', 'price'} <= set(fields):
+                problem = 'a new product needs a name and a price'
+            elif fields.get('name') in taken:
+                problem = f'name {fields["name"]!r} is already used by {taken[fields["name"]]!r}'
+            elif category and category not in categories:
+                problem = f'category {category!r} could not be created'
+            else:
+                missing = [name for name in names or () if name not in discounts]
+                if missing:
+                    problem = f'unknown discount(s): {", ".join(missing)}'
+            if problem:
+                self.error(line, problem)
+                del cleaned[slug]
+                continue
+            if 'category' in fields:
+                fields['category_id'] = categories.get(fields.pop('category'))
+            groups.setdefault(frozenset(fields), []).append(fields)
+        if not cleaned:
+            return
+        # Rejected rows neither count nor touch their product's category.
+        existing = {slug: values for slug, values in existing.items() if slug in cleaned}
+
+        self.touched_categories.update(category_id for category_id, _, _ in existing.values())
+        for columns, rows in groups.items():
+            update_fields = sorted(columns - {'slug'}) + ['updated_at']
+            if 'price' in columns:
+                update_fields.append('effective_price')
+            Product.objects.bulk_create(
+                [self._product(fields, existing.get(fields['slug'])) for fields in rows],
+                update_conflicts=True, unique_fields=['slug'], update_fields=update_fields,
+            )
+        ids = dict(Product.objects.filter(slug__in=cleaned).values_list('slug', 'pk'))
+        self.touched_categories.update(
+            fields['category_id'] for _, fields, _, _ in cleaned.values() if 'category_id' in fields
+        )
+
+        linked = {slug: names for slug, (_, _, _, names) in cleaned.items() if names is not None}
+        if linked:
+            Through = Product.discount.through
+            Through.objects.filter(product_id__in=[ids[slug] for slug in linked]).delete()
+            Through.objects.bulk_create([
+                Through(product_id=ids[slug], discount_id=discounts[name])
+                for slug, names in linked.items() for name in set(names)
+            ], ignore_conflicts=True)
+
+        refresh_effective_prices(Product.objects.filter(pk__in=ids.values()))
+        self.search.index(ids.values())
+        self.created += len(cleaned) - len(existing)
+        self.updated += len(existing)
+
+    @staticmethod
+    def _product(fields, existing):
+        """
+        The row to upsert. Columns the file leaves out keep the existing
+        product's values, which are inserted but not in ``update_fields``.
+        """
+        if existing is not None:
+            _, name, price = existing
+            fields = {'name': name, 'price': price, **fields}
+        return Product(effective_price=fields['price'], **fields)
+
+    def _category_ids(self, names):
+        """``{name: id}`` of the named categories, creating the missing ones."""
+        if not names:
+            return {}
+        found = dict(Category.objects.filter(name__in=names).values_list('name', 'pk'))
+        missing = names - set(found)
+        if missing:
+            Category.objects.bulk_create(
+                [Category(name=name, slug=slugify(name)) for name in missing], ignore_conflicts=True,
+            )
+            found.update(Category.objects.filter(name__in=missing).values_list('name', 'pk'))
+        return found
+
+    def finish(self):
+        self.touched_categories.discard(None)
+        if self.touched_categories:
+            recount_categories(Category.objects.filter(pk__in=self.touched_categories))
+        if self.created or self.updated:
+            bump_pricing_generation()
+            invalidate_catalog()
+
+
+def import_catalog(stream, file_format, batch_size=DEFAULT_BATCH_SIZE):
+    """Import the rows of a text ``stream``; returns the summary of ``CatalogImport``."""
+    return CatalogImport(batch_size).run(read_rows(stream, file_format))
+
+
+class _Echo:
+    """File-like object whose ``write`` hands back the line, for streaming csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _export_rows(chunk_size):
+    products = (
+        Product.objects.select_related('category').prefetch_related('discount')
+        .order_by('pk').iterator(chunk_size=chunk_size)
+    )
+    for product in products:
+        yield {
+            'slug': product.slug,
+            'name': product.name,
+            'description': product.description,
+            'price': str(product.price),
+            'category': product.category.name if product.category else '',
+            'digital': product.digital,
+            'stock': product.stock,
+            'discounts': sorted(discount.name for discount in product.discount.all()),
+        }
+
+
+def stream_lines(file_format, columns, rows):
+    """
+    Yield dict ``rows`` as text lines: CSV with a header of ``columns``, or
+    JSON Lines (decimals and dates as strings).
+    """
+    if file_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow([row[column] for column in columns])
+    elif file_format == 'jsonl':
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+    else:
+        raise CatalogFormatError(f'Unknown format {file_format!r}; use one of {", ".join(FORMATS)}.')
+
+
+def _csv_row(row):
+    row['digital'] = 'true' if row['digital'] else 'false'
+    row['discounts'] = DISCOUNT_SEPARATOR.join(row['discounts'])
+    return row
+
+
+def export_catalog(file_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the whole catalog as CSV or JSON Lines text, one line at a time."""
+    rows = _export_rows(chunk_size)
+    if file_format == 'csv':
+        rows = map(_csv_row, rows)
+    return stream_lines(file_format, COLUMNS, rows)
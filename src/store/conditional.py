@@ -0,0 +1,54 @@
+"""
+Conditional GET (``ETag`` / ``Last-Modified``) for product pages and the
+products API.
+
+Validators never come from the objects themselves, so a request whose
+``If-None-Match`` or ``If-Modified-Since`` still matches gets a 304 before
+anything is loaded, rendered or serialized. A single product is validated by
+one indexed ``updated_at`` lookup (every write that changes what a product
+shows stamps it, including the bulk UPDATEs for ratings, stock and effective
+prices); lists and rendered pages by the catalog and stock versions, two
+cache reads.
+
+Discounted prices also change when a discount passes its expiry date, with
+no write at all, so each ETag includes the pricing generation and today's
+date, and Last-Modified is never earlier than today's midnight.
+"""
+import hashlib
+from datetime import datetime, time as dt_time
+
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from .models import get_pricing_generation
+
+
+def make_etag(*parts):
+    parts = (timezone.localdate().isoformat(), get_pricing_generation()) + parts
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def _last_modified(updated_at):
+    midnight = timezone.make_aware(datetime.combine(timezone.localdate(), dt_time.min))
+    return int(max(updated_at, midnight).timestamp())
+
+
+def product_validators(updated_at):
+    """``(etag, last_modified)`` of a single product last changed at ``updated_at``."""
+    return make_etag(updated_at.isoformat()), _last_modified(updated_at)
+
+
+def not_modified(request, etag, last_modified=None):
+    """Return the 304 (or 412) answer to a conditional GET/HEAD that still matches, else None."""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified=None):
+    if response.status_code == 200:
+        response.headers.setdefault('ETag', etag)
+        if last_modified is not None:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+    return response
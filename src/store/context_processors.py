@@ -1,13 +1,13 @@
-import uuid
-from .models import Order
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_request_cart
+from .navigation import get_category_navigation
+
 
 def cart_items(request):
-    cartItems = 0
-    if request.user.is_authenticated:
-        order, created = Order.objects.get_or_create(
-            customer=request.user,
-            complete=False,
-            defaults={'transaction_id': str(uuid.uuid4())}
-        )
-        cartItems = order.get_cart_items
-    return {'cartItems': cartItems}
\ No newline at end of file
+    cart = get_request_cart(request)
+    return {'cart': cart, 'cartItems': cart.count}
+
+
+def category_navigation(request):
+    return {'category_nav': SimpleLazyObject(get_category_navigation)}
@@ -0,0 +1,139 @@
+"""
+Catalog facets: filter products by category, price band, rating, format,
+availability and discount, with a live count for every option.
+
+All counts for the current filter set come from one aggregate query with a
+``COUNT(*) FILTER (WHERE ...)`` per option. As usual for facets, an option's
+count applies every selected filter except its own facet's, so the other
+options of that facet stay selectable. Options only test columns of
+``store_product`` (categories by id, discounts through ``effective_price``),
+and the ``product_facets_idx`` covering index holds all of them, so on
+Postgres the aggregate is an index-only scan that never reads product rows.
+Results are cached under the catalog version, like the pages showing them.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, F, Q
+
+from .navigation import get_category_navigation
+from .page_cache import catalog_cache_key, catalog_cache_timeout
+
+Facet = namedtuple('Facet', ['name', 'label', 'multiple', 'options'])
+Option = namedtuple('Option', ['value', 'label', 'condition'])
+
+PRICE_BANDS = ((0, 25), (25, 50), (50, 100), (100, 250), (250, None))
+RATING_THRESHOLDS = (4, 3, 2, 1)
+FACET_PARAMS = ('category', 'price', 'rating', 'digital', 'in_stock', 'on_sale')
+
+
+def _price_option(low, high):
+    condition = Q(effective_price__gte=Decimal(low))
+    if high is None:
+        return Option(f'{low}-', f'${low} and up', condition)
+    return Option(f'{low}-{high}', f'${low} to ${high}', condition & Q(effective_price__lt=Decimal(high)))
+
+
+def get_facets():
+    """The facet definitions; category options come from the navigation cache."""
+    return (
+        Facet('category', 'Category', True, tuple(
+            Option(entry.slug, entry.name, Q(category_id=entry.id)) for entry in get_category_navigation()
+        )),
+        Facet('price', 'Price', True, tuple(_price_option(low, high) for low, high in PRICE_BANDS)),
+        Facet('rating', 'Rating', False, tuple(
+            Option(str(stars), f'{stars} stars and up', Q(rating__gte=stars)) for stars in RATING_THRESHOLDS
+        )),
+        Facet('digital', 'Format', False, (
+            Option('0', 'Physical', Q(digital=False)),
+            Option('1', 'Digital', Q(digital=True)),
+        )),
+        Facet('in_stock', 'Availability', False, (Option('1', 'In stock', Q(stock__gt=0)),)),
+        Facet('on_sale', 'Offers', False, (Option('1', 'On sale', Q(effective_price__lt=F('price'))),)),
+    )
+
+
+def selected_values(params, facet):
+    values = [value for value in params.getlist(facet.name) if value != '']
+    return values if facet.multiple else values[:1]
+
+
+def _selected_conditions(params, facets):
+    """``{facet name: Q}`` for every facet with a selection; unknown values match nothing."""
+    conditions = {}
+    for facet in facets:
+        values = selected_values(params, facet)
+        if not values:
+            continue
+        condition = Q(pk__in=[])
+        for option in facet.options:
+            if option.value in values:
+                condition |= option.condition
+        conditions[facet.name] = condition
+    return conditions
+
+
+def filter_facets(queryset, params, facets=None):
+    """Narrow ``queryset`` by every facet selected in ``params``."""
+    if not any(name in params for name in FACET_PARAMS):
+        return queryset
+    facets = get_facets() if facets is None else facets
+    for condition in _selected_conditions(params, facets).values():
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def cached_facet_counts(queryset, params, parts, facets=None):
+    """``facet_counts()`` cached under the catalog version; ``parts`` identify ``queryset``."""
+    key = catalog_cache_key('facets', (parts, [(name, params.getlist(name)) for name in FACET_PARAMS]))
+    counts = cache.get(key)
+    if counts is None:
+        counts = facet_counts(queryset, params, facets)
+        cache.set(key, counts, catalog_cache_timeout())
+    return counts
+
+
+def facet_counts(queryset, params, facets=None):
+    """
+    Count every option of every facet over ``queryset`` (the products before
+    any facet filter) in a single aggregate query.
+
+    Returns ``{'total': n, 'facets': [...]}`` where each facet is a dict of
+    ``name``, ``label`` and ``options`` (``value``, ``label``, ``count``,
+    ``selected``), in definition order.
+    """
+    facets = get_facets() if facets is None else facets
+    selected = _selected_conditions(params, facets)
+
+    def others(name):
+        condition = Q()
+        for facet_name, facet_condition in selected.items():
+            if facet_name != name:
+                condition &= facet_condition
+        return condition
+
+    aggregates = {'total': Count('pk', filter=others(None))}
+    for index, facet in enumerate(facets):
+        rest = others(facet.name)
+        for position, option in enumerate(facet.options):
+            aggregates[f'f{index}_{position}'] = Count('pk', filter=rest & option.condition)
+    counts = queryset.order_by().aggregate(**aggregates)
+
+    result = []
+    for index, facet in enumerate(facets):
+        values = selected_values(params, facet)
+        result.append({
+            'name': facet.name,
+            'label': facet.label,
+            'options': [
+                {
+                    'value': option.value,
+                    'label': option.label,
+                    'count': counts[f'f{index}_{position}'],
+                    'selected': option.value in values,
+                }
+                for position, option in enumerate(facet.options)
+            ],
+        })
+    return {'total': counts['total'], 'facets': result}
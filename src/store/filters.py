@@ -0,0 +1,33 @@
+from decimal import Decimal, InvalidOperation
+
+from rest_framework import filters
+
+from .search import search_products
+
+
+def _parse_price(value):
+    try:
+        return Decimal(value) if value not in (None, '') else None
+    except InvalidOperation:
+        return None
+
+
+def filter_by_price_range(queryset, params):
+    """Narrow products by ``min_price``/``max_price`` on the indexed effective price."""
+    min_price = _parse_price(params.get('min_price'))
+    max_price = _parse_price(params.get('max_price'))
+    if min_price is not None:
+        queryset = queryset.filter(effective_price__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(effective_price__lte=max_price)
+    return queryset
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """DRF ``?search=`` backed by the full-text index instead of ``icontains`` scans."""
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        return search_products(queryset, query)
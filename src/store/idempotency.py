@@ -0,0 +1,213 @@
+"""
+``Idempotency-Key`` support for views that must not run twice.
+
+The first request with a given key (per user) claims an ``IdempotencyKey``
+row, runs the view and stores its response in the row and in the cache.
+Duplicates within ``IDEMPOTENCY_WINDOW`` get that response replayed, usually
+straight from the cache. A duplicate that arrives while the first request is
+still running waits for it (up to ``IDEMPOTENCY_WAIT_SECONDS``) instead of
+executing again. 5xx responses and exceptions release the key so that the
+client can retry for real.
+"""
+import asyncio
+import hashlib
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+
+CLAIMED, REPLAY, IN_FLIGHT, MISMATCH = 'claimed', 'replay', 'in_flight', 'mismatch'
+
+
+def idempotency_window():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_WINDOW', 24 * 3600))
+
+
+def _lock_duration():
+    # How long a crashed first request can hold the key before a retry takes over.
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 60))
+
+
+def _wait_seconds():
+    return getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 10)
+
+
+def idempotency_cache_key(user_id, key):
+    return f'idempotency_{user_id}_{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.get_full_path().encode(), request.body):
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _stored(entry, fingerprint):
+    """Turn a stored ``(fingerprint, status, content_type, body)`` into an outcome."""
+    if entry[0] != fingerprint:
+        return MISMATCH, None
+    return REPLAY, entry[1:]
+
+
+def claim(user_id, key, fingerprint):
+    """
+    Try to become the request that runs for ``key``.
+
+    Returns ``(CLAIMED, record)``, ``(REPLAY, (status, content_type, body))``,
+    ``(IN_FLIGHT, None)`` or ``(MISMATCH, None)``.
+    """
+    cached = cache.get(idempotency_cache_key(user_id, key))
+    if cached is not None:
+        return _stored(cached, fingerprint)
+
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                user_id=user_id, key=key, fingerprint=fingerprint, locked_until=now + _lock_duration(),
+            )
+        return CLAIMED, record
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+    if record is None:
+        return IN_FLIGHT, None  # Released a moment ago; the next poll claims it.
+
+    # A finished key past its window, or a claim whose request died, is reusable.
+    reusable = (
+        Q(status_code__isnull=False, created_at__lt=now - idempotency_window())
+        | Q(status_code__isnull=True, locked_until__lt=now)
+    )
+    if IdempotencyKey.objects.filter(reusable, pk=record.pk).update(
+        fingerprint=fingerprint, status_code=None, content_type='', body='',
+        created_at=now, locked_until=now + _lock_duration(),
+    ):
+        record.refresh_from_db()
+        return CLAIMED, record
+
+    if record.status_code is None:
+        return IN_FLIGHT, None
+    entry = (record.fingerprint, record.status_code, record.content_type, record.body)
+    _cache_entry(record, entry)
+    return _stored(entry, fingerprint)
+
+
+def _cache_entry(record, entry):
+    remaining = record.created_at + idempotency_window() - timezone.now()
+    if remaining.total_seconds() > 0:
+        cache.set(idempotency_cache_key(record.user_id, record.key), entry, int(remaining.total_seconds()))
+
+
+def complete(record, response):
+    """Store ``response`` as the answer for ``record``, or release the key on a server error."""
+    if response.status_code >= 500 or response.streaming:
+        release(record)
+        return
+    body = response.content.decode(response.charset or 'utf-8')
+    content_type = response.get('Content-Type', '')
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        status_code=response.status_code, content_type=content_type, body=body, locked_until=None,
+    )
+    _cache_entry(record, (record.fingerprint, response.status_code, content_type, body))
+
+
+def release(record):
+    IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).delete()
+
+
+def replay(stored):
+    status, content_type, body = stored
+    response = HttpResponse(body, status=status, content_type=content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _rejected(outcome):
+    if outcome == MISMATCH:
+        return JsonResponse(
+            {'error': 'Idempotency-Key was already used for a different request'}, status=422,
+        )
+    return JsonResponse(
+        {'error': 'A request with this Idempotency-Key is still being processed'}, status=409,
+    )
+
+
+class IdempotencyMixin:
+    """
+    Honour ``Idempotency-Key`` on ``idempotent_methods``. Put it after the
+    login mixin: keys are scoped to ``request.user``.
+    """
+    idempotent_methods = ('POST',)
+
+    def _idempotency_key(self, request):
+        if request.method not in self.idempotent_methods:
+            return None
+        return request.META.get(HEADER) or None
+
+    def dispatch(self, request, *args, **kwargs):
+        key = self._idempotency_key(request)
+        if self.view_is_async:
+            return self._adispatch(key, request, *args, **kwargs)
+        if key is None:
+            return super().dispatch(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'error': 'Idempotency-Key is too long'}, status=400)
+
+        fingerprint = request_fingerprint(request)
+        deadline = time.monotonic() + _wait_seconds()
+        outcome, value = claim(request.user.pk, key, fingerprint)
+        while outcome == IN_FLIGHT and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            outcome, value = claim(request.user.pk, key, fingerprint)
+
+        if outcome == REPLAY:
+            return replay(value)
+        if outcome != CLAIMED:
+            return _rejected(outcome)
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except BaseException:
+            release(value)
+            raise
+        complete(value, response)
+        return response
+
+    async def _adispatch(self, key, request, *args, **kwargs):
+        if key is None:
+            return await super().dispatch(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'error': 'Idempotency-Key is too long'}, status=400)
+
+        fingerprint = request_fingerprint(request)
+        deadline = time.monotonic() + _wait_seconds()
+        outcome, value = await sync_to_async(claim)(request.user.pk, key, fingerprint)
+        while outcome == IN_FLIGHT and time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            outcome, value = await sync_to_async(claim)(request.user.pk, key, fingerprint)
+
+        if outcome == REPLAY:
+            return replay(value)
+        if outcome != CLAIMED:
+            return _rejected(outcome)
+        try:
+            response = await super().dispatch(request, *args, **kwargs)
+        except BaseException:
+            await sync_to_async(release)(value)
+            raise
+        await sync_to_async(complete)(value, response)
+        return response
@@ -0,0 +1,262 @@
+"""
+Per-request instrumentation: SQL, cache and latency metrics per view.
+
+``InstrumentationMiddleware`` (store.middleware) records every request into a
+``RequestRecorder``: queries and their time through the database execute
+wrappers, cache hits and misses through the cache backends' ``get`` and
+``get_many``, and the total latency. The result is folded into the
+process-wide ``registry`` under the resolved view name. The registry keeps
+cumulative Prometheus histograms plus a rolling window of recent samples per
+view, for percentiles that reflect current behaviour instead of the whole
+uptime.
+
+A query that runs more than once in the same request is reported by its
+fingerprint, the SQL with parameters, literals and ``IN`` list lengths
+normalised away.
+That is usually an N+1.
+
+Metrics are per process; a scraper sums them across workers.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+
+from django.core.cache import caches
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+ROLLING_WINDOW = 500
+QUANTILES = (0.5, 0.9, 0.99)
+# Per view; the fingerprints repeated most often win when it is full.
+MAX_FINGERPRINTS = 20
+EXPORTED_FINGERPRINTS = 5
+
+_IN_LIST_RE = re.compile(r'\((?:%s|\?)(?:\s*,\s*(?:%s|\?))*\)')
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+_active = ContextVar('store_instrumentation_recorder', default=None)
+
+
+def fingerprint(sql):
+    """Identify a statement independently of its parameters."""
+    normalised = _LITERAL_RE.sub('?', _IN_LIST_RE.sub('(...)', sql))
+    return hashlib.md5(normalised.encode()).hexdigest()[:12], normalised
+
+
+class RequestRecorder:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.samples = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+            key, normalised = fingerprint(sql)
+            self.statements[key] += 1
+            self.samples.setdefault(key, normalised)
+
+    def duplicates(self):
+        """``{fingerprint: executions}`` of statements run more than once."""
+        return {key: count for key, count in self.statements.items() if count > 1}
+
+    def activate(self):
+        return _active.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _active.reset(token)
+
+
+_MISSING = object()
+
+
+def _instrument_cache_class(cls):
+    """Count hits and misses of ``get``/``get_many`` on one cache backend class."""
+    if getattr(cls, '_store_instrumented', False):
+        return
+    original_get, original_get_many = cls.get, cls.get_many
+
+    def get(self, key, default=None, version=None):
+        value = original_get(self, key, _MISSING, version=version)
+        recorder = _active.get()
+        if recorder is not None:
+            if value is _MISSING:
+                recorder.cache_misses += 1
+            else:
+                recorder.cache_hits += 1
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = original_get_many(self, keys, version=version)
+        recorder = _active.get()
+        if recorder is not None:
+            recorder.cache_hits += len(found)
+            recorder.cache_misses += len(keys) - len(found)
+        return found
+
+    cls.get, cls.get_many = get, get_many
+    cls._store_instrumented = True
+
+
+def instrument_caches():
+    from django.conf import settings
+
+    for alias in settings.CACHES:
+        _instrument_cache_class(type(caches[alias]))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.total += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_seconds = 0.0
+        self.duplicate_queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.fingerprints = Counter()
+        self.fingerprint_sql = {}
+        # (latency seconds, queries) of the most recent requests.
+        self.recent = deque(maxlen=ROLLING_WINDOW)
+
+
+def _quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(ViewMetrics)
+
+    def record(self, view, latency, recorder):
+        duplicates = recorder.duplicates()
+        with self._lock:
+            metrics = self._views[view]
+            metrics.requests += 1
+            metrics.latency.observe(latency)
+            metrics.queries.observe(recorder.queries)
+            metrics.sql_seconds += recorder.sql_time
+            metrics.duplicate_queries += sum(count - 1 for count in duplicates.values())
+            metrics.cache_hits += recorder.cache_hits
+            metrics.cache_misses += recorder.cache_misses
+            metrics.recent.append((latency, recorder.queries))
+            for key, count in duplicates.items():
+                metrics.fingerprints[key] += count
+                metrics.fingerprint_sql.setdefault(key, recorder.samples[key])
+            if len(metrics.fingerprints) > MAX_FINGERPRINTS:
+                keep = dict(metrics.fingerprints.most_common(MAX_FINGERPRINTS))
+                metrics.fingerprints = Counter(keep)
+                metrics.fingerprint_sql = {key: metrics.fingerprint_sql[key] for key in keep}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def snapshot(self):
+        """Plain-data view of every view's metrics, with rolling-window quantiles."""
+        with self._lock:
+            result = {}
+            for view, metrics in self._views.items():
+                latencies = [latency for latency, _ in metrics.recent]
+                queries = [count for _, count in metrics.recent]
+                result[view] = {
+                    'requests': metrics.requests,
+                    'queries': metrics.queries.sum,
+                    'sql_seconds': metrics.sql_seconds,
+                    'latency_seconds': metrics.latency.sum,
+                    'duplicate_queries': metrics.duplicate_queries,
+                    'cache_hits': metrics.cache_hits,
+                    'cache_misses': metrics.cache_misses,
+                    'latency_quantiles': {q: _quantile(latencies, q) for q in QUANTILES},
+                    'query_quantiles': {q: _quantile(queries, q) for q in QUANTILES},
+                    'duplicate_fingerprints': [
+                        {'fingerprint': key, 'count': count, 'sql': metrics.fingerprint_sql[key]}
+                        for key, count in metrics.fingerprints.most_common()
+                    ],
+                }
+            return result
+
+    def render_prometheus(self):
+        """The registry in the Prometheus text exposition format."""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, help_text, attribute):
+            family(name, 'histogram', help_text)
+            for view, metrics in views:
+                hist = getattr(metrics, attribute)
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{view="{view}",le="+Inf"}} {hist.total}')
+                lines.append(f'{name}_sum{{view="{view}"}} {hist.sum}')
+                lines.append(f'{name}_count{{view="{view}"}} {hist.total}')
+
+        def counter(name, help_text, value):
+            family(name, 'counter', help_text)
+            for view, metrics in views:
+                lines.append(f'{name}{{view="{view}"}} {value(metrics)}')
+
+        with self._lock:
+            views = sorted(self._views.items())
+            histogram('store_request_latency_seconds', 'Request latency by view.', 'latency')
+            histogram('store_request_queries', 'SQL queries per request by view.', 'queries')
+            counter('store_sql_seconds_total', 'Time spent in SQL by view.', lambda m: m.sql_seconds)
+            counter('store_duplicate_queries_total', 'Repeated executions of a statement within a request.',
+                    lambda m: m.duplicate_queries)
+            counter('store_cache_hits_total', 'Cache reads that found a value.', lambda m: m.cache_hits)
+            counter('store_cache_misses_total', 'Cache reads that found nothing.', lambda m: m.cache_misses)
+
+            family('store_request_latency_rolling_seconds', 'summary',
+                   f'Latency quantiles over the last {ROLLING_WINDOW} requests by view.')
+            for view, metrics in views:
+                latencies = [latency for latency, _ in metrics.recent]
+                for q in QUANTILES:
+                    lines.append(
+                        f'store_request_latency_rolling_seconds{{view="{view}",quantile="{q}"}} '
+                        f'{_quantile(latencies, q)}'
+                    )
+
+            family('store_duplicate_query_fingerprint_total', 'counter',
+                   'Repeated executions by statement fingerprint, most frequent per view.')
+            for view, metrics in views:
+                for key, count in metrics.fingerprints.most_common(EXPORTED_FINGERPRINTS):
+                    lines.append(
+                        f'store_duplicate_query_fingerprint_total{{view="{view}",fingerprint="{key}"}} {count}'
+                    )
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,149 @@
+"""
+Inventory holds and stock commits.
+
+Stock is never read, changed in Python and written back. Opening checkout
+holds each line with ``UPDATE reserved = reserved + q WHERE stock - reserved
+>= q``; placing the order turns the holds into ``UPDATE stock = stock - q
+WHERE stock - reserved >= q`` statements in one transaction. Every check
+lives in the UPDATE's own WHERE clause, so concurrent buyers of the same
+product each take the row lock for a single statement instead of for a
+read-modify-write round trip, and a product can never be oversold.
+
+Holds expire after ``INVENTORY_HOLD_SECONDS``; ``release_expired_holds``
+(run by the ``release_expired_holds`` command) returns them in batches.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockReservation, adjust_category_counts
+from .page_cache import invalidate_catalog, invalidate_stock
+
+DEFAULT_HOLD_SECONDS = 10 * 60
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f'Not enough stock for product(s) {sorted(product_ids)}')
+        self.product_ids = product_ids
+
+
+def hold_duration():
+    return timedelta(seconds=getattr(settings, 'INVENTORY_HOLD_SECONDS', DEFAULT_HOLD_SECONDS))
+
+
+def _order_lines(order):
+    """``{product_id: quantity}`` for every line of ``order``, in lock order."""
+    lines = defaultdict(int)
+    for product_id, quantity in (
+        order.orderitem_set.filter(product__isnull=False)
+        .values_list('product_id', 'quantity').order_by('product_id')
+    ):
+        lines[product_id] += quantity
+    return lines
+
+
+def _release(reservations):
+    """Delete ``reservations`` (a locked list) and give their units back."""
+    returned = defaultdict(int)
+    for reservation in reservations:
+        returned[reservation.product_id] += reservation.quantity
+    if not returned:
+        return 0
+    StockReservation.objects.filter(pk__in=[r.pk for r in reservations]).delete()
+    for product_id in sorted(returned):
+        Product.objects.filter(pk=product_id).update(reserved=F('reserved') - returned[product_id])
+    return len(reservations)
+
+
+def release_order_holds(order):
+    with transaction.atomic():
+        return _release(list(StockReservation.objects.select_for_update().filter(order=order)))
+
+
+def hold_order_stock(order):
+    """
+    (Re)hold stock for every line of ``order`` for ``hold_duration()``.
+
+    Returns the ids of products that could not be held; the rest are held
+    even when some lines fail, so the customer can fix their cart.
+    """
+    expires_at = timezone.now() + hold_duration()
+    unavailable = []
+    with transaction.atomic():
+        release_order_holds(order)
+        holds = []
+        for product_id, quantity in _order_lines(order).items():
+            held = Product.objects.filter(
+                pk=product_id, stock__gte=F('reserved') + quantity,
+            ).update(reserved=F('reserved') + quantity)
+            if held:
+                holds.append(StockReservation(
+                    order=order, product_id=product_id, quantity=quantity, expires_at=expires_at,
+                ))
+            else:
+                unavailable.append(product_id)
+        StockReservation.objects.bulk_create(holds)
+    return unavailable
+
+
+def commit_order_stock(order):
+    """
+    Take every line of ``order`` out of stock, all or nothing.
+
+    The order's own holds are returned first, so a hold that expired but was
+    still available commits as well. Raises ``InsufficientStock`` (rolling
+    back the whole transaction) if any line no longer fits.
+    """
+    with transaction.atomic():
+        release_order_holds(order)
+        short = []
+        lines = _order_lines(order)
+        for product_id, quantity in lines.items():
+            if not Product.objects.filter(
+                pk=product_id, stock__gte=F('reserved') + quantity,
+            ).update(stock=F('stock') - quantity, updated_at=timezone.now()):
+                short.append(product_id)
+        if short:
+            raise InsufficientStock(short)
+        # Only this transaction could have taken these rows to zero.
+        sold_out = list(Product.objects.filter(pk__in=lines, stock=0).values_list('category_id', flat=True))
+        for category_id, count in Counter(sold_out).items():
+            adjust_category_counts(category_id, 0, -count)
+        # Stock levels show on product pages and in every ETag; only a
+        # sell-out changes the listings too. Expiring the whole catalog per
+        # order would leave its cache empty under load.
+        invalidate_stock()
+        if sold_out:
+            invalidate_catalog()
+
+
+def release_expired_holds(batch_size=500, now=None):
+    """Return expired holds in batches; each batch is its own short transaction."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = StockReservation.objects.filter(expires_at__lt=now).order_by('expires_at')
+            if connection.features.has_select_for_update_skip_locked:
+                # Holds being committed or swept elsewhere are skipped, not waited on.
+                expired = expired.select_for_update(skip_locked=True)
+            batch = _release(list(expired[:batch_size]))
+        released += batch
+        if batch < batch_size:
+            return released
+
+
+def reconcile_reserved(queryset=None):
+    """Rebuild ``Product.reserved`` from the live holds in one UPDATE."""
+    queryset = Product.objects.all() if queryset is None else queryset
+    held = (
+        StockReservation.objects.filter(product=OuterRef('pk'))
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    return queryset.update(reserved=Coalesce(Subquery(held), Value(0)))
@@ -0,0 +1,121 @@
+"""
+Durable background jobs backed by the ``Job`` table.
+
+Handlers are registered with ``@job(...)`` (see store.tasks) and queued with
+``handler.delay(**payload)``, usually inside the transaction that makes the
+work necessary so the job commits or rolls back with it. The ``run_worker``
+command claims due jobs in batches, hides them from other workers for a
+visibility timeout, and retries failures with exponential backoff.
+
+Claiming uses ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database
+supports it; elsewhere (SQLite) the claiming UPDATE repeats the "due"
+condition, so of two workers racing for a job only one UPDATE matches it.
+"""
+import logging
+import random
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+DEFAULT_VISIBILITY_TIMEOUT = 5 * 60
+MAX_RETRY_DELAY = 60 * 60
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler to fail its job without further retries."""
+
+
+def job(name, max_attempts=5):
+    """Register the decorated function as the handler for jobs called ``name``."""
+    def decorator(func):
+        REGISTRY[name] = func
+        func.job_name = name
+        func.delay = lambda **payload: enqueue(name, payload, max_attempts=max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, run_at=None, max_attempts=5):
+    return Job.objects.create(
+        name=name, payload=payload or {}, run_at=run_at or timezone.now(), max_attempts=max_attempts,
+    )
+
+
+def retry_delay(attempts):
+    """Exponential backoff with a little jitter, capped at ``MAX_RETRY_DELAY``."""
+    base = getattr(settings, 'JOB_RETRY_BASE_SECONDS', 5)
+    delay = min(base * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    return timedelta(seconds=delay + random.uniform(0, delay / 10))
+
+
+def _due(now):
+    return Q(status='pending', run_at__lte=now) | Q(status='running', locked_until__lt=now)
+
+
+def claim_jobs(batch_size=10, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+    """Claim up to ``batch_size`` due jobs for this worker and return them."""
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        # A worker that died during the final attempt leaves the job running.
+        Job.objects.filter(
+            status='running', locked_until__lt=now, attempts__gte=F('max_attempts'),
+        ).update(status='failed', last_error='Visibility timeout expired on the final attempt', updated_at=now)
+
+        candidates = Job.objects.filter(_due(now), attempts__lt=F('max_attempts')).order_by('run_at', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+        Job.objects.filter(_due(now), pk__in=ids).update(
+            status='running',
+            locked_until=now + timedelta(seconds=visibility_timeout),
+            lock_token=token,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+    return list(Job.objects.filter(lock_token=token, status='running').order_by('run_at', 'pk'))
+
+
+def run_job(job):
+    """Run one claimed job and record the outcome; returns whether it succeeded."""
+    # Only the current claimant may record an outcome; a job whose visibility
+    # timeout ran out may already belong to another worker.
+    claimed = Job.objects.filter(pk=job.pk, lock_token=job.lock_token)
+    try:
+        handler = REGISTRY.get(job.name)
+        if handler is None:
+            raise PermanentJobError(f'No handler registered for {job.name!r}')
+        result = handler(**job.payload)
+    except Exception as exc:
+        logger.exception('Job %s (%s) failed on attempt %s', job.pk, job.name, job.attempts)
+        now = timezone.now()
+        if isinstance(exc, PermanentJobError) or job.attempts >= job.max_attempts:
+            claimed.update(status='failed', locked_until=None, last_error=traceback.format_exc(), updated_at=now)
+        else:
+            claimed.update(
+                status='pending', locked_until=None, run_at=now + retry_delay(job.attempts),
+                last_error=traceback.format_exc(), updated_at=now,
+            )
+        return False
+    claimed.update(status='done', locked_until=None, result=result, last_error='', updated_at=timezone.now())
+    return True
+
+
+def run_pending(batch_size=10, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+    """Claim and run one batch of due jobs; returns how many were claimed."""
+    jobs = claim_jobs(batch_size, visibility_timeout)
+    for claimed in jobs:
+        run_job(claimed)
+    return len(jobs)
@@ -0,0 +1,96 @@
+import json
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from store.benchmark import DATASET_DEFAULTS, BenchmarkError, compare_results, run_benchmark, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic dataset in a throwaway test database and report p50/p95/p99 latency, '
+        'queries and allocations of the storefront and API endpoints.'
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DATASET_DEFAULTS.items():
+            parser.add_argument(
+                f"--{name.replace('_', '-')}", type=int, default=default, dest=name,
+                help=f'Size of the dataset: {name.replace("_", " ")} (default {default}).',
+            )
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data.')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per endpoint first.')
+        parser.add_argument(
+            '--traced', type=int, default=3,
+            help='Extra requests per endpoint measured with tracemalloc for allocations.',
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Expire the catalog caches before every request.',
+        )
+        parser.add_argument(
+            '--endpoint', action='append', dest='endpoints',
+            help='Only measure this endpoint; repeat for several.',
+        )
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline', help='Compare with the JSON results of an earlier run.')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Allowed p95 slowdown against the baseline, as a fraction (default 0.2).',
+        )
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database afterwards.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        sizes = {name: options[name] for name in DATASET_DEFAULTS}
+
+        # Cached pages and carts are keyed by ids, which the test database reuses.
+        prefix = f'benchmark-{uuid.uuid4().hex[:8]}'
+        isolated = {alias: {**config, 'KEY_PREFIX': prefix} for alias, config in settings.CACHES.items()}
+        with override_settings(CACHES=isolated, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, keepdb=options['keepdb'],
+            )
+            try:
+                self.stdout.write(f'Seeding {sizes}...')
+                dataset = seed_dataset(sizes, seed=options['seed'])
+                results = run_benchmark(
+                    dataset, iterations=options['iterations'], warmup=options['warmup'],
+                    traced=options['traced'], cold=options['cold'], only=options['endpoints'], sizes=sizes,
+                )
+            except BenchmarkError as exc:
+                raise CommandError(str(exc))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        self.stdout.write(f"{'endpoint':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'alloc KiB':>11}")
+        for name, row in results['endpoints'].items():
+            self.stdout.write(
+                f"{name:<28}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+                f"{row['queries']:>9}{row['alloc_peak_kib'] or 0:>11.1f}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['output']}."))
+
+        if baseline is not None:
+            for key in ('dataset', 'cold', 'database'):
+                if baseline['meta'].get(key) != results['meta'][key]:
+                    self.stdout.write(self.style.WARNING(
+                        f"The baseline was run with a different {key}: {baseline['meta'].get(key)}."
+                    ))
+            regressions = compare_results(results, baseline, options['tolerance'])
+            for name, metric, before, after in regressions:
+                self.stdout.write(self.style.ERROR(f'{name}: {metric} {before} -> {after}'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}.')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from store.catalog_io import EXPORT_CHUNK_SIZE, FORMATS, export_catalog, format_for
+
+
+class Command(BaseCommand):
+    help = 'Write the whole catalog as CSV or JSON Lines, in the format import_catalog reads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file, or '-' for standard output.")
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='File format; guessed from the extension by default (csv for standard output).',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help='Number of products fetched from the database at a time.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or format_for(path)
+        lines = export_catalog(file_format, options['chunk_size'])
+        if path == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        exported = -1 if file_format == 'csv' else 0  # The header line.
+        with open(path, 'w', newline='', encoding='utf-8') as output:
+            for line in lines:
+                output.write(line)
+                exported += 1
+        self.stdout.write(self.style.SUCCESS(f'Exported {exported} product(s) to {path}.'))
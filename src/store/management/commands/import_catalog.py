@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog_io import DEFAULT_BATCH_SIZE, FORMATS, CatalogFormatError, format_for, import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Create or update products, categories and discount links from a CSV or JSON Lines catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Catalog file, or '-' for standard input.")
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='File format; guessed from the extension by default (csv for standard input).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Number of rows upserted per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or format_for(path)
+        try:
+            if path == '-':
+                summary = import_catalog(sys.stdin, file_format, options['batch_size'])
+            else:
+                with open(path, newline='', encoding='utf-8-sig') as stream:
+                    summary = import_catalog(stream, file_format, options['batch_size'])
+        except (OSError, CatalogFormatError) as exc:
+            raise CommandError(str(exc))
+
+        for error in summary['errors']:
+            self.stderr.write(f"Line {error['line']}: {error['error']}")
+        if summary['failed'] > len(summary['errors']):
+            self.stderr.write(f"... and {summary['failed'] - len(summary['errors'])} more.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {summary['created']} and updated {summary['updated']} product(s); "
+            f"skipped {summary['failed']} row(s)."
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from store.paypal_stub import StubPayPalServer
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stub of the PayPal REST API (point PAYPAL_API_BASE at it).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--latency', type=float, default=0.0,
+            help='Seconds added to every response to mimic the real round trip.',
+        )
+
+    def handle(self, *args, **options):
+        server = StubPayPalServer(options['host'], options['port'], latency=options['latency'])
+        self.stdout.write(self.style.SUCCESS(f'Stub PayPal API listening on {server.url}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
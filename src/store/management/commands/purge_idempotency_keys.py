@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.idempotency import idempotency_window
+from store.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete stored Idempotency-Key responses older than IDEMPOTENCY_WINDOW.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of rows deleted per statement.',
+        )
+
+    def handle(self, *args, **options):
+        expired = IdempotencyKey.objects.filter(
+            status_code__isnull=False, created_at__lt=timezone.now() - idempotency_window(),
+        )
+        purged = 0
+        while True:
+            ids = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            purged += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} idempotency key(s).'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from store.models import Discount, Product, refresh_effective_prices
+
+
+class Command(BaseCommand):
+    help = 'Expire overdue discounts and recompute Product.effective_price for the whole catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of primary keys covered by each UPDATE statement.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        expired = Discount.objects.expire_overdue()
+        if expired:
+            self.stdout.write(f'Deactivated {expired} expired discount(s).')
+
+        bounds = Product.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            self.stdout.write('No products to update.')
+            return
+
+        updated = 0
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            with transaction.atomic():
+                updated += refresh_effective_prices(
+                    Product.objects.filter(pk__gte=start, pk__lt=start + batch_size)
+                )
+        self.stdout.write(self.style.SUCCESS(f'Updated effective price of {updated} product(s).'))
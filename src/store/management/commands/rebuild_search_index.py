@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.models import Product
+from store.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Create the product search index if needed and re-index the whole catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Number of products re-indexed per statement.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        backend = get_search_backend()
+        backend.setup()
+
+        indexed = 0
+        batch = []
+        for pk in Product.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=batch_size):
+            batch.append(pk)
+            if len(batch) == batch_size:
+                with transaction.atomic():
+                    backend.index(batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                backend.index(batch)
+            indexed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} product(s).'))
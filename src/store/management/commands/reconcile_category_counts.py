@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Category, recount_categories
+from store.page_cache import invalidate_catalog
+
+
+class Command(BaseCommand):
+    help = 'Recompute product_count and in_stock_count of every category from its products.'
+
+    def handle(self, *args, **options):
+        reconciled = recount_categories(Category.objects.all())
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f'Reconciled counts of {reconciled} categories.'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from store.models import Product, recompute_product_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute num_reviews, rating_sum and rating of every product from its reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of primary keys covered by each UPDATE statement.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = Product.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            self.stdout.write('No products to reconcile.')
+            return
+
+        reconciled = 0
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            with transaction.atomic():
+                reconciled += recompute_product_ratings(
+                    Product.objects.filter(pk__gte=start, pk__lt=start + batch_size)
+                )
+        self.stdout.write(self.style.SUCCESS(f'Reconciled ratings of {reconciled} product(s).'))
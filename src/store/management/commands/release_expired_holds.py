@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from store.inventory import reconcile_reserved, release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Return stock held by checkouts whose reservation has expired.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of holds released per transaction.',
+        )
+        parser.add_argument(
+            '--reconcile', action='store_true',
+            help='Afterwards rebuild Product.reserved from the remaining holds.',
+        )
+
+    def handle(self, *args, **options):
+        released = release_expired_holds(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired hold(s).'))
+        if options['reconcile']:
+            updated = reconcile_reserved()
+            self.stdout.write(self.style.SUCCESS(f'Reconciled reserved stock of {updated} product(s).'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from store.models import Order, recompute_order_totals
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized item_count and items_subtotal of every order.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of primary keys covered by each UPDATE statement.',
+        )
+        parser.add_argument(
+            '--open-only', action='store_true',
+            help='Only repair open carts (complete=False).',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        orders = Order.objects.all()
+        if options['open_only']:
+            orders = orders.filter(complete=False)
+
+        bounds = orders.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            self.stdout.write('No orders to repair.')
+            return
+
+        repaired = 0
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            with transaction.atomic():
+                repaired += recompute_order_totals(
+                    orders.filter(pk__gte=start, pk__lt=start + batch_size)
+                )
+        self.stdout.write(self.style.SUCCESS(f'Repaired totals of {repaired} order(s).'))
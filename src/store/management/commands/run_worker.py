@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.jobs import DEFAULT_VISIBILITY_TIMEOUT, run_pending
+from store.tasks import schedule_discount_expiry
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (checkout emails, PayPal calls, daily discount expiry) until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10,
+            help='Number of jobs claimed per poll.',
+        )
+        parser.add_argument(
+            '--visibility-timeout', type=int, default=DEFAULT_VISIBILITY_TIMEOUT,
+            help='Seconds a claimed job stays hidden from other workers.',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=1.0,
+            help='Seconds to wait between polls when the queue is empty.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no job is due instead of polling.',
+        )
+
+    def handle(self, *args, **options):
+        # Starts the daily discount expiry, which then queues its own next run.
+        schedule_discount_expiry()
+        processed = 0
+        try:
+            while True:
+                claimed = run_pending(options['batch_size'], options['visibility_timeout'])
+                processed += claimed
+                if claimed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} job(s).'))
@@ -0,0 +1,56 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .instrumentation import RequestRecorder, instrument_caches, registry
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentationMiddleware:
+    """
+    Record queries, SQL time, cache hits/misses and latency of every request
+    under its resolved view name (see ``store.instrumentation``).
+
+    Place it first in ``MIDDLEWARE`` so the work of every other middleware
+    counts. Requests with repeated statements are logged at INFO with the
+    repeated SQL, and at WARNING when over ``SLOW_REQUEST_QUERIES`` queries.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_queries = getattr(settings, 'SLOW_REQUEST_QUERIES', 50)
+        instrument_caches()
+
+    def __call__(self, request):
+        recorder = RequestRecorder()
+        token = recorder.activate()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = self.get_response(request)
+        finally:
+            recorder.deactivate(token)
+        latency = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        registry.record(view, latency, recorder)
+
+        duplicates = recorder.duplicates()
+        if duplicates or recorder.queries > self.slow_queries:
+            logger.log(
+                logging.WARNING if recorder.queries > self.slow_queries else logging.INFO,
+                '%s %s (%s): %d queries, %d repeated statements%s',
+                request.method, request.path, view, recorder.queries, len(duplicates),
+                ''.join(
+                    f'\n  {count}x {recorder.samples[key]}'
+                    for key, count in sorted(duplicates.items(), key=lambda item: -item[1])
+                ),
+            )
+        return response
@@ -1,8 +1,13 @@
+import time
+import uuid
+from datetime import datetime, time as dt_time, timedelta
 from decimal import Decimal
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Sum, F
+from django.db import models, transaction
+from django.db.models import Case, Count, Sum, F, Max, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 from django_countries.fields import CountryField
 from phone_field import PhoneField
@@ -15,10 +20,16 @@ from django.utils.text import slugify
 from django.core.cache import cache
 
 
+# Cached prices are namespaced by a generation counter that every Discount
+# change bumps, so they can live for hours without going stale.
+PRICE_CACHE_TIMEOUT = 6 * 3600
+PRICING_GENERATION_KEY = 'pricing_generation'
+
+
 def change_product_images_name(instance, filename):
-    """Rename uploaded product images to a consistent format."""
-    ext = filename.split('.')[-1]
-    return f'store/{instance.name}_{instance.pk}.{ext}'
+    """Name uploads after the product plus a fresh token, so a re-upload never reuses a URL."""
+    ext = filename.split('.')[-1].lower()
+    return f'store/{slugify(instance.name)}-{uuid.uuid4().hex[:8]}.{ext}'
 
 
 class Category(models.Model):
@@ -27,6 +38,9 @@ class Category(models.Model):
     slug = models.SlugField(unique=True, blank=True)
     description = models.TextField(max_length=500, blank=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    # Kept current by Product.save() and store.inventory (see adjust_category_counts).
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+    in_stock_count = models.PositiveIntegerField(default=0, editable=False)
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -44,7 +58,20 @@ class Category(models.Model):
 
 class DiscountManager(models.Manager):
     def get_active_discounts(self):
-        return self.filter(active=True, expired_date__gte=timezone.now())
+        return self.filter(active=True, expired_date__gte=timezone.now().date())
+
+    def expire_overdue(self):
+        """Deactivate discounts past their expiry date and reprice their products."""
+        overdue = self.filter(active=True, expired_date__lt=timezone.now().date())
+        product_ids = list(
+            Product.discount.through.objects.filter(discount__in=overdue)
+            .values_list('product_id', flat=True).distinct()
+        )
+        count = overdue.update(active=False)
+        if count:
+            bump_pricing_generation()
+        refresh_effective_prices(Product.objects.filter(pk__in=product_ids))
+        return count
 
 
 class Discount(models.Model):
@@ -60,6 +87,11 @@ class Discount(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def is_current(self):
+        """Active and not yet past its expiry date."""
+        return self.active and self.expired_date >= timezone.now().date()
+
     def clean(self):
         if self.expired_date <= timezone.now().date():
             raise ValidationError('The expiration date must be in the future.')
@@ -104,48 +136,83 @@ class Product(models.Model):
         default='store/default.png',
         validators=[FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png'])],
     )
+    # Derivative files of image, written by store.renditions; {} until rendered.
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     stock = models.PositiveIntegerField(default=0)
+    # Units held by open checkouts (see store.inventory); available = stock - reserved.
+    reserved = models.PositiveIntegerField(default=0, editable=False)
+    # Price after the best current discount, kept in sync by store.signals so
+    # the catalog can be sorted and filtered on what customers actually pay.
+    effective_price = models.DecimalField(max_digits=8, decimal_places=2, default=0, editable=False)
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
     num_reviews = models.PositiveIntegerField(default=0)
+    # Running sum of review ratings; rating is always rating_sum / num_reviews
+    # and all three move together in one UPDATE (see adjust_product_rating).
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    # Weighted tsvector maintained by store.search on Postgres; unused elsewhere.
+    search_vector = SearchVectorField(null=True, editable=False)
 
     objects = ProductManager()
 
+    # Filled in by resolve_discounted_prices(); avoids a cache hit per access.
+    _discounted_price = None
+    # (category_id, in stock) as last persisted, None if loaded deferred;
+    # new rows are not counted in any category yet.
+    _persisted_listing = (None, False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if {'category_id', 'stock'} <= instance.__dict__.keys():
+            instance._persisted_listing = instance._current_listing()
+        else:
+            instance._persisted_listing = None
+        return instance
+
+    def _current_listing(self, persisted=(None, False)):
+        """``(category_id, in stock)`` as saving now leaves it; deferred fields keep ``persisted``."""
+        category_id = self.__dict__.get('category_id', persisted[0])
+        in_stock = self.__dict__['stock'] > 0 if 'stock' in self.__dict__ else persisted[1]
+        return category_id, in_stock
+
+    def _stored_listing(self):
+        """The persisted listing, read back for an instance loaded without it."""
+        row = Product.objects.filter(pk=self.pk).values_list('category_id', 'stock').first()
+        return (row[0], row[1] > 0) if row else (None, False)
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        best = None
+        if self.pk:
+            best = self.discount.get_active_discounts().aggregate(best=Max('percentage'))['best']
+        self.effective_price = _apply_discount(self.price, [best] if best is not None else [])
+        old_listing = self._persisted_listing
+        with transaction.atomic():
+            if old_listing is None:
+                old_listing = self._stored_listing()
+            super().save(*args, **kwargs)
+            new_listing = self._current_listing(old_listing)
+            move_category_listing(old_listing, new_listing)
+        self._persisted_listing = new_listing
         # Only clear this product's cache key, not everything
-        cache.delete(f'product_{self.id}_discounted_price')
+        self._discounted_price = None
+        cache.delete(price_cache_key(self.id))
 
     def __str__(self):
         return self.name
 
     def get_discounted_price(self):
         """Return the lowest discounted price, or the base price if no active discount."""
-        cache_key = f'product_{self.id}_discounted_price'
-        discounted_price = cache.get(cache_key)
-
-        if discounted_price is None:
-            active_discounts = self.discount.filter(active=True)
-            if active_discounts.exists():
-                max_discount = max(d.percentage for d in active_discounts)
-                discounted_price = self.price * (1 - max_discount / 100)
-            else:
-                discounted_price = self.price
-            cache.set(cache_key, discounted_price, 3600)
-
-        return discounted_price
+        if self._discounted_price is None:
+            resolve_discounted_prices([self])
+        return self._discounted_price
 
     def update_rating(self):
-        """Recalculate and persist rating without triggering a full save() cascade."""
-        from django.db.models import Avg
-        result = self.reviews.aggregate(avg=Avg('rating'), count=models.Count('id'))
-        Product.objects.filter(pk=self.pk).update(
-            rating=result['avg'] or 0,
-            num_reviews=result['count'],
-        )
+        """Recalculate rating from scratch; reviews keep it current incrementally."""
+        recompute_product_ratings(Product.objects.filter(pk=self.pk))
 
     class Meta:
         verbose_name_plural = 'Products'
@@ -153,11 +220,170 @@ class Product(models.Model):
         indexes = [
             models.Index(fields=['slug']),
             models.Index(fields=['price']),
+            models.Index(fields=['effective_price']),
             models.Index(fields=['rating']),
             models.Index(fields=['created_at']),
+            # Covers every column store.facets counts on, for index-only scans.
+            models.Index(
+                fields=['category', 'effective_price', 'price', 'rating', 'digital', 'stock'],
+                name='product_facets_idx',
+            ),
         ]
 
 
+def adjust_category_counts(category_id, products, in_stock):
+    """Shift a category's product and in-stock counts in one UPDATE."""
+    if category_id is None or (not products and not in_stock):
+        return
+    Category.objects.filter(pk=category_id).update(
+        product_count=F('product_count') + products,
+        in_stock_count=F('in_stock_count') + in_stock,
+    )
+
+
+def move_category_listing(old, new):
+    """Recount a product going from listing ``old`` to ``new``, each ``(category_id, in_stock)``."""
+    (old_category, old_in_stock), (new_category, new_in_stock) = old, new
+    if old_category == new_category:
+        adjust_category_counts(new_category, 0, new_in_stock - old_in_stock)
+    else:
+        adjust_category_counts(old_category, -1, -old_in_stock)
+        adjust_category_counts(new_category, 1, new_in_stock)
+
+
+def recount_categories(queryset):
+    """Rebuild ``product_count``/``in_stock_count`` of ``queryset`` from its products."""
+    products = Product.objects.filter(category=OuterRef('pk')).order_by().values('category')
+    count = products.annotate(n=Count('id')).values('n')
+    in_stock = products.filter(stock__gt=0).annotate(n=Count('id')).values('n')
+    return queryset.order_by().update(
+        product_count=Coalesce(Subquery(count), Value(0)),
+        in_stock_count=Coalesce(Subquery(in_stock), Value(0)),
+    )
+
+
+def get_pricing_generation():
+    """Return the current pricing cache generation, seeding it if evicted."""
+    generation = cache.get(PRICING_GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so a lost counter never reuses an old namespace.
+        cache.add(PRICING_GENERATION_KEY, time.time_ns() // 1000, None)
+        generation = cache.get(PRICING_GENERATION_KEY)
+    return generation
+
+
+def bump_pricing_generation():
+    """Invalidate every cached discounted price in O(1)."""
+    try:
+        return cache.incr(PRICING_GENERATION_KEY)
+    except ValueError:
+        return get_pricing_generation()
+
+
+def price_cache_key(product_id, generation=None):
+    if generation is None:
+        generation = get_pricing_generation()
+    return f'pricing:{generation}:product_{product_id}_discounted_price'
+
+
+def _price_cache_timeout(expiry_dates):
+    """Cap the TTL so a price never outlives the discount it was computed from."""
+    if not expiry_dates:
+        return PRICE_CACHE_TIMEOUT
+    ends_at = timezone.make_aware(datetime.combine(min(expiry_dates) + timedelta(days=1), dt_time.min))
+    remaining = int((ends_at - timezone.now()).total_seconds())
+    return max(1, min(PRICE_CACHE_TIMEOUT, remaining))
+
+
+def _apply_discount(price, percentages):
+    """Apply the largest of ``percentages`` to ``price``."""
+    if not percentages:
+        return price
+    return price * (1 - max(percentages) / 100)
+
+
+def resolve_discounted_prices(products):
+    """
+    Resolve discounted prices for a page of products in bulk.
+
+    Costs one generation lookup and one cache.get_many, at most one discount
+    query for the cache misses (none when ``discount`` was prefetched) and
+    one cache.set_many per distinct TTL.
+    The price is memoised on each instance so that templates and serializers
+    calling get_discounted_price() afterwards do no further work.
+    Returns a ``{product_id: price}`` dict.
+    """
+    products = [p for p in products if p is not None]
+    if not products:
+        return {}
+
+    generation = get_pricing_generation()
+    keys = {price_cache_key(p.id, generation): p for p in products}
+    cached = cache.get_many(keys.keys())
+
+    missing = [p for key, p in keys.items() if key not in cached]
+    current = {p.id: [] for p in missing}
+    to_query = []
+    for product in missing:
+        prefetched = getattr(product, '_prefetched_objects_cache', {})
+        if 'discount' in prefetched:
+            current[product.id] = [
+                (d.percentage, d.expired_date) for d in prefetched['discount'] if d.is_current
+            ]
+        else:
+            to_query.append(product.id)
+
+    if to_query:
+        rows = Product.discount.through.objects.filter(
+            product_id__in=to_query,
+            discount__in=Discount.objects.get_active_discounts(),
+        ).values_list('product_id', 'discount__percentage', 'discount__expired_date')
+        for product_id, percentage, expired_date in rows:
+            current[product_id].append((percentage, expired_date))
+
+    fresh = {}
+    by_timeout = {}
+    for product in missing:
+        key = price_cache_key(product.id, generation)
+        discounts = current[product.id]
+        fresh[key] = _apply_discount(product.price, [percentage for percentage, _ in discounts])
+        timeout = _price_cache_timeout([expired_date for _, expired_date in discounts])
+        by_timeout.setdefault(timeout, {})[key] = fresh[key]
+    for timeout, values in by_timeout.items():
+        cache.set_many(values, timeout)
+
+    prices = {}
+    for product in products:
+        key = price_cache_key(product.id, generation)
+        product._discounted_price = cached[key] if key in cached else fresh[key]
+        prices[product.id] = product._discounted_price
+    return prices
+
+
+def refresh_effective_prices(queryset):
+    """
+    Recompute ``effective_price`` for every product in ``queryset`` with a
+    single UPDATE; the best current discount is looked up in a correlated
+    subquery so no rows are loaded into Python.
+    """
+    best = (
+        Discount.objects.get_active_discounts()
+        .filter(products_discount=OuterRef('pk'))
+        .order_by()
+        .values('products_discount')
+        .annotate(best=Max('percentage'))
+        .values('best')
+    )
+    percentage = Coalesce(Subquery(best), Value(Decimal('0')))
+    return queryset.order_by().update(
+        effective_price=Round(
+            F('price') * (Value(Decimal('100')) - percentage) / Value(Decimal('100')), 2,
+            output_field=models.DecimalField(max_digits=8, decimal_places=2),
+        ),
+        updated_at=timezone.now(),
+    )
+
+
 class Review(models.Model):
     """A user review for a product."""
     product = models.ForeignKey(Product, related_name='reviews', on_delete=models.CASCADE)
@@ -168,9 +394,25 @@ class Review(models.Model):
     comment = models.TextField(max_length=500)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # (product_id, rating) as last persisted; new rows have not counted yet.
+    _persisted_rating = (None, 0)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._persisted_rating = (instance.__dict__.get('product_id'), instance.__dict__.get('rating') or 0)
+        return instance
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.product.update_rating()
+        old_product_id, old_rating = self._persisted_rating
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if old_product_id == self.product_id:
+                adjust_product_rating(self.product_id, 0, self.rating - old_rating)
+            else:
+                adjust_product_rating(old_product_id, -1, -old_rating)
+                adjust_product_rating(self.product_id, 1, self.rating)
+        self._persisted_rating = (self.product_id, self.rating)
 
     class Meta:
         unique_together = ['product', 'user']
@@ -178,6 +420,43 @@ class Review(models.Model):
         indexes = [models.Index(fields=['product', 'user'])]
 
 
+def _derived_rating(rating_sum, num_reviews, no_reviews):
+    return Case(
+        When(no_reviews, then=Value(Decimal('0.00'))),
+        default=Round(Cast(rating_sum, models.FloatField()) / num_reviews, 2),
+        output_field=models.DecimalField(max_digits=3, decimal_places=2),
+    )
+
+
+def adjust_product_rating(product_id, count, rating_sum):
+    """Shift a product's review count and rating sum, and rederive rating, in one UPDATE."""
+    if product_id is None or (not count and not rating_sum):
+        return
+    new_count = F('num_reviews') + count
+    new_sum = F('rating_sum') + rating_sum
+    # rating is assigned first: MySQL evaluates SET left to right against
+    # the already-updated columns, other backends against the old row.
+    Product.objects.filter(pk=product_id).update(
+        rating=_derived_rating(new_sum, new_count, Q(num_reviews__lte=-count)),
+        num_reviews=new_count,
+        rating_sum=new_sum,
+        updated_at=timezone.now(),
+    )
+
+
+def recompute_product_ratings(queryset):
+    """Rebuild ``num_reviews``/``rating_sum``/``rating`` of ``queryset`` from its reviews."""
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    queryset = queryset.order_by()
+    updated = queryset.update(
+        num_reviews=Coalesce(Subquery(reviews.annotate(n=Count('id')).values('n')), Value(0)),
+        rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), Value(0)),
+        updated_at=timezone.now(),
+    )
+    queryset.update(rating=_derived_rating(F('rating_sum'), F('num_reviews'), Q(num_reviews=0)))
+    return updated
+
+
 class ShippingInfo(models.Model):
     """Shipping address for a customer."""
     customer = models.ForeignKey(User, related_name='shipping_infos', on_delete=models.CASCADE)
@@ -202,6 +481,22 @@ class ShippingInfo(models.Model):
         indexes = [models.Index(fields=['customer', 'is_default'])]
 
 
+class ShippingZone(models.Model):
+    """Shipping rates for a group of countries; unlisted countries use the default zone."""
+    name = models.CharField(max_length=50, unique=True)
+    countries = CountryField(multiple=True, blank=True)
+    base_cost = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('5.00'))
+    per_item_cost = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('2.00'))
+    multiplier = models.DecimalField(max_digits=4, decimal_places=2, default=Decimal('1.00'))
+    is_default = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ['name']
+
+
 class Order(models.Model):
     """A customer order, complete or in-progress (cart)."""
     SHIPPING_STATUS_CHOICES = [
@@ -229,21 +524,23 @@ class Order(models.Model):
     shipping_status = models.CharField(max_length=15, choices=SHIPPING_STATUS_CHOICES, default='Pending')
     payment_status = models.CharField(max_length=15, choices=PAYMENT_STATUS_CHOICES, default='Pending')
     shipping_cost = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    # Running totals over orderitem_set, maintained by OrderItem with F()
+    # updates; repair with the repair_order_totals command.
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    items_subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     transaction_id = models.CharField(max_length=100, unique=True)
 
+    DENORMALIZED_TOTALS = ('item_count', 'items_subtotal')
+
     def __str__(self):
         return f'Order #{self.id} by {self.customer.username}'
 
     @property
     def get_cart_total(self):
-        """Total item cost + shipping, computed in the DB."""
-        result = self.orderitem_set.aggregate(
-            total=Sum(F('price_at_purchase') * F('quantity'))
-        )
-        items_total = result['total'] or Decimal('0.00')
-        return items_total + self.shipping_cost
+        """Total item cost + shipping, from the denormalized columns."""
+        return self.items_subtotal + self.shipping_cost
 
     @property
     def get_total_price_for_order(self):
@@ -253,8 +550,7 @@ class Order(models.Model):
     @property
     def get_cart_items(self):
         """Total number of items in the cart."""
-        result = self.orderitem_set.aggregate(total=Sum('quantity'))
-        return result['total'] or 0
+        return self.item_count
 
     @property
     def get_total_quantity(self):
@@ -272,30 +568,32 @@ class Order(models.Model):
     def physical_items(self):
         return self.orderitem_set.filter(product__digital=False)
 
-    def calculate_shipping_cost(self):
-        if not self.requires_shipping:
-            self.shipping_cost = Decimal('0.00')
-            return
-
-        base_cost = Decimal('5.00')
-        per_item_cost = Decimal('2.00')
-        physical_count = self.physical_items.count()
-        cost = base_cost + (per_item_cost * physical_count)
-
+    @property
+    def shipping_country_code(self):
         if self.shipping_info and self.shipping_info.country:
-            country_code = self.shipping_info.country.code
-            if country_code in ['US', 'CA']:
-                cost *= Decimal('1.2')
-            elif country_code in ['GB', 'DE', 'FR']:
-                cost *= Decimal('1.3')
+            return self.shipping_info.country.code
+        return None
+
+    def calculate_shipping_cost(self, profile=None):
+        from .shipping import get_shipping_profile, quote_shipping
 
-        self.shipping_cost = cost
+        profile = profile or get_shipping_profile(self)
+        self.shipping_cost = quote_shipping(profile, self.shipping_country_code)
 
     def save(self, *args, **kwargs):
         if self.pk:  # ← add this guard
-            if self.requires_shipping and not self.shipping_info:
+            from .shipping import get_shipping_profile
+
+            profile = get_shipping_profile(self)
+            if profile.requires_shipping and not self.shipping_info:
                 raise ValidationError('Shipping information is required for physical items.')
-            self.calculate_shipping_cost()
+            self.calculate_shipping_cost(profile)
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write back possibly stale totals over concurrent F() updates.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DENORMALIZED_TOTALS
+            ]
         super().save(*args, **kwargs)
 
     class Meta:
@@ -307,6 +605,31 @@ class Order(models.Model):
         ]
 
 
+def adjust_order_totals(order_id, quantity, subtotal):
+    """Shift an order's denormalized totals by the given deltas in one UPDATE."""
+    if order_id is None or (not quantity and not subtotal):
+        return
+    Order.objects.filter(pk=order_id).update(
+        item_count=F('item_count') + quantity,
+        items_subtotal=F('items_subtotal') + subtotal,
+    )
+
+
+def recompute_order_totals(queryset):
+    """Rebuild ``item_count``/``items_subtotal`` for ``queryset`` in one UPDATE."""
+    lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    return queryset.order_by().update(
+        item_count=Coalesce(Subquery(lines.annotate(n=Sum('quantity')).values('n')), Value(0)),
+        items_subtotal=Coalesce(
+            Subquery(lines.annotate(
+                total=Sum(F('price_at_purchase') * F('quantity'),
+                          output_field=models.DecimalField(max_digits=10, decimal_places=2)),
+            ).values('total')),
+            Value(Decimal('0.00')),
+        ),
+    )
+
+
 class OrderItem(models.Model):
     """A single product line within an order."""
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
@@ -315,13 +638,36 @@ class OrderItem(models.Model):
     price_at_purchase = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # (order_id, quantity, line total) as last persisted; new rows count as empty.
+    _persisted_line = (None, 0, Decimal('0.00'))
+
     def __str__(self):
         return f'{self.quantity} x {self.product.name}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._persisted_line = instance._current_line()
+        return instance
+
+    def _current_line(self):
+        quantity = self.__dict__.get('quantity') or 0
+        price = self.__dict__.get('price_at_purchase') or Decimal('0.00')
+        return self.__dict__.get('order_id'), quantity, price * quantity
+
     def save(self, *args, **kwargs):
         if not self.price_at_purchase:
             self.price_at_purchase = self.product.get_discounted_price()
-        super().save(*args, **kwargs)
+        old_order_id, old_quantity, old_total = self._persisted_line
+        new_order_id, new_quantity, new_total = self._current_line()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if old_order_id == new_order_id:
+                adjust_order_totals(new_order_id, new_quantity - old_quantity, new_total - old_total)
+            else:
+                adjust_order_totals(old_order_id, -old_quantity, -old_total)
+                adjust_order_totals(new_order_id, new_quantity, new_total)
+        self._persisted_line = (new_order_id, new_quantity, new_total)
 
     @property
     def get_total_price(self):
@@ -329,4 +675,76 @@ class OrderItem(models.Model):
 
     class Meta:
         ordering = ['product__name']
-        indexes = [models.Index(fields=['order', 'product'])]
+        # One line per product per order; concurrent first adds collide here
+        # and fall back to incrementing the winner's row.
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_order_product'),
+        ]
+
+
+class StockReservation(models.Model):
+    """Units of a product held for an order in checkout until ``expires_at``."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id} for order {self.order_id}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_reservation_order_product'),
+        ]
+
+
+class Job(models.Model):
+    """A unit of background work, run by the ``run_worker`` command (see store.jobs)."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    # A claimed job is invisible to other workers until locked_until passes.
+    locked_until = models.DateTimeField(null=True, blank=True)
+    lock_token = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+
+class IdempotencyKey(models.Model):
+    """The first response to a request sent with an ``Idempotency-Key`` header (see store.idempotency)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # Hash of method, path and body; a key reused for another request is rejected.
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    body = models.TextField(blank=True)
+    # While the first request runs, duplicates wait until this passes.
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f'{self.key} ({self.user_id})'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_user_key'),
+        ]
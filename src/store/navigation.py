@@ -0,0 +1,47 @@
+"""
+Category navigation: every category with its product and in-stock counts.
+
+The counts are columns on ``Category`` kept current by deltas (see
+``adjust_category_counts``), so building the list is one small query. The
+list is cached in the shared cache and copied into each process, both keyed
+by the catalog version that every product, category and stock change bumps.
+A warm request only reads that version: no queries and no unpickling.
+"""
+from collections import namedtuple
+
+from django.core.cache import cache
+
+from .models import Category
+from .page_cache import get_catalog_version
+
+CATEGORY_NAV_KEY = 'category_nav'
+CATEGORY_NAV_TIMEOUT = 6 * 3600
+
+CategoryEntry = namedtuple('CategoryEntry', ['id', 'name', 'slug', 'product_count', 'in_stock_count'])
+
+# (catalog version, entries) of the last list this process used.
+_local = (None, ())
+
+
+def build_category_navigation():
+    return tuple(
+        CategoryEntry(*row)
+        for row in Category.objects.values_list('pk', 'name', 'slug', 'product_count', 'in_stock_count')
+    )
+
+
+def get_category_navigation():
+    """Return the navigation entries, ordered by name."""
+    global _local
+    version = get_catalog_version()
+    if _local[0] == version:
+        return _local[1]
+
+    cached = cache.get(CATEGORY_NAV_KEY)
+    if cached is not None and cached[0] == version:
+        entries = cached[1]
+    else:
+        entries = build_category_navigation()
+        cache.set(CATEGORY_NAV_KEY, (version, entries), CATEGORY_NAV_TIMEOUT)
+    _local = (version, entries)
+    return entries
@@ -0,0 +1,166 @@
+"""
+Rendered-page cache for the catalog and product detail pages.
+
+Both pages are assembled from fragments that depend only on the catalog
+(products, categories, discounts, reviews) and on the URL. Fragments are
+cached under a catalog version that store.signals bumps whenever any of those
+change, so entries are never deleted one by one: a bump simply makes every
+old key unreachable. Anonymous visitors get the whole response from the
+cache; everyone else gets the cached fragments wrapped in a freshly rendered
+page, so only the per-user parts (cart badge, review form) cost anything.
+Anonymous pages also carry an ETag derived from the same version.
+
+Placing an order changes stock levels without touching the catalog (only a
+sell-out does, see store.inventory), so stock has a version of its own. It
+is part of every ETag, and of the cache keys of pages that show exact stock
+levels (``shows_stock_levels``); listings only show in or out of stock.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
+
+from .conditional import make_etag, not_modified, set_validators
+
+CATALOG_VERSION_KEY = 'catalog_version'
+STOCK_VERSION_KEY = 'catalog_stock_version'
+
+
+def catalog_cache_timeout():
+    # Also bounds how late a discount passing its expiry date shows up.
+    return getattr(settings, 'CATALOG_PAGE_TIMEOUT', 300)
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a lost counter never reuses an old namespace.
+        cache.add(key, time.time_ns() // 1000, None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return _get_version(key)
+
+
+def get_catalog_version():
+    """Return the current catalog version, seeding it if evicted."""
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    return _bump_version(CATALOG_VERSION_KEY)
+
+
+def get_stock_version():
+    """Return the current stock version, seeding it if evicted."""
+    return _get_version(STOCK_VERSION_KEY)
+
+
+def bump_stock_version():
+    return _bump_version(STOCK_VERSION_KEY)
+
+
+def invalidate_catalog():
+    """
+    Invalidate every cached catalog page. Bumps again once the surrounding
+    transaction commits, so a page rendered from the old rows in between
+    does not stay cached.
+    """
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+
+def invalidate_stock():
+    """
+    Expire every ETag and the pages showing exact stock levels, but not the
+    rest of the catalog cache. Bumps again on commit like
+    ``invalidate_catalog()``.
+    """
+    bump_stock_version()
+    transaction.on_commit(bump_stock_version)
+
+
+def catalog_cache_key(kind, parts, version=None):
+    if version is None:
+        version = get_catalog_version()
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f'catalog:{version}:{kind}_{digest}'
+
+
+class CatalogPageCacheMixin:
+    """
+    Serve a view from the catalog cache.
+
+    ``cache_params`` lists the query parameters the page depends on; any
+    others are ignored, so tracking parameters do not split the cache.
+    ``fragment_templates`` maps fragment names to templates rendered with
+    ``get_fragment_context()``, which only runs on a miss. ``template_name``
+    receives the rendered ``fragments`` plus ``get_page_context()``.
+    """
+    cache_params = ()
+    fragment_templates = {}
+    shows_stock_levels = False
+
+    def cache_parts(self):
+        return (
+            self.request.path,
+            [(name, self.request.GET.getlist(name)) for name in self.cache_params],
+        )
+
+    def get_fragment_context(self):
+        raise NotImplementedError
+
+    def get_fragments(self):
+        context = self.get_fragment_context()
+        return {
+            name: render_to_string(template, context, self.request)
+            for name, template in self.fragment_templates.items()
+        }
+
+    def get_page_context(self, fragments):
+        return {'fragments': fragments}
+
+    def caches_whole_page(self, request):
+        # Pages carrying one-off messages are rendered but never stored.
+        return not request.user.is_authenticated and not get_messages(request)
+
+    def get(self, request, *args, **kwargs):
+        catalog_version, stock_version = get_catalog_version(), get_stock_version()
+        version = f'{catalog_version}.{stock_version}' if self.shows_stock_levels else catalog_version
+        parts = self.cache_parts()
+        whole_page = self.caches_whole_page(request)
+        page_key = catalog_cache_key('page', parts, version)
+        if whole_page:
+            # The same page for every anonymous visitor, so it can be revalidated.
+            etag = make_etag(catalog_version, stock_version, parts)
+            unchanged = not_modified(request, etag)
+            if unchanged is not None:
+                return unchanged
+            content = cache.get(page_key)
+            if content is not None:
+                return set_validators(HttpResponse(content), etag)
+
+        fragments_key = catalog_cache_key('fragments', parts, version)
+        fragments = cache.get(fragments_key)
+        if fragments is None:
+            fragments = self.get_fragments()
+            cache.set(fragments_key, fragments, catalog_cache_timeout())
+
+        response = TemplateResponse(request, self.template_name, self.get_page_context(fragments))
+        if whole_page:
+            response.add_post_render_callback(
+                lambda rendered: cache.set(page_key, rendered.content, catalog_cache_timeout())
+            )
+            set_validators(response, etag)
+        return response
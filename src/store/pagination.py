@@ -0,0 +1,242 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by the sort values and primary key of their boundary row
+instead of an OFFSET, so page 5000 costs the same index range scan as page 1
+and no COUNT(*) is needed. ``KeysetPaginator`` backs the HTML catalog and
+``KeysetPagination`` plugs the same scheme into DRF viewsets.
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from decimal import InvalidOperation
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+COUNT_CAP = 1000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def queryset_ordering(queryset, default='-pk'):
+    """Return the leading field ordering terms of ``queryset`` (e.g. ``['-price']``)."""
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    terms = []
+    for term in ordering:
+        if not isinstance(term, str) or term == '?':
+            break
+        terms.append(term)
+    return terms or [default]
+
+
+def estimate_count(queryset, cap=COUNT_CAP):
+    """
+    Count ``queryset`` without an unbounded scan.
+
+    Returns ``(count, exact)``: an exact count up to ``cap``; past that, the
+    planner's row estimate on Postgres or ``cap`` itself.
+    """
+    queryset = queryset.order_by()
+    bounded = queryset[:cap + 1].count()
+    if bounded <= cap:
+        return bounded, True
+    if connections[queryset.db].vendor == 'postgresql':
+        plan = json.loads(queryset.explain(format='json'))
+        return max(int(plan[0]['Plan']['Plan Rows']), cap), False
+    return cap, False
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    """
+    Paginate ``queryset`` on ``ordering`` (one or more fields, each
+    optionally ``-`` prefixed) with the primary key as the final tiebreaker.
+    """
+
+    def __init__(self, queryset, per_page, ordering=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        ordering = ordering or queryset_ordering(queryset)
+        if isinstance(ordering, str):
+            ordering = [ordering]
+        # [(field, descending)]; the primary key closes the key, in the
+        # direction it is ordered in or else in the last field's.
+        self.keys = []
+        for term in ordering:
+            field, descending = term.lstrip('-'), term.startswith('-')
+            if field in ('pk', queryset.model._meta.pk.name):
+                break
+            self.keys.append((field, descending))
+        else:
+            descending = self.keys[-1][1] if self.keys else True
+        self.pk_descending = descending
+
+    def _to_python(self, field, value):
+        if field in self.queryset.query.annotations:
+            return self.queryset.query.annotations[field].output_field.to_python(value)
+        model = self.queryset.model
+        try:
+            for part in field.split('__')[:-1]:
+                model = model._meta.get_field(part).related_model
+            return model._meta.get_field(field.split('__')[-1]).to_python(value)
+        except FieldDoesNotExist:
+            return value
+
+    def _value_of(self, obj, field):
+        for part in field.split('__'):
+            obj = getattr(obj, part)
+        return obj
+
+    def encode_cursor(self, obj, reverse):
+        values = []
+        for field, _ in self.keys:
+            value = self._value_of(obj, field)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        payload = json.dumps({'v': values, 'pk': obj.pk, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values = payload['v'] if isinstance(payload['v'], list) else [payload['v']]
+            if len(values) != len(self.keys):
+                raise ValueError('cursor does not match the ordering')
+            values = [self._to_python(field, value) for (field, _), value in zip(self.keys, values)]
+            return values, int(payload['pk']), bool(payload['r'])
+        except (binascii.Error, ValueError, KeyError, TypeError, ValidationError, InvalidOperation) as exc:
+            raise InvalidCursor('Invalid cursor') from exc
+
+    def page(self, cursor=None):
+        queryset = self.queryset
+        reverse = False
+        terms = self.keys + [('pk', self.pk_descending)]
+        if cursor:
+            values, pk, reverse = self.decode_cursor(cursor)
+            values.append(pk)
+            # Rows after the boundary: equal on every earlier key and past it
+            # on this one. Walking backwards flips each comparison as well as
+            # the ordering.
+            after = Q()
+            for index, (field, descending) in enumerate(terms):
+                op = 'lt' if descending != reverse else 'gt'
+                equal = {name: value for (name, _), value in zip(terms[:index], values)}
+                after |= Q(**equal, **{f'{field}__{op}': values[index]})
+            queryset = queryset.filter(after)
+
+        order = [f"{'-' if descending != reverse else ''}{field}" for field, descending in terms]
+        rows = list(queryset.order_by(*order)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+
+        next_cursor = self.encode_cursor(rows[-1], reverse=False) if rows and has_next else None
+        previous_cursor = self.encode_cursor(rows[0], reverse=True) if rows and has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor)
+
+
+class KeysetPagination(BasePagination):
+    """
+    DRF pagination over ``KeysetPaginator``. The key is the queryset's
+    ordering (so ``OrderingFilter`` keeps working), falling back to the
+    view's ``keyset_ordering``. Pass ``?count=1`` for a bounded count.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    default_ordering = '-pk'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        default = getattr(view, 'keyset_ordering', self.default_ordering)
+        paginator = KeysetPaginator(
+            queryset, self.get_page_size(request), queryset_ordering(queryset, default),
+        )
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = estimate_count(queryset)
+        return self.page.object_list
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self._link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self._link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+        ])
+        if self.count is not None:
+            payload['count'], payload['count_exact'] = self.count
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'count_exact': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,201 @@
+"""
+Async PayPal REST client.
+
+One ``PayPalClient`` per process holds an OAuth token that is reused until
+shortly before it expires, and one pooled ``httpx.AsyncClient`` per event
+loop, since a pool cannot be shared between loops. Under ASGI that is one
+pool for the life of the server's loop, so payments reuse warm HTTPS
+connections; the job worker keeps one long-lived loop per thread for the
+same reason (see store.tasks). A pool opened in a one-off loop (an async
+view under WSGI, ``async_to_sync``) is closed when that loop shuts down.
+Concurrent requests on a loop share a single token refresh.
+
+``PAYPAL_API_BASE`` overrides the endpoint implied by ``PAYPAL_MODE``, e.g.
+to point at the stub server in store.paypal_stub.
+"""
+import asyncio
+import threading
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+
+API_BASES = {
+    'sandbox': 'https://api-m.sandbox.paypal.com',
+    'live': 'https://api-m.paypal.com',
+}
+# Refresh the token this many seconds before PayPal would reject it.
+TOKEN_LEEWAY = 60
+
+
+class PayPalError(Exception):
+    def __init__(self, message, status=None, transient=False):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        # Network failures, timeouts, 429 and 5xx are worth retrying later.
+        self.transient = transient
+
+
+class _Session:
+    __slots__ = ('http', 'token_lock', 'closer')
+
+    def __init__(self, http, token_lock, closer):
+        self.http = http
+        self.token_lock = token_lock
+        self.closer = closer
+
+
+class PayPalClient:
+    def __init__(self, base_url, client_id, client_secret, timeout=10.0, max_connections=100):
+        self.base_url = base_url
+        self.auth = (client_id, client_secret)
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections,
+        )
+        # Event loop -> _Session; loops run in different threads.
+        self._sessions = weakref.WeakKeyDictionary()
+        self._sessions_lock = threading.Lock()
+        # (token, monotonic expiry), replaced as a whole.
+        self._token = (None, 0)
+
+    async def _session(self):
+        """The pool of the running loop, opened on first use."""
+        loop = asyncio.get_running_loop()
+        with self._sessions_lock:
+            session = self._sessions.get(loop)
+        if session is None:
+            http = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+            session = _Session(http, asyncio.Lock(), self._close_with_loop(http))
+            with self._sessions_lock:
+                self._sessions[loop] = session
+            # Registers the generator with the loop, whose shutdown_asyncgens()
+            # (run by asyncio.run) closes it and so the pool.
+            await session.closer.__anext__()
+        return session
+
+    async def _close_with_loop(self, http):
+        try:
+            yield
+        finally:
+            with self._sessions_lock:
+                self._sessions.pop(asyncio.get_running_loop(), None)
+            await http.aclose()
+
+    async def _send(self, method, path, **kwargs):
+        http = (await self._session()).http
+        try:
+            response = await http.request(method, path, **kwargs)
+        except httpx.HTTPError as exc:
+            raise PayPalError(f'PayPal unreachable: {exc}', transient=True) from exc
+        if response.status_code >= 400:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+            message = body.get('message') or body.get('error_description') or response.reason_phrase
+            transient = response.status_code == 429 or response.status_code >= 500
+            raise PayPalError(message, status=response.status_code, transient=transient)
+        return response.json()
+
+    async def access_token(self):
+        token, expires = self._token
+        if token and time.monotonic() < expires:
+            return token
+        session = await self._session()
+        async with session.token_lock:
+            # Another request may have refreshed it while this one waited.
+            token, expires = self._token
+            if not token or time.monotonic() >= expires:
+                data = await self._send(
+                    'POST', '/v1/oauth2/token',
+                    data={'grant_type': 'client_credentials'}, auth=self.auth,
+                )
+                token = data['access_token']
+                self._token = (token, time.monotonic() + data['expires_in'] - TOKEN_LEEWAY)
+        return token
+
+    async def request(self, method, path, json=None):
+        for retry in (False, True):
+            token = await self.access_token()
+            try:
+                return await self._send(
+                    method, path, json=json, headers={'Authorization': f'Bearer {token}'},
+                )
+            except PayPalError as exc:
+                # A revoked or early-expired token: fetch a new one once.
+                if exc.status != 401 or retry:
+                    raise
+                if self._token[0] == token:
+                    self._token = (None, 0)
+
+    async def create_payment(self, payment):
+        return await self.request('POST', '/v1/payments/payment', json=payment)
+
+    async def execute_payment(self, payment_id, payer_id):
+        return await self.request(
+            'POST', f'/v1/payments/payment/{payment_id}/execute', json={'payer_id': payer_id},
+        )
+
+    async def aclose(self):
+        """Close the running loop's pool now instead of at loop shutdown."""
+        with self._sessions_lock:
+            session = self._sessions.get(asyncio.get_running_loop())
+        if session is not None:
+            await session.closer.aclose()
+
+
+_clients = {}
+
+
+def get_paypal_client():
+    """The process-wide client for the configured PayPal account."""
+    base_url = getattr(settings, 'PAYPAL_API_BASE', None) or API_BASES[settings.PAYPAL_MODE]
+    key = (base_url, settings.PAYPAL_CLIENT_ID, settings.PAYPAL_CLIENT_SECRET)
+    if key not in _clients:
+        _clients[key] = PayPalClient(
+            base_url, settings.PAYPAL_CLIENT_ID, settings.PAYPAL_CLIENT_SECRET,
+            timeout=getattr(settings, 'PAYPAL_TIMEOUT', 10.0),
+            max_connections=getattr(settings, 'PAYPAL_MAX_CONNECTIONS', 100),
+        )
+    return _clients[key]
+
+
+def payment_request(order, return_url, cancel_url):
+    """The PayPal ``Payment`` body for ``order``."""
+    total = str(order.get_total_price_for_order)  # property, no ()
+    return {
+        'intent': 'sale',
+        'payer': {'payment_method': 'paypal'},
+        'redirect_urls': {'return_url': return_url, 'cancel_url': cancel_url},
+        'transactions': [{
+            'item_list': {
+                'items': [{
+                    'name': f'Order {order.id}',
+                    'sku': 'item',
+                    'price': total,
+                    'currency': 'USD',
+                    'quantity': 1,
+                }]
+            },
+            'amount': {'total': total, 'currency': 'USD'},
+            'description': f'Payment for Order {order.id}',
+        }],
+    }
+
+
+def approval_url(payment):
+    return next(
+        (link['href'] for link in payment.get('links', []) if link.get('rel') == 'approval_url'),
+        None,
+    )
+
+
+def order_id_from_payment(payment):
+    """Parse our order id back out of the transaction description; raises ValueError."""
+    try:
+        return int(payment['transactions'][0]['description'].split()[-1])
+    except (KeyError, IndexError, TypeError) as exc:
+        raise ValueError('Could not parse order ID') from exc
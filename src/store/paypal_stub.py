@@ -0,0 +1,108 @@
+"""
+A local stand-in for the PayPal REST API, for tests and benchmarks.
+
+It implements just what store.paypal uses (OAuth token, payment create and
+execute) and can add artificial latency to mimic the real round trip::
+
+    server = StubPayPalServer(latency=0.2).start()
+    # settings.PAYPAL_API_BASE = server.url
+    server.stop()
+
+or run it standalone with ``manage.py paypal_stub``.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EXECUTE_RE = re.compile(r'^/v1/payments/payment/(?P<id>[^/]+)/execute$')
+
+
+class StubPayPalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        stub = self.server
+        body = self._body()
+        time.sleep(stub.latency)
+
+        if self.path == '/v1/oauth2/token':
+            with stub.lock:
+                stub.token_requests += 1
+                stub.token = uuid.uuid4().hex
+            return self._reply(200, {
+                'access_token': stub.token, 'token_type': 'Bearer', 'expires_in': stub.token_ttl,
+            })
+
+        if self.headers.get('Authorization') != f'Bearer {stub.token}':
+            return self._reply(401, {'name': 'AUTHENTICATION_FAILURE', 'message': 'Invalid token'})
+
+        if self.path == '/v1/payments/payment':
+            payment = json.loads(body)
+            payment.update(id=f'PAYID-{uuid.uuid4().hex[:12].upper()}', state='created')
+            payment['links'] = [{
+                'rel': 'approval_url', 'method': 'REDIRECT',
+                'href': f'https://www.sandbox.paypal.com/checkoutnow?token={payment["id"]}',
+            }]
+            with stub.lock:
+                stub.payments[payment['id']] = payment
+            return self._reply(201, payment)
+
+        match = EXECUTE_RE.match(self.path)
+        if match:
+            with stub.lock:
+                payment = stub.payments.get(match['id'])
+                if payment is None or payment['state'] != 'created':
+                    return self._reply(400, {'name': 'PAYMENT_NOT_APPROVED_FOR_EXECUTION',
+                                             'message': 'Payment cannot be executed'})
+                payment['state'] = 'approved'
+                payment['payer'] = {**payment.get('payer', {}), 'payer_id': json.loads(body).get('payer_id')}
+            return self._reply(200, payment)
+
+        return self._reply(404, {'name': 'NOT_FOUND', 'message': 'Unknown endpoint'})
+
+
+class StubPayPalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, token_ttl=32400):
+        super().__init__((host, port), StubPayPalHandler)
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.lock = threading.Lock()
+        self.token = None
+        self.token_requests = 0
+        self.payments = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve from a background thread and return ``self``."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
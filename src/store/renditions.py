@@ -0,0 +1,115 @@
+"""
+Product image renditions.
+
+Each product image is rendered once into fixed-width derivatives (``thumb``,
+``card``, ``detail`` at 1x and 2x) in WebP plus a JPEG fallback by the
+``store.make_product_renditions`` job, queued when a product's image changes
+or, for images uploaded before this existed, on first render. File names
+carry a hash of the source bytes, so a URL's content never changes: they can
+be served with ``Cache-Control: immutable`` and identical uploads share files.
+``{% product_image %}`` (store_images tags) emits the ``<picture>``/``srcset``
+markup and falls back to the original until the renditions exist.
+"""
+import hashlib
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+# Rendition name -> widths to render (1x, 2x).
+RENDITIONS = {
+    'thumb': (80, 160),
+    'card': (400, 800),
+    'detail': (600, 1200),
+}
+# (key, Pillow format, MIME type), preferred first; the last one is the fallback.
+FORMATS = (
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpeg', 'JPEG', 'image/jpeg'),
+)
+# Bump to regenerate every rendition after changing the specs above.
+RENDITION_VERSION = 1
+QUALITY = 80
+MAX_SOURCE_PIXELS = 40_000_000
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+QUEUED_TIMEOUT = 10 * 60
+
+
+class UnprocessableImage(ValueError):
+    pass
+
+
+def source_digest(file, chunk_size=64 * 1024):
+    digest = hashlib.sha256(f'v{RENDITION_VERSION}:'.encode())
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()[:20]
+
+
+def rendition_path(digest, name, width, ext):
+    return f'renditions/{digest[:2]}/{digest}/{name}-{width}.{ext}'
+
+
+def failed_renditions(image_name, error):
+    """Recorded instead of renditions so a broken image is not queued again."""
+    return {'source': image_name, 'version': RENDITION_VERSION, 'error': error}
+
+
+def is_current(product):
+    renditions = product.renditions or {}
+    return (
+        renditions.get('source') == product.image.name
+        and renditions.get('version') == RENDITION_VERSION
+    )
+
+
+def _open_source(file):
+    image = Image.open(file)  # Reads the header only.
+    if image.width * image.height > MAX_SOURCE_PIXELS:
+        raise UnprocessableImage(f'{image.width}x{image.height} is too large to render')
+    largest = max(max(widths) for widths in RENDITIONS.values())
+    # JPEGs decode straight at a reduced scale instead of at full size.
+    image.draft('RGB', (largest, largest))
+    return ImageOps.exif_transpose(image).convert('RGB')
+
+
+def build_renditions(image_file):
+    """Render every rendition of ``image_file`` (a FieldFile) and return the map to store."""
+    storage = image_file.storage
+    try:
+        with storage.open(image_file.name) as source:
+            digest = source_digest(source)
+            source.seek(0)
+            image = _open_source(source)
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise UnprocessableImage(f'Unreadable image {image_file.name}') from exc
+
+    sets = {}
+    for name, widths in RENDITIONS.items():
+        # Never upscale: widths past the source collapse into the source width.
+        for width in sorted({min(width, image.width) for width in widths}):
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            for ext, pillow_format, _ in FORMATS:
+                path = rendition_path(digest, name, width, ext)
+                if not storage.exists(path):
+                    output = BytesIO()
+                    resized.save(output, pillow_format, quality=QUALITY)
+                    path = storage.save(path, ContentFile(output.getvalue()))
+                sets.setdefault(name, {}).setdefault(ext, []).append([width, path])
+    return {
+        'source': image_file.name,
+        'version': RENDITION_VERSION,
+        'size': [image.width, image.height],
+        'sets': sets,
+    }
+
+
+def request_renditions(product):
+    """Queue rendering of ``product``'s current image, at most once per image."""
+    from .tasks import make_product_renditions
+
+    image_key = hashlib.md5(product.image.name.encode()).hexdigest()
+    if cache.add(f'product_{product.pk}_renditions_{image_key}', True, QUEUED_TIMEOUT):
+        make_product_renditions.delay(product_id=product.pk, image_name=product.image.name)
@@ -0,0 +1,159 @@
+"""
+Full-text product search.
+
+Postgres keeps a weighted ``tsvector`` in ``Product.search_vector`` behind a
+GIN index; SQLite (dev and tests) keeps an FTS5 shadow table keyed by product
+id. Both are kept in sync from store.signals and rebuilt with the
+``rebuild_search_index`` management command. Any other backend falls back to
+the old ``icontains`` scan.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, FloatField, OuterRef, Q, Subquery
+from django.db.models.expressions import RawSQL
+
+from .models import Category, Product
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a user query into safe word tokens (no operators reach the engine)."""
+    return TOKEN_RE.findall(query or '')
+
+
+class FallbackSearchBackend:
+    """Unindexed substring search, used on databases without a native engine."""
+
+    def setup(self):
+        pass
+
+    def index(self, product_ids):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def search(self, queryset, query):
+        condition = Q()
+        for token in tokenize(query):
+            condition &= Q(name__icontains=token) | Q(description__icontains=token)
+        return queryset.filter(condition)
+
+
+class PostgresSearchBackend:
+    index_name = 'store_product_search_gin'
+
+    def __init__(self):
+        self.config = getattr(settings, 'PRODUCT_SEARCH_CONFIG', 'english')
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {self.index_name} '
+                f'ON {Product._meta.db_table} USING gin (search_vector)'
+            )
+
+    def _vector(self):
+        from django.contrib.postgres.search import SearchVector
+
+        category_name = Subquery(
+            Category.objects.filter(pk=OuterRef('category_id')).values('name')[:1]
+        )
+        return (
+            SearchVector('name', weight='A', config=self.config)
+            + SearchVector(category_name, weight='B', config=self.config)
+            + SearchVector('description', weight='C', config=self.config)
+        )
+
+    def index(self, product_ids):
+        Product.objects.filter(pk__in=product_ids).update(search_vector=self._vector())
+
+    def remove(self, product_ids):
+        pass  # The vector lives on the product row itself.
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        search_query = SearchQuery(
+            ' & '.join(f'{token}:*' for token in tokens),
+            search_type='raw', config=self.config,
+        )
+        return (
+            queryset.filter(search_vector=search_query)
+            .annotate(search_rank=SearchRank(F('search_vector'), search_query))
+            .order_by('-search_rank', '-created_at')
+        )
+
+
+class SQLiteSearchBackend:
+    table = 'store_product_fts'
+    # bm25() column weights for (name, category, description).
+    weights = '10.0, 5.0, 1.0'
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+                f"USING fts5(name, category, description, tokenize='unicode61')"
+            )
+
+    def index(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', product_ids)
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, name, category, description) '
+                f'SELECT p.id, p.name, COALESCE(c.name, \'\'), p.description '
+                f'FROM {Product._meta.db_table} p '
+                f'LEFT JOIN {Category._meta.db_table} c ON c.id = p.category_id '
+                f'WHERE p.id IN ({placeholders})',
+                product_ids,
+            )
+
+    def remove(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', product_ids)
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        product_table = Product._meta.db_table
+        return (
+            queryset.filter(pk__in=RawSQL(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [match]
+            ))
+            .annotate(search_rank=RawSQL(
+                f'SELECT -bm25({self.table}, {self.weights}) FROM {self.table} '
+                f'WHERE {self.table} MATCH %s AND rowid = {product_table}.id', [match],
+                output_field=FloatField(),
+            ))
+            .order_by('-search_rank', '-created_at')
+        )
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    return FallbackSearchBackend()
+
+
+def search_products(queryset, query):
+    """Filter ``queryset`` to products matching ``query``, best matches first."""
+    return get_search_backend().search(queryset, query)
@@ -1,5 +1,13 @@
+from django.db import models
 from rest_framework import serializers
-from .models import Product, Order, OrderItem, ShippingInfo, Review
+from .models import Product, Order, OrderItem, ShippingInfo, Review, resolve_discounted_prices
+
+
+class CategoryNavigationSerializer(serializers.Serializer):
+    name = serializers.CharField()
+    slug = serializers.SlugField()
+    product_count = serializers.IntegerField()
+    in_stock_count = serializers.IntegerField()
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -11,27 +19,91 @@ class ReviewSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'username', 'created_at']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class PricedListSerializer(serializers.ListSerializer):
+    """Resolves discounted prices for the whole page before serializing rows."""
+
+    def to_representation(self, data):
+        products = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if 'discounted_price' in self.child.fields:
+            resolve_discounted_prices(products)
+        return super().to_representation(products)
+
+
+class SparseFieldsMixin:
+    """Honour ``?fields=a,b`` by dropping every other field from the output."""
+    fields_query_param = 'fields'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.get_requested_fields(self.context.get('request'))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """Return the requested subset of ``Meta.fields``, or None for all of them."""
+        raw = request.query_params.get(cls.fields_query_param) if request is not None else None
+        if not raw:
+            return None
+        requested = {name.strip() for name in raw.split(',')} & set(cls.Meta.fields)
+        return requested or None
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """List representation: no reviews, and only the columns a client asks for."""
     category_name = serializers.CharField(source='category.name', read_only=True)
     discounted_price = serializers.SerializerMethodField()
-    reviews = ReviewSerializer(many=True, read_only=True)
+
+    # Columns each serializer field needs; anything absent maps to itself.
+    field_columns = {
+        'category_name': ['category__name'],
+        'discounted_price': ['price'],
+    }
+    # Lookup and keyset-pagination columns, loaded whatever the fieldset.
+    always_loaded = ['id', 'slug', 'price', 'effective_price', 'rating', 'created_at']
 
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'slug', 'description',
             'category', 'category_name',
-            'price', 'discounted_price',
+            'price', 'discounted_price', 'effective_price',
             'digital', 'image',
             'stock', 'rating', 'num_reviews',
-            'created_at', 'reviews',
+            'created_at',
         ]
-        read_only_fields = ['id', 'slug', 'rating', 'num_reviews', 'created_at']
+        read_only_fields = ['id', 'slug', 'effective_price', 'rating', 'num_reviews', 'created_at']
+        list_serializer_class = PricedListSerializer
+
+    @classmethod
+    def narrow_queryset(cls, queryset, fields=None):
+        """Restrict the SELECT (and joins/prefetches) to what ``fields`` render."""
+        fields = fields or set(cls.Meta.fields)
+        columns = set(cls.always_loaded)
+        for name in fields:
+            columns.update(cls.field_columns.get(name, [name]))
+        if any(column.startswith('category__') for column in columns):
+            queryset = queryset.select_related('category')
+        if 'discounted_price' in fields:
+            queryset = queryset.prefetch_related('discount')
+        return queryset.only(*columns)
 
     def get_discounted_price(self, obj):
         return str(obj.get_discounted_price())
 
 
+class ProductDetailSerializer(ProductSerializer):
+    """Detail representation; reviews are paged separately via ``reviews_url``."""
+    reviews_url = serializers.HyperlinkedIdentityField(
+        view_name='store:product-reviews', lookup_field='slug',
+    )
+    field_columns = {**ProductSerializer.field_columns, 'reviews_url': ['slug']}
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ['reviews_url']
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     total_price = serializers.SerializerMethodField()
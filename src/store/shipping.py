@@ -0,0 +1,114 @@
+"""
+Shipping cost engine.
+
+An order's shipping profile (physical line count and whether it holds
+digital goods) comes from one aggregate query. Rates come from the
+``ShippingZone`` table, held in an in-process lookup that is rebuilt whenever
+the shared ``shipping_rate_table_version`` changes (bumped from
+store.signals on every zone edit). With no zones configured the built-in
+table below applies.
+"""
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import ShippingZone
+
+RATE_TABLE_VERSION_KEY = 'shipping_rate_table_version'
+CENT = Decimal('0.01')
+
+Rate = namedtuple('Rate', ['base_cost', 'per_item_cost', 'multiplier'])
+
+DEFAULT_RATE = Rate(Decimal('5.00'), Decimal('2.00'), Decimal('1.0'))
+BUILTIN_COUNTRY_RATES = {
+    **dict.fromkeys(['US', 'CA'], DEFAULT_RATE._replace(multiplier=Decimal('1.2'))),
+    **dict.fromkeys(['GB', 'DE', 'FR'], DEFAULT_RATE._replace(multiplier=Decimal('1.3'))),
+}
+
+
+class ShippingProfile(namedtuple('ShippingProfile', ['physical_items', 'has_digital'])):
+    __slots__ = ()
+
+    @property
+    def requires_shipping(self):
+        return self.physical_items > 0
+
+
+class RateTable:
+    def __init__(self, country_rates, default_rate):
+        self.country_rates = country_rates
+        self.default_rate = default_rate
+
+    def rate_for(self, country_code):
+        return self.country_rates.get(country_code, self.default_rate)
+
+    @classmethod
+    def load(cls):
+        zones = list(ShippingZone.objects.all())
+        if not zones:
+            return cls(BUILTIN_COUNTRY_RATES, DEFAULT_RATE)
+
+        country_rates, default_rate = {}, DEFAULT_RATE
+        for zone in zones:
+            rate = Rate(zone.base_cost, zone.per_item_cost, zone.multiplier)
+            if zone.is_default:
+                default_rate = rate
+            for country in zone.countries:
+                country_rates[country.code] = rate
+        return cls(country_rates, default_rate)
+
+
+_local = {'version': None, 'table': None}
+
+
+def _current_version():
+    version = cache.get(RATE_TABLE_VERSION_KEY)
+    if version is None:
+        cache.add(RATE_TABLE_VERSION_KEY, time.time_ns() // 1000, None)
+        version = cache.get(RATE_TABLE_VERSION_KEY)
+    return version
+
+
+def get_rate_table():
+    """Return the in-process rate table, reloading it if any process changed the zones."""
+    version = _current_version()
+    if _local['version'] != version or _local['table'] is None:
+        _local['table'] = RateTable.load()
+        _local['version'] = version
+    return _local['table']
+
+
+def invalidate_rate_table():
+    try:
+        cache.incr(RATE_TABLE_VERSION_KEY)
+    except ValueError:
+        cache.set(RATE_TABLE_VERSION_KEY, time.time_ns() // 1000, None)
+    _local['table'] = None
+
+
+def get_shipping_profile(order):
+    """Physical line count and digital flag of ``order`` in one aggregate."""
+    result = order.orderitem_set.aggregate(
+        physical_items=Count('id', filter=Q(product__digital=False)),
+        digital_items=Count('id', filter=Q(product__digital=True)),
+    )
+    return ShippingProfile(result['physical_items'], result['digital_items'] > 0)
+
+
+def quote_shipping(profile, country_code=None, rate_table=None):
+    """Shipping cost for ``profile`` delivered to ``country_code``."""
+    if not profile.requires_shipping:
+        return Decimal('0.00')
+    rate = (rate_table or get_rate_table()).rate_for(country_code)
+    cost = (rate.base_cost + rate.per_item_cost * profile.physical_items) * rate.multiplier
+    return cost.quantize(CENT)
+
+
+def quote_destinations(order, country_codes):
+    """Price one cart against many destinations with a single aggregate query."""
+    profile = get_shipping_profile(order)
+    rate_table = get_rate_table()
+    return {code: quote_shipping(profile, code, rate_table) for code in country_codes}
@@ -0,0 +1,152 @@
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    Category, Discount, OrderItem, Product, Review, ShippingZone,
+    adjust_order_totals, adjust_product_rating, bump_pricing_generation, move_category_listing,
+    refresh_effective_prices,
+)
+from .page_cache import invalidate_catalog
+from .renditions import is_current, request_renditions
+from .search import get_search_backend
+from .shipping import invalidate_rate_table
+
+
+def _discount_products(discount):
+    return Product.objects.filter(discount=discount)
+
+
+@receiver(post_save, sender=Discount)
+def reprice_on_discount_save(sender, instance, **kwargs):
+    """Activation, deactivation and percentage edits all change effective prices."""
+    bump_pricing_generation()
+    refresh_effective_prices(_discount_products(instance))
+
+
+@receiver(pre_delete, sender=Discount)
+def remember_discount_products(sender, instance, **kwargs):
+    # The M2M rows are gone by post_delete, so capture the affected ids first.
+    instance._repriced_product_ids = list(
+        _discount_products(instance).values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Discount)
+def reprice_on_discount_delete(sender, instance, **kwargs):
+    product_ids = getattr(instance, '_repriced_product_ids', [])
+    bump_pricing_generation()
+    refresh_effective_prices(Product.objects.filter(pk__in=product_ids))
+
+
+@receiver(m2m_changed, sender=Product.discount.through)
+def reprice_on_discount_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    """Handle both ``product.discount.add()`` and ``discount.products_discount.add()``."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_pricing_generation()
+
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_effective_prices(Product.objects.filter(pk=instance.pk))
+        return
+
+    if action == 'pre_clear':
+        instance._repriced_product_ids = list(
+            _discount_products(instance).values_list('pk', flat=True)
+        )
+    elif action == 'post_clear':
+        product_ids = getattr(instance, '_repriced_product_ids', [])
+        refresh_effective_prices(Product.objects.filter(pk__in=product_ids))
+    elif action in ('post_add', 'post_remove'):
+        refresh_effective_prices(Product.objects.filter(pk__in=pk_set or []))
+
+
+@receiver(post_migrate)
+def setup_search_index(sender, **kwargs):
+    if sender.name == 'store':
+        get_search_backend().setup()
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_search_backend().index([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def render_product_image(sender, instance, raw=False, **kwargs):
+    if not raw and instance.image and not is_current(instance):
+        request_renditions(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(pre_delete, sender=Product)
+def remember_product_listing(sender, instance, **kwargs):
+    if instance._persisted_listing is None:
+        instance._persisted_listing = instance._stored_listing()
+
+
+@receiver(post_delete, sender=Product)
+def release_product_listing(sender, instance, **kwargs):
+    move_category_listing(instance._persisted_listing, (None, False))
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, raw=False, **kwargs):
+    # A renamed category changes the indexed text of all of its products.
+    if not created and not raw:
+        get_search_backend().index(
+            Product.objects.filter(category=instance).values_list('pk', flat=True)
+        )
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def touch_category_products(sender, instance, raw=False, **kwargs):
+    # Products show their category's name, so renaming or removing it
+    # changes them too (see store.conditional).
+    if not raw:
+        Product.objects.filter(category=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=OrderItem)
+def release_order_totals(sender, instance, **kwargs):
+    # Runs inside the delete's transaction, including queryset.delete().
+    order_id, quantity, total = instance._persisted_line
+    adjust_order_totals(order_id, -quantity, -total)
+
+
+@receiver(post_delete, sender=Review)
+def release_review_rating(sender, instance, **kwargs):
+    # Fires for queryset deletes and ReviewViewSet.destroy alike.
+    product_id, rating = instance._persisted_rating
+    adjust_product_rating(product_id, -1, -rating)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def expire_catalog_pages(sender, raw=False, **kwargs):
+    if not raw:
+        invalidate_catalog()
+
+
+@receiver(m2m_changed, sender=Product.discount.through)
+def expire_catalog_pages_on_discount_membership(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_catalog()
+
+
+@receiver(post_save, sender=ShippingZone)
+@receiver(post_delete, sender=ShippingZone)
+def reload_shipping_rates(sender, **kwargs):
+    invalidate_rate_table()
@@ -0,0 +1,149 @@
+"""
+Background job handlers (see store.jobs), run by ``run_worker``: order
+confirmation mail, PayPal calls, product image renditions, catalog imports
+and the daily discount expiry.
+"""
+import asyncio
+import io
+import threading
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.core.files.storage import default_storage
+from django.core.mail import send_mail
+from django.utils import timezone
+
+from .catalog_io import DEFAULT_BATCH_SIZE, CatalogFormatError, import_catalog
+from .jobs import PermanentJobError, enqueue, job
+from .models import Discount, Job, Order, Product
+from .page_cache import invalidate_catalog
+from .paypal import (
+    PayPalError, approval_url, get_paypal_client, order_id_from_payment, payment_request,
+)
+from .renditions import UnprocessableImage, build_renditions, failed_renditions
+
+
+@job('store.send_order_confirmation')
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('customer').get(pk=order_id)
+    if not order.customer.email:
+        return {'sent': False}
+    send_mail(
+        f'Order {order.id} confirmed',
+        f'Thank you for your order. Transaction: {order.transaction_id}\n'
+        f'Total: ${order.get_cart_total}',
+        None,
+        [order.customer.email],
+    )
+    return {'sent': True}
+
+
+@job('store.make_product_renditions')
+def make_product_renditions(product_id, image_name):
+    product = Product.objects.filter(pk=product_id, image=image_name).only('id', 'image').first()
+    if product is None:
+        return {'skipped': True}  # Replaced again before this job ran.
+    try:
+        renditions = build_renditions(product.image)
+    except UnprocessableImage as exc:
+        Product.objects.filter(pk=product_id, image=image_name).update(
+            renditions=failed_renditions(image_name, str(exc)),
+        )
+        raise PermanentJobError(str(exc)) from exc
+    Product.objects.filter(pk=product_id, image=image_name).update(renditions=renditions)
+    return {'renditions': sorted(renditions['sets'])}
+
+
+_worker_loop = threading.local()
+
+
+def _run_on_worker_loop(coroutine):
+    """
+    Run ``coroutine`` on this thread's long-lived event loop, so the PayPal
+    client's connection pool for that loop is reused from job to job.
+    """
+    loop = getattr(_worker_loop, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _worker_loop.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coroutine)
+
+
+def _paypal_call(call, *args):
+    """Run a client coroutine from the worker; only transient failures are retried."""
+    try:
+        return _run_on_worker_loop(call(*args))
+    except PayPalError as exc:
+        if exc.transient:
+            raise
+        raise PermanentJobError(exc.message) from exc
+
+
+def mark_order_paid(user_id, payment):
+    order = Order.objects.filter(pk=order_id_from_payment(payment), customer_id=user_id).first()
+    if order is None:
+        raise Order.DoesNotExist
+    order.payment_status = 'Paid'
+    order.save()
+    return order
+
+
+@job('store.create_paypal_payment', max_attempts=3)
+def create_paypal_payment(user_id, order_id, return_url, cancel_url):
+    order = Order.objects.filter(pk=order_id, customer_id=user_id).first()
+    if order is None:
+        raise PermanentJobError(f'Order {order_id} not found')
+    payment = _paypal_call(
+        get_paypal_client().create_payment, payment_request(order, return_url, cancel_url),
+    )
+    return {'payment_id': payment['id'], 'approval_url': approval_url(payment)}
+
+
+@job('store.execute_paypal_payment', max_attempts=3)
+def execute_paypal_payment(user_id, payment_id, payer_id):
+    payment = _paypal_call(get_paypal_client().execute_payment, payment_id, payer_id)
+    try:
+        order = mark_order_paid(user_id, payment)
+    except (ValueError, Order.DoesNotExist) as exc:
+        raise PermanentJobError(f'No order for payment {payment_id}') from exc
+    return {'order_id': order.id}
+
+
+@job('store.import_catalog', max_attempts=3)
+def import_catalog_file(name, file_format, batch_size=DEFAULT_BATCH_SIZE):
+    """Import a catalog uploaded through the API; rows are upserts, so a retry is harmless."""
+    try:
+        with default_storage.open(name, 'rb') as raw:
+            stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+            summary = import_catalog(stream, file_format, batch_size)
+    except FileNotFoundError as exc:
+        raise PermanentJobError(f'{name} no longer exists') from exc
+    except (CatalogFormatError, UnicodeDecodeError) as exc:
+        default_storage.delete(name)
+        raise PermanentJobError(str(exc)) from exc
+    default_storage.delete(name)
+    return summary
+
+
+def next_discount_expiry(now=None):
+    """Just after the coming midnight (UTC), when the day's discounts become overdue."""
+    tomorrow = ((now or timezone.now()) + timedelta(days=1)).astimezone(dt_timezone.utc).date()
+    return datetime.combine(tomorrow, time(0, 5), tzinfo=dt_timezone.utc)
+
+
+def schedule_discount_expiry(run_at=None):
+    """Queue ``store.expire_discounts`` unless a run is already pending; returns the pending job."""
+    pending = Job.objects.filter(name=expire_discounts.job_name, status='pending').first()
+    return pending or enqueue(expire_discounts.job_name, run_at=run_at)
+
+
+@job('store.expire_discounts')
+def expire_discounts():
+    """
+    Daily: deactivate overdue discounts and reprice their products, so
+    listings sorted or filtered by ``effective_price`` drop them. Queues the
+    next day's run first, so a failure here does not end the schedule.
+    """
+    schedule_discount_expiry(next_discount_expiry())
+    expired = Discount.objects.expire_overdue()
+    if expired:
+        invalidate_catalog()
+    return {'expired': expired}
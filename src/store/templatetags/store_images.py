@@ -0,0 +1,41 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from store.renditions import FORMATS, RENDITIONS, is_current, request_renditions
+
+register = template.Library()
+
+
+def _srcset(storage, entries):
+    return ', '.join(f'{storage.url(path)} {width}w' for width, path in entries)
+
+
+@register.simple_tag
+def product_image(product, rendition='card', css_class='', alt=None):
+    """
+    ``<picture>`` for ``product`` at the ``rendition`` size: WebP and JPEG
+    ``srcset``s covering 1x and 2x screens, or the original image until the
+    renditions of its current image exist.
+    """
+    alt = product.name if alt is None else alt
+    current = is_current(product)
+    if not current:
+        request_renditions(product)
+    # Stale sets show a replaced image, or lack a size added since.
+    if not current or 'sets' not in product.renditions:
+        return format_html('<img class="{}" src="{}" alt="{}" loading="lazy">', css_class, product.image.url, alt)
+
+    storage = product.image.storage
+    sets = product.renditions['sets'][rendition]
+    sizes = f'{min(RENDITIONS[rendition])}px'
+    *preferred, (fallback, _, _) = FORMATS
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((mime, _srcset(storage, sets[ext]), sizes) for ext, _, mime in preferred),
+    )
+    fallback_entries = sets[fallback]
+    return format_html(
+        '<picture>{}<img class="{}" src="{}" srcset="{}" sizes="{}" alt="{}" loading="lazy"></picture>',
+        sources, css_class, storage.url(fallback_entries[0][1]),
+        _srcset(storage, fallback_entries), sizes, alt,
+    )
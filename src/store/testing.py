@@ -0,0 +1,100 @@
+"""
+Query budgets for tests.
+
+Every view and API endpoint of an app declares the most queries one request
+may run, for data large enough that an N+1 would exceed it::
+
+    class StoreQueryBudgetTest(QueryBudgetMixin, TestCase):
+        app = 'store'
+
+        def get_budgets(self):
+            return [
+                QueryBudget('store:cart', 'get', '/cart/', 6, user=self.buyer),
+                ...
+            ]
+
+A request over its budget fails with the captured SQL, repeated statements
+first, and an app view with no budget fails the suite too, so new endpoints
+cannot skip the check.
+"""
+from collections import Counter, namedtuple
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver
+
+from .instrumentation import fingerprint
+
+QueryBudget = namedtuple(
+    'QueryBudget', ['view', 'method', 'url', 'budget', 'data', 'user', 'status', 'content_type'],
+    defaults=(None, None, 200, None),
+)
+
+
+def iter_views(patterns=None, namespaces=()):
+    """Yield ``(view name, callback)`` for every named URL, as ``resolver_match.view_name`` spells it."""
+    patterns = get_resolver().url_patterns if patterns is None else patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            nested = namespaces + (pattern.namespace,) if pattern.namespace else namespaces
+            yield from iter_views(pattern.url_patterns, nested)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield ':'.join(namespaces + (pattern.name,)), pattern.callback
+
+
+def app_views(app):
+    """Names of the URLs served by views defined in ``app`` itself."""
+    return {name for name, callback in iter_views() if callback.__module__.startswith(f'{app}.')}
+
+
+def describe_queries(queries):
+    """The captured SQL, one line per statement, most repeated first."""
+    statements = Counter()
+    samples = {}
+    for query in queries:
+        key = fingerprint(query['sql'])[0]
+        statements[key] += 1
+        samples.setdefault(key, query['sql'])
+    return '\n'.join(f'  {count}x {samples[key]}' for key, count in statements.most_common())
+
+
+class QueryBudgetMixin:
+    """TestCase mixin checking ``get_budgets()`` against every view of ``app``."""
+    app = None
+
+    def get_budgets(self):
+        raise NotImplementedError
+
+    def assertWithinQueryBudget(self, budget, method, url, data=None, user=None, status=200, content_type=None):
+        """Request ``url`` and fail if it ran more than ``budget`` queries or answered another status."""
+        if user is not None:
+            self.client.force_login(user)
+        else:
+            self.client.logout()
+        extra = {'content_type': content_type} if content_type else {}
+        with CaptureQueriesContext(connections['default']) as captured:
+            response = getattr(self.client, method)(url, data, **extra)
+            if response.streaming:
+                response.getvalue()  # Streamed responses query while they are read.
+        self.assertEqual(response.status_code, status, f'{method.upper()} {url}')
+        queries = captured.captured_queries
+        if len(queries) > budget:
+            self.fail(
+                f'{method.upper()} {url} ran {len(queries)} queries, over its budget of {budget}:\n'
+                f'{describe_queries(queries)}'
+            )
+        return response
+
+    def test_query_budgets(self):
+        budgets = self.get_budgets()
+        for entry in budgets:
+            with self.subTest(view=entry.view, method=entry.method):
+                response = self.assertWithinQueryBudget(
+                    entry.budget, entry.method, entry.url, entry.data,
+                    entry.user, entry.status, entry.content_type,
+                )
+                self.assertEqual(response.resolver_match.view_name, entry.view)
+
+    def test_every_view_has_a_budget(self):
+        missing = app_views(self.app) - {entry.view for entry in self.get_budgets()}
+        self.assertFalse(missing, f'Views without a query budget: {sorted(missing)}')
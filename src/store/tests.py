@@ -1,3 +1,1385 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import skipUnless
+from decimal import Decimal
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.http import QueryDict
+from django.template import Context, Template
+from django.test import TestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from store.benchmark import compare_results, run_benchmark, seed_dataset
+from store.cart import (
+    NOT_FOUND, OUT_OF_STOCK, bump_cart_version, compute_cart_summary, get_active_order, get_cart_summary,
+    update_cart,
+)
+from store.catalog_io import export_catalog, import_catalog
+from store.facets import facet_counts, get_facets
+from store.instrumentation import RequestRecorder, registry
+from store.inventory import (
+    InsufficientStock, commit_order_stock, hold_order_stock, release_expired_holds,
+)
+from store.jobs import PermanentJobError, claim_jobs, job, run_pending
+from store.models import (
+    Category, Discount, IdempotencyKey, Job, Order, OrderItem, Product, Review, ShippingInfo,
+    ShippingZone, StockReservation, resolve_discounted_prices,
+)
+from store.navigation import get_category_navigation
+from store.order_export import ITEM_COLUMNS, ORDER_COLUMNS, export_orders
+from store.page_cache import get_catalog_version
+from store.pagination import InvalidCursor, KeysetPaginator
+from store.paypal import PayPalClient, get_paypal_client
+from store.paypal_stub import StubPayPalServer
+from store.renditions import RENDITION_VERSION, failed_renditions
+from store.search import search_products
+from store.shipping import get_shipping_profile, quote_shipping
+from store.tasks import create_paypal_payment, next_discount_expiry, schedule_discount_expiry
+from store.testing import QueryBudget, QueryBudgetMixin
+
+
+class ResolveDiscountedPricesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.discount = Discount.objects.create(
+            name='Sale', percentage=Decimal('10.00'), active=True,
+            expired_date=timezone.now().date() + timedelta(days=7),
+        )
+        cls.products = [
+            Product.objects.create(name=f'Product {i}', description='-', price=Decimal('100.00'))
+            for i in range(5)
+        ]
+        cls.products[0].discount.add(cls.discount)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_resolves_page_in_one_query(self):
+        products = list(Product.objects.all())
+        with self.assertNumQueries(1):
+            prices = resolve_discounted_prices(products)
+        self.assertEqual(prices[self.products[0].id], Decimal('90.00'))
+        self.assertEqual(prices[self.products[1].id], Decimal('100.00'))
+
+    def test_cached_prices_need_no_query(self):
+        resolve_discounted_prices(list(Product.objects.all()))
+        products = list(Product.objects.all())
+        with self.assertNumQueries(0):
+            resolve_discounted_prices(products)
+            for product in products:
+                product.get_discounted_price()
+
+    def test_discount_edit_invalidates_cached_prices(self):
+        resolve_discounted_prices(list(Product.objects.all()))
+        self.discount.percentage = Decimal('50.00')
+        self.discount.save()
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).get_discounted_price(), Decimal('50.00'))
+
+    def test_uses_prefetched_discounts(self):
+        products = list(Product.objects.prefetch_related('discount'))
+        with self.assertNumQueries(0):
+            prices = resolve_discounted_prices(products)
+        self.assertEqual(prices[self.products[0].id], Decimal('90.00'))
+
+
+class EffectivePriceTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Lamp', description='-', price=Decimal('80.00'))
+        cls.discount = Discount.objects.create(
+            name='Spring', percentage=Decimal('25.00'), active=True,
+            expired_date=timezone.now().date() + timedelta(days=7),
+        )
+
+    def effective_price(self):
+        return Product.objects.values_list('effective_price', flat=True).get(pk=self.product.pk)
+
+    def test_new_product_uses_base_price(self):
+        self.assertEqual(self.effective_price(), Decimal('80.00'))
+
+    def test_follows_discount_membership_and_activation(self):
+        self.discount.products_discount.add(self.product)
+        self.assertEqual(self.effective_price(), Decimal('60.00'))
+
+        self.discount.active = False
+        self.discount.save()
+        self.assertEqual(self.effective_price(), Decimal('80.00'))
+
+        self.discount.active = True
+        self.discount.save()
+        self.product.discount.remove(self.discount)
+        self.assertEqual(self.effective_price(), Decimal('80.00'))
+
+    def test_rebuild_command_expires_overdue_discounts(self):
+        self.product.discount.add(self.discount)
+        Discount.objects.filter(pk=self.discount.pk).update(
+            expired_date=timezone.now().date() - timedelta(days=1)
+        )
+        call_command('rebuild_effective_prices', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.effective_price(), Decimal('80.00'))
+        self.assertFalse(Discount.objects.get(pk=self.discount.pk).active)
+
+    def test_daily_job_expires_overdue_discounts(self):
+        self.product.discount.add(self.discount)
+        Discount.objects.filter(pk=self.discount.pk).update(
+            expired_date=timezone.now().date() - timedelta(days=1)
+        )
+        Job.objects.all().delete()
+        call_command('run_worker', once=True, stdout=StringIO())
+        self.assertEqual(self.effective_price(), Decimal('80.00'))
+        self.assertFalse(Discount.objects.get(pk=self.discount.pk).active)
+
+        upcoming = Job.objects.get(name='store.expire_discounts', status='pending')
+        self.assertEqual(upcoming.run_at, next_discount_expiry())
+        self.assertGreater(upcoming.run_at, timezone.now())
+        self.assertEqual(schedule_discount_expiry(), upcoming)
+
+
+class ProductSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lamps = Category.objects.create(name='Lighting')
+        cls.desk_lamp = Product.objects.create(
+            name='Desk lamp', description='Adjustable arm', price=Decimal('30.00'), category=cls.lamps,
+        )
+        cls.chair = Product.objects.create(
+            name='Office chair', description='Comes with a free lamp bulb', price=Decimal('90.00'),
+        )
+
+    def search(self, query):
+        return list(search_products(Product.objects.all(), query))
+
+    def test_ranks_name_matches_first(self):
+        self.assertEqual(self.search('lamp'), [self.desk_lamp, self.chair])
+
+    def test_prefix_and_category_matches(self):
+        self.assertEqual(self.search('offi'), [self.chair])
+        self.assertEqual(self.search('lighting'), [self.desk_lamp])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.chair.description = 'Ergonomic'
+        self.chair.save()
+        self.assertEqual(self.search('lamp'), [self.desk_lamp])
+        self.desk_lamp.delete()
+        self.assertEqual(self.search('lamp'), [])
+
+    def test_operators_are_not_passed_through(self):
+        self.assertEqual(self.search('"lamp OR'), [])
+        self.assertEqual(self.search('***'), [])
+
+
+class KeysetPaginatorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Duplicate prices exercise the primary key tiebreaker.
+        for i in range(7):
+            Product.objects.create(name=f'Item {i}', description='-', price=Decimal(10 + i // 2))
+
+    def test_walks_forwards_and_backwards(self):
+        expected = list(Product.objects.order_by('price', 'pk'))
+        paginator = KeysetPaginator(Product.objects.all(), 3, 'price')
+
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+        self.assertEqual(first.object_list + second.object_list + third.object_list, expected)
+        self.assertFalse(first.has_previous())
+        self.assertFalse(third.has_next())
+
+        back = paginator.page(third.previous_cursor)
+        self.assertEqual(back.object_list, second.object_list)
+        self.assertEqual(paginator.page(back.previous_cursor).object_list, first.object_list)
+
+    def test_catalog_pages_by_cursor(self):
+        response = self.client.get('/', {'sort': 'price'})
+        self.assertEqual(len(response.context['products']), 7)
+        self.assertEqual(self.client.get('/', {'cursor': 'garbage'}).status_code, 404)
+
+    def test_cursor_with_a_value_of_the_wrong_type_is_not_found(self):
+        payload = json.dumps({'v': 'abc', 'pk': 1, 'r': 0}).encode()
+        cursor = base64.urlsafe_b64encode(payload).decode().rstrip('=')
+        with self.assertRaises(InvalidCursor):
+            KeysetPaginator(Product.objects.all(), 3, 'price').page(cursor)
+        self.assertEqual(self.client.get('/', {'sort': 'price', 'cursor': cursor}).status_code, 404)
+
+
+class MultiColumnKeysetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('traveller')
+        for country, city, default in [('US', 'Austin', False), ('DE', 'Berlin', False), ('US', 'Austin', False),
+                                       ('FR', 'Paris', True), ('DE', 'Aachen', False), ('US', 'Boston', False)]:
+            ShippingInfo.objects.create(
+                customer=cls.user, country=country, city=city, state='-', zipcode=10000,
+                address='1 Main St', phone='5125550100', is_default=default,
+            )
+
+    def test_shipping_info_pages_in_model_ordering(self):
+        expected = [info.pk for info in ShippingInfo.objects.filter(customer=self.user).order_by(
+            '-is_default', 'country', 'city', 'pk')]
+        self.client.force_login(self.user)
+        pages, url = [], '/api/shipping-info/?page_size=2'
+        while url:
+            data = self.client.get(url).json()
+            pages.append([row['id'] for row in data['results']])
+            url = data['next']
+        self.assertEqual(sum(pages, []), expected)
+
+        back = self.client.get(data['previous']).json()
+        self.assertEqual([row['id'] for row in back['results']], pages[-2])
+
+
+class ProductApiRepresentationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Kettle', description='Boils water', price=Decimal('25.00'))
+        for i in range(3):
+            user = User.objects.create_user(f'reviewer{i}')
+            Review.objects.create(product=cls.product, user=user, rating=4, comment='Fine')
+
+    def test_list_omits_reviews(self):
+        row = self.client.get('/api/products/').json()['results'][0]
+        self.assertNotIn('reviews', row)
+        self.assertIn('description', row)
+
+    def test_sparse_fieldset(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/', {'fields': 'name,price'})
+        self.assertEqual(set(response.json()['results'][0]), {'name', 'price'})
+
+    def test_detail_links_to_paginated_reviews(self):
+        detail = self.client.get(f'/api/products/{self.product.slug}/').json()
+        reviews = self.client.get(detail['reviews_url'], {'page_size': 2}).json()
+        self.assertEqual(len(reviews['results']), 2)
+        self.assertIsNotNone(reviews['next'])
+
+
+class ReviewRatingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Teapot', description='-', price=Decimal('30.00'))
+        cls.users = [User.objects.create_user(f'critic{i}') for i in range(4)]
+
+    def rating(self):
+        return Product.objects.values_list('rating', 'num_reviews', 'rating_sum').get(pk=self.product.pk)
+
+    def review(self, user, rating):
+        return Review.objects.create(product=self.product, user=user, rating=rating, comment='-')
+
+    def test_create_edit_and_delete_move_the_rating(self):
+        self.review(self.users[0], 5)
+        self.review(self.users[1], 4)
+        self.assertEqual(self.rating(), (Decimal('4.50'), 2, 9))
+
+        edited = Review.objects.get(user=self.users[1])
+        edited.rating = 1
+        edited.save()
+        self.assertEqual(self.rating(), (Decimal('3.00'), 2, 6))
+
+        self.client.force_login(self.users[1])
+        self.assertEqual(self.client.delete(f'/api/reviews/{edited.pk}/').status_code, 204)
+        self.assertEqual(self.rating(), (Decimal('5.00'), 1, 5))
+        Review.objects.all().delete()
+        self.assertEqual(self.rating(), (Decimal('0.00'), 0, 0))
+
+    def test_review_writes_do_not_scan_other_reviews(self):
+        for user in self.users[:3]:
+            self.review(user, 3)
+        with CaptureQueriesContext(connection) as queries:
+            self.review(self.users[3], 5)
+        self.assertFalse([q for q in queries.captured_queries if 'AVG(' in q['sql'] or 'COUNT(' in q['sql']])
+        self.assertEqual(self.rating(), (Decimal('3.50'), 4, 14))
+
+    def test_reconcile_command_fixes_drift(self):
+        self.review(self.users[0], 2)
+        Product.objects.filter(pk=self.product.pk).update(rating=5, num_reviews=9, rating_sum=45)
+        call_command('reconcile_ratings', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.rating(), (Decimal('2.00'), 1, 2))
+
+
+class CartSummaryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper')
+        cls.product = Product.objects.create(name='Mug', description='-', price=Decimal('8.00'), stock=10)
+        cls.order, _ = get_active_order(cls.user)
+        OrderItem.objects.create(order=cls.order, product=cls.product, quantity=2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_summary_is_cached_until_version_bump(self):
+        self.assertEqual(get_cart_summary(self.order).count, 2)
+        OrderItem.objects.filter(order=self.order).update(quantity=3)
+        self.assertEqual(get_cart_summary(self.order).count, 2)
+        bump_cart_version(self.order.id)
+        summary = get_cart_summary(self.order)
+        self.assertEqual((summary.count, summary.subtotal), (3, Decimal('24.00')))
+
+    def test_catalog_render_aggregates_cart_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertEqual(response.context['cartItems'], 2)
+        aggregates = [q for q in queries.captured_queries if 'SUM(' in q['sql']]
+        self.assertEqual(len(aggregates), 1)
+
+
+class CartServiceTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('clicker')
+        cls.mug = Product.objects.create(name='Mug', description='-', price=Decimal('8.00'), stock=3)
+        cls.pen = Product.objects.create(name='Pen', description='-', price=Decimal('2.00'), stock=10)
+        cls.order, _ = get_active_order(cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def quantities(self):
+        return dict(OrderItem.objects.filter(order=self.order).values_list('product_id', 'quantity'))
+
+    def test_batch_merges_deltas_and_respects_stock(self):
+        result = update_cart(self.order, [(self.mug.pk, 2), (self.pen.pk, 1), (self.mug.pk, 1), (0, 1)])
+        self.assertEqual(result.rejected, {0: NOT_FOUND})
+        self.assertEqual((result.totals.count, result.totals.subtotal), (4, Decimal('26.00')))
+
+        result = update_cart(self.order, [(self.mug.pk, 1), (self.pen.pk, 2)])
+        self.assertEqual(result.rejected, {self.mug.pk: OUT_OF_STOCK})
+        self.assertEqual(self.quantities(), {self.mug.pk: 3, self.pen.pk: 3})
+        self.assertEqual(get_cart_summary(self.order).count, result.totals.count)
+
+    def test_removals_shrink_then_drop_lines(self):
+        update_cart(self.order, [(self.mug.pk, 3), (self.pen.pk, 1)])
+        result = update_cart(self.order, [(self.mug.pk, -1), (self.pen.pk, -5)])
+        self.assertEqual(self.quantities(), {self.mug.pk: 2})
+        self.assertEqual((result.totals.count, result.totals.subtotal), (2, Decimal('16.00')))
+
+    def test_endpoints(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/update_cart/', {'changes': [
+            {'productId': self.pen.pk, 'delta': 4}, {'productId': self.mug.pk, 'delta': 5},
+        ]}, content_type='application/json')
+        self.assertEqual(response.json()['rejected'], {str(self.mug.pk): OUT_OF_STOCK})
+        self.assertEqual(response.json()['cartItems'], 4)
+
+        response = self.client.post(
+            '/update_item/', {'productId': str(self.pen.pk), 'action': 'remove'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['cartItems'], 3)
+        response = self.client.post(
+            '/update_item/', {'productId': self.mug.pk, 'action': 'add'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class InventoryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lamp = Product.objects.create(name='Lamp', description='-', price=Decimal('20.00'), stock=3, digital=True)
+        cls.first = Order.objects.create(customer=User.objects.create_user('early'), transaction_id='inv-1')
+        cls.second = Order.objects.create(customer=User.objects.create_user('late'), transaction_id='inv-2')
+        OrderItem.objects.create(order=cls.first, product=cls.lamp, quantity=2)
+        OrderItem.objects.create(order=cls.second, product=cls.lamp, quantity=2)
+
+    def stock(self):
+        return Product.objects.values_list('stock', 'reserved').get(pk=self.lamp.pk)
+
+    def test_holds_block_other_checkouts_until_they_expire(self):
+        self.assertEqual(hold_order_stock(self.first), [])
+        self.assertEqual(hold_order_stock(self.second), [self.lamp.pk])
+        self.assertEqual(self.stock(), (3, 2))
+
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(release_expired_holds(batch_size=1), 1)
+        self.assertEqual(self.stock(), (3, 0))
+        self.assertEqual(hold_order_stock(self.second), [])
+
+    def test_commit_never_oversells(self):
+        hold_order_stock(self.first)
+        commit_order_stock(self.first)
+        self.assertEqual(self.stock(), (1, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+        with self.assertRaises(InsufficientStock):
+            commit_order_stock(self.second)
+        self.assertEqual(self.stock(), (1, 0))
+
+    def test_checkout_endpoint_reports_shortage(self):
+        Product.objects.filter(pk=self.lamp.pk).update(stock=1)
+        self.client.force_login(self.first.customer)
+        response = self.client.post(
+            '/process_order/', {'form': {'total': '40.00'}}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.get(pk=self.first.pk).complete)
+
+
+calls = []
+
+
+@job('tests.flaky')
+def flaky(fail_times):
+    calls.append(fail_times)
+    if len(calls) <= fail_times:
+        raise ConnectionError('Upstream unavailable')
+    return {'calls': len(calls)}
+
+
+@job('tests.broken')
+def broken():
+    raise PermanentJobError('Bad payload')
+
+
+class JobQueueTest(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_retries_with_backoff_until_success(self):
+        queued = flaky.delay(fail_times=1)
+        with self.assertLogs('store.jobs', 'ERROR'):
+            self.assertEqual(run_pending(), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('pending', 1))
+        self.assertGreater(queued.run_at, timezone.now())
+        self.assertEqual(run_pending(), 0)
+
+        Job.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        run_pending()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.result), ('done', {'calls': 2}))
+
+    def test_permanent_errors_and_unknown_jobs_fail_at_once(self):
+        failing = [broken.delay(), Job.objects.create(name='tests.missing')]
+        with self.assertLogs('store.jobs', 'ERROR'):
+            run_pending()
+        self.assertEqual(
+            list(Job.objects.filter(pk__in=[j.pk for j in failing]).values_list('status', flat=True)),
+            ['failed', 'failed'],
+        )
+
+    def test_claimed_jobs_reappear_after_visibility_timeout(self):
+        flaky.delay(fail_times=0)
+        self.assertEqual(len(claim_jobs(visibility_timeout=60)), 1)
+        self.assertEqual(claim_jobs(), [])
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(claim_jobs()), 1)
+
+    def test_checkout_queues_confirmation_email(self):
+        user = User.objects.create_user('mailme', email='mailme@example.com')
+        product = Product.objects.create(name='Font', description='-', price=Decimal('4.00'), stock=5, digital=True)
+        order, _ = get_active_order(user)
+        OrderItem.objects.create(order=order, product=product, quantity=1)
+        self.client.force_login(user)
+
+        response = self.client.post('/process_order/', {'form': {'total': '4.00'}}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mail.outbox, [])
+        call_command('run_worker', once=True, stdout=StringIO())
+        self.assertEqual(mail.outbox[0].to, ['mailme@example.com'])
+
+
+class PayPalClientTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubPayPalServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.stop()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('paypal-buyer')
+        cls.order = Order.objects.create(customer=cls.user, transaction_id='pp-1')
+
+    def test_concurrent_payments_share_one_token(self):
+        client = PayPalClient(self.stub.url, 'id', 'secret')
+        before = self.stub.token_requests
+
+        async def pay_many():
+            payments = await asyncio.gather(*[
+                client.create_payment({'transactions': [{'description': f'Payment for Order {i}'}]})
+                for i in range(10)
+            ])
+            await client.aclose()
+            return payments
+
+        self.assertEqual(len({p['id'] for p in async_to_sync(pay_many)()}), 10)
+        self.assertEqual(self.stub.token_requests, before + 1)
+
+    def test_pool_of_a_one_off_loop_closes_with_it(self):
+        client = PayPalClient(self.stub.url, 'id', 'secret')
+        before = self.stub.token_requests
+
+        async def pay():
+            await client.create_payment({'transactions': [{'description': 'Payment for Order 1'}]})
+            return (await client._session()).http
+
+        pools = [async_to_sync(pay)() for _ in range(2)]
+        self.assertTrue(all(pool.is_closed for pool in pools))
+        self.assertEqual(len(client._sessions), 0)
+        self.assertEqual(self.stub.token_requests, before + 1)
+
+    def test_worker_reuses_one_pool(self):
+        with override_settings(PAYPAL_API_BASE=self.stub.url):
+            for _ in range(2):
+                create_paypal_payment.delay(
+                    user_id=self.user.id, order_id=self.order.id,
+                    return_url='http://testserver/ok', cancel_url='http://testserver/no',
+                )
+            run_pending()
+            sessions = list(get_paypal_client()._sessions.values())
+        self.assertEqual(list(Job.objects.values_list('status', flat=True)), ['done', 'done'])
+        self.assertEqual(len(sessions), 1)
+        self.assertFalse(sessions[0].http.is_closed)
+
+    def test_payment_views_against_stub(self):
+        self.client.force_login(self.user)
+        with override_settings(PAYPAL_API_BASE=self.stub.url):
+            created = self.client.post(
+                '/paypal_payment/', {'order_id': self.order.id}, content_type='application/json',
+            ).json()
+            params = {'paymentId': created['payment_id'], 'PayerID': 'PAYER'}
+            # PayPal's redirect sends no Idempotency-Key; a reload must still replay.
+            response = self.client.get('/payment_success/', params)
+            # The stub refuses a second execute, so only a replay can succeed.
+            retried = self.client.get('/payment_success/', params, HTTP_IDEMPOTENCY_KEY='other')
+        self.assertEqual(response.json()['order_id'], self.order.id)
+        self.assertEqual(retried.json(), response.json())
+        self.assertEqual(retried['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.get(pk=self.order.pk).payment_status, 'Paid')
+
+    def test_unreachable_paypal_falls_back_to_the_queue(self):
+        self.client.force_login(self.user)
+        with override_settings(PAYPAL_API_BASE='http://127.0.0.1:9'):
+            response = self.client.post(
+                '/paypal_payment/', {'order_id': self.order.id}, content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(response.json()['status_url']).json()['status'], 'pending')
+
+        self.client.force_login(User.objects.create_user('snoop'))
+        self.assertEqual(self.client.get(response.json()['status_url']).status_code, 404)
+
+
+class IdempotencyTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('retrier')
+        cls.font = Product.objects.create(name='Font', description='-', price=Decimal('4.00'), stock=5, digital=True)
+        order, _ = get_active_order(cls.user)
+        OrderItem.objects.create(order=order, product=cls.font, quantity=2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def process_order(self, key, total='8.00'):
+        return self.client.post(
+            '/process_order/', {'form': {'total': total}},
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retries_replay_the_first_response(self):
+        first = self.process_order('checkout-1')
+        cache.clear()  # The database copy alone is enough to replay.
+        retried = self.process_order('checkout-1')
+        self.assertEqual(retried.json(), first.json())
+        self.assertEqual(retried['Idempotent-Replayed'], 'true')
+        self.assertEqual(Product.objects.get(pk=self.font.pk).stock, 3)
+        self.assertEqual(self.process_order('checkout-1', total='9.00').status_code, 422)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0.1)
+    def test_duplicates_wait_for_the_request_in_flight(self):
+        IdempotencyKey.objects.create(
+            user=self.user, key='checkout-2', fingerprint='-',
+            locked_until=timezone.now() + timedelta(minutes=1),
+        )
+        self.assertEqual(self.process_order('checkout-2').status_code, 409)
+
+        # A claim whose request died is taken over once its lock lapses.
+        IdempotencyKey.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.process_order('checkout-2').status_code, 200)
+
+
+class OrderTotalsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+        cls.pen = Product.objects.create(name='Pen', description='-', price=Decimal('2.50'), digital=True)
+        cls.book = Product.objects.create(name='Ebook', description='-', price=Decimal('10.00'), digital=True)
+        cls.order, _ = get_active_order(cls.user)
+
+    def totals(self):
+        return Order.objects.values_list('item_count', 'items_subtotal').get(pk=self.order.pk)
+
+    def test_maintained_on_create_change_and_delete(self):
+        pen = OrderItem.objects.create(order=self.order, product=self.pen, quantity=2)
+        OrderItem.objects.create(order=self.order, product=self.book, quantity=1)
+        self.assertEqual(self.totals(), (3, Decimal('15.00')))
+
+        pen = OrderItem.objects.get(pk=pen.pk)
+        pen.quantity = 4
+        pen.save()
+        self.assertEqual(self.totals(), (5, Decimal('20.00')))
+
+        OrderItem.objects.filter(product=self.book).delete()
+        self.assertEqual(self.totals(), (4, Decimal('10.00')))
+
+    def test_order_save_does_not_clobber_totals(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        OrderItem.objects.create(order=self.order, product=self.pen, quantity=2)
+        stale.payment_status = 'Paid'
+        stale.save()
+        self.assertEqual(self.totals(), (2, Decimal('5.00')))
+
+    def test_repair_command(self):
+        OrderItem.objects.create(order=self.order, product=self.pen, quantity=2)
+        Order.objects.filter(pk=self.order.pk).update(item_count=0, items_subtotal=0)
+        call_command('repair_order_totals', stdout=StringIO())
+        self.assertEqual(self.totals(), (2, Decimal('5.00')))
+
+
+class ShippingEngineTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('traveller')
+        cls.chair = Product.objects.create(name='Chair', description='-', price=Decimal('40.00'))
+        cls.manual = Product.objects.create(name='Manual', description='-', price=Decimal('3.00'), digital=True)
+        cls.address = ShippingInfo.objects.create(
+            customer=cls.user, country='DE', city='Berlin', state='BE',
+            zipcode=10115, address='Street 1', phone='+49 30 1234567',
+        )
+        cls.order = Order.objects.create(customer=cls.user, transaction_id='ship-1', shipping_info=cls.address)
+        OrderItem.objects.create(order=cls.order, product=cls.chair, quantity=2)
+        OrderItem.objects.create(order=cls.order, product=cls.manual, quantity=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_profile_in_one_query(self):
+        with self.assertNumQueries(1):
+            profile = get_shipping_profile(self.order)
+        self.assertEqual((profile.physical_items, profile.has_digital), (1, True))
+
+    def test_builtin_rates_without_zones(self):
+        self.order.save()
+        self.assertEqual(self.order.shipping_cost, Decimal('9.10'))
+
+    def test_zone_edits_take_effect_immediately(self):
+        profile = get_shipping_profile(self.order)
+        zone = ShippingZone.objects.create(name='EU', countries=['DE', 'FR'], multiplier=Decimal('2.00'))
+        self.assertEqual(quote_shipping(profile, 'DE'), Decimal('14.00'))
+        zone.base_cost = Decimal('0.00')
+        zone.save()
+        self.assertEqual(quote_shipping(profile, 'DE'), Decimal('4.00'))
+        self.assertEqual(quote_shipping(profile, 'JP'), Decimal('7.00'))
+
+    def test_batch_quote_endpoint(self):
+        self.client.force_login(self.user)
+        response = self.client.get(f'/api/orders/{self.order.pk}/shipping-quotes/', {'country': 'US,DE,JP'})
+        self.assertEqual(response.json()['quotes'], {'US': '8.40', 'DE': '9.10', 'JP': '7.00'})
+
+
+RENDITION_MEDIA_ROOT = tempfile.mkdtemp()
+CATALOG_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def jpeg_upload(width, height, color='teal', name='photo.jpg'):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=RENDITION_MEDIA_ROOT)
+class ProductRenditionTest(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(RENDITION_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def create(self, name, upload):
+        product = Product.objects.create(name=name, description='-', price=Decimal('5.00'), image=upload)
+        run_pending()
+        product.refresh_from_db()
+        return product
+
+    def render(self, product):
+        return Template('{% load store_images %}{% product_image product "card" %}').render(
+            Context({'product': product}),
+        )
+
+    def test_renders_hashed_widths_once_per_source(self):
+        lamp = self.create('Desk Lamp', jpeg_upload(1600, 1000))
+        self.assertTrue(lamp.image.name.startswith('store/desk-lamp-'))
+        self.assertEqual(lamp.renditions['version'], RENDITION_VERSION)
+        card = lamp.renditions['sets']['card']
+        self.assertEqual([width for width, _ in card['webp']], [400, 800])
+        for _, path in card['webp'] + card['jpeg']:
+            self.assertTrue(lamp.image.storage.exists(path))
+        with lamp.image.storage.open(card['jpeg'][0][1]) as rendered:
+            self.assertEqual(Image.open(rendered).size, (400, 250))
+
+        twin = self.create('Desk Lamp Twin', jpeg_upload(1600, 1000))
+        self.assertNotEqual(twin.image.name, lamp.image.name)
+        self.assertEqual(twin.renditions['sets'], lamp.renditions['sets'])
+
+    def test_small_sources_are_not_upscaled(self):
+        badge = self.create('Badge', jpeg_upload(300, 300, 'gold'))
+        self.assertEqual([width for width, _ in badge.renditions['sets']['detail']['jpeg']], [300])
+
+    def test_tag_emits_picture_with_webp_and_srcset(self):
+        lamp = self.create('Desk Lamp', jpeg_upload(1600, 1000))
+        html = self.render(lamp)
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('-400.webp 400w', html)
+        self.assertIn('-800.jpeg 800w', html)
+
+    def test_tag_falls_back_and_queues_once(self):
+        product = Product.objects.create(name='Legacy', description='-', price=Decimal('5.00'))
+        Job.objects.all().delete()
+        cache.clear()
+        for _ in range(3):
+            html = self.render(product)
+        self.assertIn(product.image.url, html)
+        self.assertEqual(Job.objects.filter(name='store.make_product_renditions').count(), 1)
+
+    def test_replaced_image_falls_back_until_rendered(self):
+        lamp = self.create('Desk Lamp', jpeg_upload(1600, 1000))
+        lamp.image = jpeg_upload(1200, 900, 'navy', name='new.jpg')
+        lamp.save()
+        html = self.render(lamp)
+        self.assertNotIn('<picture>', html)
+        self.assertIn(lamp.image.url, html)
+
+        lamp.renditions = {**lamp.renditions, 'source': lamp.image.name, 'version': RENDITION_VERSION - 1,
+                           'sets': {}}
+        self.assertIn(lamp.image.url, self.render(lamp))
+
+    def test_unreadable_source_is_not_retried(self):
+        product = Product.objects.create(
+            name='Broken', description='-', price=Decimal('5.00'),
+            image=SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg'),
+        )
+        with self.assertLogs('store.jobs', 'ERROR'):
+            run_pending()
+        product.refresh_from_db()
+        self.assertIn('error', product.renditions)
+        cache.clear()
+        self.assertIn(product.image.url, self.render(product))
+        self.assertFalse(Job.objects.filter(status='pending').exists())
+
+
+class CatalogPageCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Lighting')
+        cls.lamp = Product.objects.create(
+            name='Desk Lamp', description='-', price=Decimal('30.00'), stock=4, category=cls.category,
+        )
+        cls.user = User.objects.create_user('regular')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_served_whole(self):
+        first = self.client.get('/', {'category': 'lighting', 'utm_source': 'mail'})
+        with self.assertNumQueries(0):
+            again = self.client.get('/', {'category': 'lighting'})
+        self.assertEqual(again.content, first.content)
+        self.client.get(f'/product/{self.lamp.slug}/')
+        with self.assertNumQueries(0):
+            self.client.get(f'/product/{self.lamp.slug}/')
+
+    def test_model_changes_expire_pages(self):
+        self.client.get('/')
+        self.client.get(f'/product/{self.lamp.slug}/')
+        self.lamp.price = Decimal('25.00')
+        self.lamp.save()
+        self.assertContains(self.client.get('/'), '$25.00')
+
+        Review.objects.create(product=self.lamp, user=self.user, rating=5, comment='Bright')
+        self.assertContains(self.client.get(f'/product/{self.lamp.slug}/'), 'Bright')
+
+        version = get_catalog_version()
+        order, _ = get_active_order(self.user)
+        OrderItem.objects.create(order=order, product=self.lamp, quantity=1)
+        commit_order_stock(order)
+        self.assertEqual(get_catalog_version(), version)
+
+        order, _ = get_active_order(User.objects.create_user('second'))
+        OrderItem.objects.create(order=order, product=self.lamp, quantity=3)
+        commit_order_stock(order)
+        self.assertContains(self.client.get('/'), 'Out of Stock')
+
+    def test_signed_in_users_share_fragments_with_their_own_badge(self):
+        other = User.objects.create_user('other')
+        OrderItem.objects.create(order=get_active_order(other)[0], product=self.lamp, quantity=3)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/').context['cartItems'], 0)
+
+        self.client.force_login(other)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertEqual(response.context['cartItems'], 3)
+        self.assertFalse([q for q in queries.captured_queries if 'store_category' in q['sql']])
+
+
+class ConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.kettle = Product.objects.create(name='Kettle', description='-', price=Decimal('25.00'), stock=2)
+        cls.user = User.objects.create_user('poller')
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_product_detail_api(self):
+        url = '/api/products/kettle/'
+        first = self.client.get(url)
+        self.assertIn('Last-Modified', first)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, first).status_code, 304)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304,
+        )
+
+        Review.objects.create(product=self.kettle, user=self.user, rating=3, comment='Loud')
+        rated = self.revalidate(url, first)
+        self.assertEqual((rated.status_code, rated.json()['num_reviews']), (200, 1))
+
+        Discount.objects.create(name='Sale', percentage=Decimal('10.00'), active=True,
+                                expired_date=timezone.now().date() + timedelta(days=1))
+        self.assertEqual(self.revalidate(url, rated).status_code, 200)
+        self.assertEqual(self.client.get('/api/products/missing/').status_code, 404)
+
+    def test_product_list_api(self):
+        url = '/api/products/?ordering=price'
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(url, first).status_code, 304)
+        Product.objects.create(name='Toaster', description='-', price=Decimal('30.00'))
+        self.assertEqual(self.revalidate(url, first).status_code, 200)
+
+    def test_placed_orders_change_validators(self):
+        urls = ['/api/products/', '/', f'/product/{self.kettle.slug}/']
+        first = {url: self.client.get(url) for url in urls}
+        order, _ = get_active_order(self.user)
+        OrderItem.objects.create(order=order, product=self.kettle, quantity=1)
+        commit_order_stock(order)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url, first[url]).status_code, 200)
+        self.assertContains(self.client.get(urls[2]), '1 items available')
+        self.assertEqual(self.client.get(urls[0]).json()['results'][0]['stock'], 1)
+
+    def test_anonymous_pages_only(self):
+        url = f'/product/{self.kettle.slug}/'
+        first = self.client.get(url)
+        self.assertEqual(self.revalidate(url, first).status_code, 304)
+        self.client.force_login(self.user)
+        self.assertNotIn('ETag', self.client.get(url))
+
+
+class CategoryNavigationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lighting = Category.objects.create(name='Lighting')
+        cls.garden = Category.objects.create(name='Garden')
+        cls.lamp = Product.objects.create(name='Lamp', description='-', price=Decimal('9.00'), stock=1, category=cls.lighting)
+        Product.objects.create(name='Bulb', description='-', price=Decimal('2.00'), category=cls.lighting)
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self):
+        return {entry.slug: (entry.product_count, entry.in_stock_count) for entry in get_category_navigation()}
+
+    def test_counts_follow_category_and_stock_changes(self):
+        self.assertEqual(self.counts(), {'garden': (0, 0), 'lighting': (2, 1)})
+        lamp = Product.objects.only('id', 'category').get(pk=self.lamp.pk)
+        lamp.category = self.garden
+        lamp.save()
+        self.assertEqual(self.counts(), {'garden': (1, 1), 'lighting': (1, 0)})
+
+        user = User.objects.create_user('buyer')
+        order, _ = get_active_order(user)
+        OrderItem.objects.create(order=order, product=self.lamp, quantity=1)
+        commit_order_stock(order)
+        self.assertEqual(self.counts(), {'garden': (1, 0), 'lighting': (1, 0)})
+
+        Product.objects.filter(name='Bulb').delete()
+        self.assertEqual(self.counts()['lighting'], (0, 0))
+
+    def test_warm_navigation_costs_no_queries(self):
+        get_category_navigation()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_category_navigation()), 2)
+        data = self.client.get('/api/categories/').json()
+        self.assertEqual(data[1], {'name': 'Lighting', 'slug': 'lighting', 'product_count': 2, 'in_stock_count': 1})
+
+    def test_reconcile_command_fixes_drift(self):
+        Category.objects.update(product_count=7, in_stock_count=7)
+        call_command('reconcile_category_counts', stdout=StringIO())
+        self.assertEqual(self.counts(), {'garden': (0, 0), 'lighting': (2, 1)})
+
+
+class FacetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        lighting = Category.objects.create(name='Lighting')
+        books = Category.objects.create(name='Books')
+        Product.objects.create(name='Lamp', description='-', price=Decimal('40.00'), stock=3, category=lighting)
+        Product.objects.create(name='Bulb', description='-', price=Decimal('5.00'), category=lighting)
+        Product.objects.create(name='Novel', description='-', price=Decimal('12.00'), stock=9, category=books)
+        ebook = Product.objects.create(name='Ebook', description='-', price=Decimal('8.00'), digital=True, category=books)
+        sale = Discount.objects.create(name='Sale', percentage=Decimal('50.00'), active=True,
+                                       expired_date=timezone.now().date() + timedelta(days=3))
+        ebook.discount.add(sale)
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self, query):
+        params, facets = QueryDict(query), get_facets()
+        with self.assertNumQueries(1):
+            result = facet_counts(Product.objects.all(), params, facets)
+        return result['total'], {
+            facet['name']: {option['value']: option['count'] for option in facet['options']}
+            for facet in result['facets']
+        }
+
+    def test_counts_in_one_query_excluding_own_facet(self):
+        total, counts = self.counts('category=lighting')
+        self.assertEqual(total, 2)
+        self.assertEqual(counts['category'], {'books': 2, 'lighting': 2})
+        self.assertEqual(counts['price']['0-25'], 1)
+        self.assertEqual(counts['in_stock'], {'1': 1})
+
+        total, counts = self.counts('price=0-25&digital=0')
+        self.assertEqual(total, 2)
+        self.assertEqual(counts['digital'], {'0': 2, '1': 1})
+        self.assertEqual(counts['on_sale'], {'1': 0})
+
+    def test_api_filters_and_reports_facets(self):
+        data = self.client.get('/api/products/', {'on_sale': '1', 'facets': '1'}).json()
+        self.assertEqual([row['name'] for row in data['results']], ['Ebook'])
+        self.assertEqual(data['facets']['total'], 1)
+        self.assertNotIn('facets', self.client.get('/api/products/').json())
+
+    def test_catalog_page(self):
+        response = self.client.get('/', {'category': ['lighting', 'books'], 'in_stock': '1'})
+        self.assertEqual({p.name for p in response.context['products']}, {'Lamp', 'Novel'})
+        self.assertContains(response, 'href="?category=books&amp;in_stock=1"')
+        self.assertEqual(len(self.client.get('/', {'category': 'nowhere'}).context['products']), 0)
+
+
+@override_settings(METRICS_TOKEN='scrape-me')
+class InstrumentationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Tools')
+        for name in ('Hammer', 'Saw', 'Drill'):
+            Product.objects.create(name=name, description='-', price=Decimal('10.00'), stock=1, category=cls.category)
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+
+    def test_requests_are_recorded_per_view(self):
+        with self.modify_settings(MIDDLEWARE={'prepend': 'store.middleware.InstrumentationMiddleware'}):
+            self.client.get('/')
+            self.client.get('/')
+            self.client.get('/api/products/hammer/')
+        metrics = registry.snapshot()
+        self.assertEqual(metrics['store:store']['requests'], 2)
+        self.assertGreater(metrics['store:store']['cache_hits'], 0)
+        self.assertGreater(metrics['store:store']['cache_misses'], 0)
+        self.assertEqual(metrics['store:product-detail']['queries'], 3)
+
+    def test_repeated_statements_are_fingerprinted(self):
+        recorder = RequestRecorder()
+        with connection.execute_wrapper(recorder):
+            for product in Product.objects.order_by('pk'):
+                Category.objects.get(pk=product.category_id)
+            list(Product.objects.filter(pk__in=[1, 2]))
+            list(Product.objects.filter(pk__in=[1, 2, 3]))
+        self.assertEqual(recorder.queries, 6)
+        self.assertEqual(sorted(recorder.duplicates().values()), [2, 3])
+
+        registry.record('store:store', 0.02, recorder)
+        self.assertEqual(registry.snapshot()['store:store']['duplicate_queries'], 3)
+
+    def test_metrics_endpoint(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        registry.record('store:store', 0.02, RequestRecorder())
+        response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertContains(response, 'store_request_latency_seconds_bucket{view="store:store",le="0.025"} 1')
+        self.assertContains(response, 'store_request_latency_rolling_seconds{view="store:store",quantile="0.5"} 0.02')
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        self.assertEqual(self.client.get('/metrics/', {'format': 'json'}).json()['store:store']['requests'], 1)
+
+
+@override_settings(MEDIA_ROOT=CATALOG_MEDIA_ROOT)
+class StoreQueryBudgetTest(QueryBudgetMixin, TestCase):
+    app = 'store'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user('buyer')
+        cls.staff = User.objects.create_user('staff', is_staff=True, is_superuser=True)
+        reviewers = [User.objects.create_user(f'reviewer{n}') for n in range(3)]
+        sale = Discount.objects.create(name='Sale', percentage=Decimal('10.00'), active=True,
+                                       expired_date=timezone.now().date() + timedelta(days=3))
+        cls.products = []
+        for n in range(6):
+            product = Product.objects.create(
+                name=f'Widget {n}', description='-', price=Decimal('10.00') + n, stock=20,
+                category=Category.objects.get_or_create(name=f'Aisle {n % 2}')[0],
+            )
+            product.discount.add(sale)
+            for reviewer in reviewers:
+                Review.objects.create(product=product, user=reviewer, rating=4, comment='Fine')
+            cls.products.append(product)
+        # As if already rendered, so pages do not queue rendition jobs.
+        Product.objects.update(renditions=failed_renditions(cls.products[0].image.name, 'No source file'))
+
+        cls.shipping = ShippingInfo.objects.create(
+            customer=cls.buyer, country='US', city='Austin', state='TX', zipcode=73301,
+            address='1 Main St', phone='5125550100', is_default=True,
+        )
+        placed, _ = get_active_order(cls.buyer)
+        for product in cls.products[:3]:
+            OrderItem.objects.create(order=placed, product=product, quantity=1)
+        commit_order_stock(placed)
+        placed.complete = True
+        placed.shipping_info = cls.shipping
+        placed.save()
+        cls.order, _ = get_active_order(cls.buyer)
+        cls.order.shipping_info = cls.shipping
+        cls.order.save()
+        for product in cls.products[3:]:
+            OrderItem.objects.create(order=cls.order, product=product, quantity=2)
+        for reviewer in reviewers:
+            OrderItem.objects.create(order=get_active_order(reviewer)[0], product=cls.products[0], quantity=1)
+        cls.job = Job.objects.create(name='store.create_paypal_payment', payload={'user_id': cls.buyer.id})
+        cls.import_job = Job.objects.create(name='store.import_catalog', status='done', result={'created': 1})
+
+    def setUp(self):
+        cache.clear()
+
+    def get_budgets(self):
+        product, order = self.products[0], self.order
+        review = Review.objects.filter(product=product).first()
+        total = str(compute_cart_summary(order).total)
+        return [
+            QueryBudget('store:store', 'get', '/', 5),
+            QueryBudget('store:store', 'get', '/', 4, user=self.buyer),
+            QueryBudget('store:store', 'get', '/', 3, {'category': 'aisle-1', 'sort': 'price'}),
+            QueryBudget('store:product_detail', 'get', f'/product/{product.slug}/', 3),
+            QueryBudget('store:product_detail', 'get', f'/product/{product.slug}/', 3, user=self.buyer),
+            QueryBudget('store:cart', 'get', '/cart/', 4, user=self.buyer),
+            QueryBudget('store:checkout', 'get', '/checkout/', 15, user=self.buyer),
+            QueryBudget('store:shipping_info', 'get', '/shipping_info/', 3, user=self.buyer),
+            QueryBudget('store:process_order', 'post', '/process_order/', 27,
+                        {'form': {'total': total}}, self.buyer, content_type='application/json'),
+            QueryBudget('store:update_item', 'post', '/update_item/', 18,
+                        {'productId': product.id, 'action': 'add'}, self.buyer, content_type='application/json'),
+            QueryBudget('store:update_cart', 'post', '/update_cart/', 53,
+                        {'changes': [{'productId': p.id, 'delta': 1} for p in self.products]},
+                        self.buyer, content_type='application/json'),
+            QueryBudget('store:add_review', 'post', f'/product/{product.slug}/review/', 8,
+                        {'rating': 5, 'comment': 'Great'}, self.buyer),
+            QueryBudget('store:paypal_payment', 'post', '/paypal_payment/', 2, {}, self.buyer, 400,
+                        'application/json'),
+            QueryBudget('store:payment_success', 'get', '/payment_success/', 2, user=self.buyer, status=400),
+            QueryBudget('store:payment_job', 'get', f'/payment_jobs/{self.job.id}/', 3, user=self.buyer),
+            QueryBudget('store:payment_cancelled', 'get', '/payment_cancelled/', 2, user=self.buyer),
+            QueryBudget('store:metrics', 'get', '/metrics/', 2, user=self.staff),
+            QueryBudget('store:category-list', 'get', '/api/categories/', 1),
+            QueryBudget('store:product-list', 'get', '/api/products/', 3, {'facets': '1'}),
+            QueryBudget('store:product-detail', 'get', f'/api/products/{product.slug}/', 3),
+            QueryBudget('store:product-reviews', 'get', f'/api/products/{product.slug}/reviews/', 2),
+            QueryBudget('store:order-list', 'get', '/api/orders/', 5, user=self.buyer),
+            QueryBudget('store:order-list', 'get', '/api/orders/', 5, user=self.staff),
+            QueryBudget('store:order-detail', 'get', f'/api/orders/{order.id}/', 5, user=self.buyer),
+            QueryBudget('store:order-shipping-quotes', 'get', f'/api/orders/{order.id}/shipping-quotes/', 6,
+                        {'country': 'US,CA,DE'}, self.buyer),
+            QueryBudget('store:shipping-info-list', 'get', '/api/shipping-info/', 3, user=self.buyer),
+            QueryBudget('store:shipping-info-detail', 'get', f'/api/shipping-info/{self.shipping.id}/', 3,
+                        user=self.buyer),
+            QueryBudget('store:review-list', 'get', '/api/reviews/', 1),
+            QueryBudget('store:review-detail', 'get', f'/api/reviews/{review.id}/', 1),
+            QueryBudget('store:catalog-export', 'get', '/api/catalog/export/', 4, user=self.staff),
+            QueryBudget('store:catalog-imports', 'post', '/api/catalog/imports/', 3,
+                        {'file': SimpleUploadedFile('catalog.csv', b'name,price\nGizmo,5.00\n')}, self.staff, 202),
+            QueryBudget('store:catalog-import-status', 'get', f'/api/catalog/imports/{self.import_job.id}/', 3,
+                        user=self.staff),
+            QueryBudget('store:order-export', 'get', '/api/orders/export/', 3, {'rows': 'items'}, self.staff),
+            QueryBudget('admin:store_order_changelist', 'get', '/admin/store/order/', 10, user=self.staff),
+            QueryBudget('admin:store_order_changelist', 'post', '/admin/store/order/', 6,
+                        {'action': 'export_orders_csv', 'select_across': '1', '_selected_action': [order.id]},
+                        self.staff),
+        ]
+
+
+class BenchmarkTest(TestCase):
+    """
+    ``STORE_BENCHMARK=1`` runs the full benchmark; ``STORE_BENCHMARK_OUTPUT``
+    and ``STORE_BENCHMARK_BASELINE`` name JSON files to write and compare with.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_every_endpoint_on_a_small_dataset(self):
+        sizes = {'categories': 3, 'products': 30, 'discounts': 2, 'users': 5, 'orders': 10, 'reviews': 40}
+        dataset = seed_dataset(sizes)
+        self.assertFalse(Order.objects.filter(complete=True, item_count=0).exists())
+        self.assertEqual(Review.objects.count(), Product.objects.aggregate(n=Sum('num_reviews'))['n'])
+        results = json.loads(json.dumps(run_benchmark(dataset, iterations=3, warmup=1, traced=1, sizes=sizes)))
+        self.assertIn('process_order', results['endpoints'])
+        self.assertEqual(results['endpoints']['catalog']['queries'], 0)
+        self.assertEqual(compare_results(results, results), [])
+
+        slower = json.loads(json.dumps(results))
+        slower['endpoints']['cart']['queries'] += 1
+        self.assertEqual(compare_results(slower, results), [
+            ('cart', 'queries', results['endpoints']['cart']['queries'], slower['endpoints']['cart']['queries']),
+        ])
+
+    @tag('benchmark')
+    @skipUnless(os.environ.get('STORE_BENCHMARK'), 'set STORE_BENCHMARK=1 to run the benchmark')
+    def test_benchmark(self):
+        results = run_benchmark(seed_dataset())
+        if os.environ.get('STORE_BENCHMARK_OUTPUT'):
+            with open(os.environ['STORE_BENCHMARK_OUTPUT'], 'w') as f:
+                json.dump(results, f, indent=2)
+        if os.environ.get('STORE_BENCHMARK_BASELINE'):
+            with open(os.environ['STORE_BENCHMARK_BASELINE']) as f:
+                self.assertEqual(compare_results(results, json.load(f)), [])
+
+
+CATALOG_CSV = """slug,name,description,price,category,digital,stock,discounts
+oak-desk,Oak Desk,Solid oak.,200.00,Furniture,false,4,Spring Sale
+,Desk Lamp,Warm light.,30.00,Lighting,no,0,
+broken,Broken,-,not-a-price,Furniture,false,1,
+ghost,Ghost,-,5.00,Furniture,false,1,Nonexistent
+"""
+
+
+@override_settings(MEDIA_ROOT=CATALOG_MEDIA_ROOT)
+class CatalogImportExportTest(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(CATALOG_MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        Discount.objects.create(name='Spring Sale', percentage=Decimal('25.00'), active=True,
+                                expired_date=timezone.now().date() + timedelta(days=5))
+        cls.staff = User.objects.create_user('merchant', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_import_upserts_in_batches_and_reports_bad_rows(self):
+        summary = import_catalog(StringIO(CATALOG_CSV), 'csv', batch_size=2)
+        self.assertEqual((summary['created'], summary['updated'], summary['failed']), (2, 0, 2))
+        self.assertEqual([error['line'] for error in summary['errors']], [4, 5])
+
+        desk = Product.objects.get(slug='oak-desk')
+        self.assertEqual((desk.category.name, desk.effective_price), ('Furniture', Decimal('150.00')))
+        self.assertEqual(Product.objects.get(slug='desk-lamp').category.slug, 'lighting')
+        self.assertEqual(self.counts(), {'furniture': (1, 1), 'lighting': (1, 0)})
+        self.assertEqual(list(search_products(Product.objects.all(), 'oak').values_list('slug', flat=True)),
+                         ['oak-desk'])
+
+        self.assertContains(self.client.get('/'), 'Oak Desk')
+        partial = '{"slug": "oak-desk", "name": "Oak Desk", "price": "180.00", "category": "Lighting"}\n'
+        summary = import_catalog(StringIO(partial), 'jsonl')
+        self.assertEqual((summary['created'], summary['updated']), (0, 1))
+        desk.refresh_from_db()
+        self.assertEqual((desk.stock, desk.description, desk.effective_price), (4, 'Solid oak.', Decimal('135.00')))
+        self.assertEqual(desk.discount.count(), 1)
+        self.assertEqual(self.counts(), {'furniture': (0, 0), 'lighting': (2, 1)})
+        self.assertContains(self.client.get('/'), '135.00')
+
+    def counts(self):
+        return {entry.slug: (entry.product_count, entry.in_stock_count) for entry in get_category_navigation()}
+
+    def test_partial_rows_update_only_their_columns(self):
+        import_catalog(StringIO(CATALOG_CSV), 'csv')
+        summary = import_catalog(StringIO('slug,stock\noak-desk,0\nnew-thing,3\n'), 'csv')
+        self.assertEqual((summary['updated'], summary['failed']), (1, 1))
+        self.assertEqual(summary['errors'][0], {'line': 3, 'error': 'a new product needs a name and a price'})
+        desk = Product.objects.get(slug='oak-desk')
+        self.assertEqual((desk.name, desk.price, desk.effective_price, desk.stock),
+                         ('Oak Desk', Decimal('200.00'), Decimal('150.00'), 0))
+        self.assertEqual(self.counts()['furniture'], (1, 0))
+
+    def test_rejected_rows_do_not_count_as_updated(self):
+        import_catalog(StringIO('slug,name,price\na,A,1\n'), 'csv')
+        summary = import_catalog(StringIO('slug,name,price,discounts\na,A,1,Nope\nb,B,2,\n'), 'csv')
+        self.assertEqual((summary['created'], summary['updated'], summary['failed']), (1, 0, 1))
+        self.assertEqual(summary['errors'][0]['line'], 2)
+
+    def test_export_round_trips(self):
+        import_catalog(StringIO(CATALOG_CSV), 'csv')
+        exported = ''.join(export_catalog('csv'))
+        self.assertIn('oak-desk,Oak Desk,Solid oak.,200.00,Furniture,false,4,Spring Sale', exported)
+        summary = import_catalog(StringIO(exported), 'csv')
+        self.assertEqual((summary['created'], summary['updated'], summary['failed']), (0, 2, 0))
+        self.assertEqual(''.join(export_catalog('csv')), exported)
+
+        lines = ''.join(export_catalog('jsonl')).splitlines()
+        self.assertEqual(json.loads(lines[0])['discounts'], ['Spring Sale'])
+
+    def test_commands(self):
+        path = os.path.join(CATALOG_MEDIA_ROOT, 'catalog.csv')
+        with open(path, 'w') as f:
+            f.write(CATALOG_CSV)
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=err)
+        self.assertIn('Created 2 and updated 0', out.getvalue())
+        self.assertIn('Line 4: invalid price', err.getvalue())
+
+        call_command('export_catalog', os.path.join(CATALOG_MEDIA_ROOT, 'out.jsonl'), stdout=StringIO())
+        with open(os.path.join(CATALOG_MEDIA_ROOT, 'out.jsonl')) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def test_staff_api(self):
+        self.assertEqual(self.client.get('/api/catalog/export/').status_code, 403)
+        self.client.force_login(self.staff)
+        upload = SimpleUploadedFile('catalog.csv', CATALOG_CSV.encode(), content_type='text/csv')
+        response = self.client.post('/api/catalog/imports/', {'file': upload})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(response.json()['status_url']).json()['status'], 'pending')
+
+        run_pending()
+        status = self.client.get(response.json()['status_url']).json()
+        self.assertEqual((status['status'], status['result']['created']), ('done', 2))
+
+        export = self.client.get('/api/catalog/export/', {'type': 'jsonl'})
+        self.assertEqual(export['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(b''.join(export.streaming_content).splitlines()), 2)
+
+
+class OrderExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser('finance', 'finance@example.com', 'x')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com')
+        shipping = ShippingInfo.objects.create(
+            customer=cls.buyer, country='US', city='Austin', state='TX', zipcode=73301,
+            address='1 Main St', phone='5125550100', is_default=True,
+        )
+        lamp = Product.objects.create(name='Lamp', price=Decimal('20.00'), stock=10)
+        ebook = Product.objects.create(name='Ebook', price=Decimal('5.00'), digital=True)
+        cls.orders = []
+        for n in range(3):
+            order = Order.objects.create(customer=cls.buyer, transaction_id=f'tx-{n}', shipping_info=shipping)
+            OrderItem.objects.create(order=order, product=lamp, quantity=n + 1)
+            OrderItem.objects.create(order=order, product=ebook, quantity=1)
+            cls.orders.append(order)
+        Order.objects.update(shipping_cost=Decimal('4.50'))
+
+    def read_csv(self, lines):
+        return list(csv.DictReader(StringIO(''.join(lines))))
+
+    def test_one_row_per_order_from_one_query(self):
+        with CaptureQueriesContext(connection) as captured:
+            rows = self.read_csv(export_orders('csv', chunk_size=2))
+        self.assertEqual(len(captured), 1)
+        self.assertEqual(tuple(rows[0]), ORDER_COLUMNS)
+        self.assertEqual([row['transaction_id'] for row in rows], ['tx-0', 'tx-1', 'tx-2'])
+        last = rows[-1]
+        self.assertEqual((last['customer'], last['email'], last['country']), ('buyer', 'buyer@example.com', 'US'))
+        self.assertEqual((last['item_count'], last['items_subtotal'], last['total']), ('4', '65.00', '69.50'))
+
+    def test_one_row_per_order_line(self):
+        orders = Order.objects.filter(transaction_id__in=['tx-1', 'tx-2'])
+        with CaptureQueriesContext(connection) as captured:
+            rows = [json.loads(line) for line in export_orders('jsonl', orders, rows='items')]
+        self.assertEqual(len(captured), 1)
+        self.assertEqual(tuple(rows[0]), ITEM_COLUMNS)
+        self.assertEqual([(row['transaction_id'], row['product']) for row in rows],
+                         [('tx-1', 'Lamp'), ('tx-1', 'Ebook'), ('tx-2', 'Lamp'), ('tx-2', 'Ebook')])
+        self.assertEqual((rows[2]['quantity'], rows[2]['line_total'], rows[2]['total']), (3, '60.00', '69.50'))
+        self.assertEqual(rows[0]['phone'], '+15125550100')
+
+    def test_staff_api(self):
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get('/api/orders/export/').status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get('/api/orders/export/', {'rows': 'totals'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/orders/export/', {'since': 'last year'}).status_code, 400)
+
+        response = self.client.get('/api/orders/export/', {'type': 'jsonl', 'rows': 'items'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('order-items-', response['Content-Disposition'])
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 6)
+
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+        response = self.client.get('/api/orders/export/', {'since': tomorrow})
+        self.assertEqual(len(self.read_csv(line.decode() for line in response.streaming_content)), 0)
+
+    def test_admin_action(self):
+        self.client.force_login(self.staff)
+        response = self.client.post('/admin/store/order/', {
+            'action': 'export_items_csv', '_selected_action': [self.orders[0].pk, self.orders[1].pk],
+        })
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = self.read_csv(line.decode() for line in response.streaming_content)
+        self.assertEqual({row['transaction_id'] for row in rows}, {'tx-0', 'tx-1'})
+        self.assertEqual(len(rows), 4)
@@ -5,12 +5,15 @@ from .views import (
     CartView,
     CheckoutView,
     UpdateCartView,
+    BulkUpdateCartView,
     ProcessOrderView,
     AddReviewView,
     ShippingInfoView,
     PayPalPaymentView,
     PaymentSuccessView,
-    PaymentCancelledView
+    PaymentJobStatusView,
+    PaymentCancelledView,
+    MetricsView,
 )
 
 app_name = "store"
@@ -21,11 +24,14 @@ urlpatterns = [
     path('cart/', CartView.as_view(), name='cart'),
     path('checkout/', CheckoutView.as_view(), name='checkout'),
     path('update_item/', UpdateCartView.as_view(), name='update_item'),
+    path('update_cart/', BulkUpdateCartView.as_view(), name='update_cart'),
     path('process_order/', ProcessOrderView.as_view(), name='process_order'),
     path('product/<slug:slug>/review/', AddReviewView.as_view(), name='add_review'),
     path('shipping_info/', ShippingInfoView.as_view(), name='shipping_info'),
     path('paypal_payment/', PayPalPaymentView.as_view(), name='paypal_payment'),
     path('payment_success/', PaymentSuccessView.as_view(), name='payment_success'),
+    path('payment_jobs/<int:job_id>/', PaymentJobStatusView.as_view(), name='payment_job'),
     path('payment_cancelled/', PaymentCancelledView.as_view(), name='payment_cancelled'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('api/', include('store.api')),  # Include the API URLs
 ]
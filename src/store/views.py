@@ -1,152 +1,262 @@
+import hmac
 import json
 import uuid
 from decimal import Decimal, InvalidOperation
 
-import paypalrestsdk
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import AccessMixin, LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
 from django.conf import settings
-from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Q
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, QueryDict
 from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
 from django.views.generic import ListView, DetailView, View, CreateView
 
+from store.cart import (
+    NOT_FOUND, bump_cart_version, compute_cart_summary, get_active_order,
+    get_request_cart, update_cart,
+)
+from store.filters import filter_by_price_range
 from store.forms import ReviewForm, ShippingInfoForm
-from store.models import Category, Order, OrderItem, Product, ShippingInfo
+from store.facets import FACET_PARAMS, cached_facet_counts, filter_facets, get_facets
+from store.idempotency import IdempotencyMixin
+from store.instrumentation import registry
+from store.inventory import InsufficientStock, commit_order_stock, hold_order_stock
+from store.models import (
+    Job, Order, Product, ShippingInfo, resolve_discounted_prices,
+)
+from store.page_cache import CatalogPageCacheMixin
+from store.pagination import InvalidCursor, KeysetPaginator
+from store.paypal import PayPalError, approval_url, get_paypal_client, payment_request
+from store.search import search_products
+from store.tasks import (
+    create_paypal_payment, execute_paypal_payment, mark_order_paid, send_order_confirmation,
+)
 
 
-# ---------------------------------------------------------------------------
-# Helper
-# ---------------------------------------------------------------------------
-
-def get_active_order(user):
-    """Return (order, created) for the user's current open cart."""
-    return Order.objects.get_or_create(
-        customer=user,
-        complete=False,
-        defaults={'transaction_id': str(uuid.uuid4())}
-    )
-
 # ---------------------------------------------------------------------------
 # Store views
 # ---------------------------------------------------------------------------
 
-class ProductListView(ListView):
+class ProductListView(CatalogPageCacheMixin, ListView):
     model = Product
     template_name = 'store/store.html'
+    fragment_templates = {'catalog': 'store/fragments/catalog.html'}
+    cache_params = ('search', 'sort', 'cursor', 'min_price', 'max_price') + FACET_PARAMS
     context_object_name = 'products'
     paginate_by = 12
+    # Every option is backed by an index so keyset pages stay O(page size).
+    sort_options = {
+        'newest': '-created_at',
+        'price': 'effective_price',
+        '-price': '-effective_price',
+        'rating': '-rating',
+    }
 
     def get_queryset(self):
         queryset = Product.objects.select_related('category').prefetch_related('reviews')
 
-        category_slug = self.request.GET.get('category')
-        if category_slug:
-            queryset = queryset.filter(category__slug=category_slug)
-
-        search_query = self.request.GET.get('search')
+        search_query = self.request.GET.get('search', '').strip()
         if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) | Q(description__icontains=search_query)
-            )
-        return queryset
+            queryset = search_products(queryset, search_query)
+
+        # Search results keep their relevance order unless a sort is chosen.
+        sort = self.sort_options.get(self.request.GET.get('sort'))
+        if sort:
+            queryset = queryset.order_by(sort)
+        # Facet counts are taken before the facets themselves narrow the list.
+        self.facets = get_facets()
+        self.unfaceted = filter_by_price_range(queryset, self.request.GET)
+        return filter_facets(self.unfaceted, self.request.GET, self.facets)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def _page_params(self):
+        # Only parameters the page is cached by, so the links fit every hit.
+        params = QueryDict(mutable=True)
+        for name in self.cache_params:
+            if name != 'cursor' and name in self.request.GET:
+                params.setlist(name, self.request.GET.getlist(name))
+        return params
+
+    def _page_url(self, cursor=None):
+        params = self._page_params()
+        if cursor:
+            params['cursor'] = cursor
+        return f'?{params.urlencode()}'
+
+    def _toggle_url(self, facet, value):
+        params = self._page_params()
+        values = params.getlist(facet['name']) if facet['multiple'] else []
+        if value in params.getlist(facet['name']):
+            values = [selected for selected in values if selected != value]
+        else:
+            values.append(value)
+        params.setlist(facet['name'], values)
+        return f'?{params.urlencode()}'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.values_list('name', 'slug').distinct()
+        resolve_discounted_prices(context['products'])
+        page = context['page_obj']
+        context['first_page_url'] = self._page_url()
+        context['next_page_url'] = self._page_url(page.next_cursor)
+        context['previous_page_url'] = self._page_url(page.previous_cursor)
+        # Carried through the sort form as hidden inputs.
+        context['filter_params'] = [
+            (name, value)
+            for name, values in self._page_params().lists() if name != 'sort'
+            for value in values
+        ]
+        parts = [(name, self.request.GET.get(name)) for name in ('search', 'min_price', 'max_price')]
+        context['facets'] = cached_facet_counts(self.unfaceted, self.request.GET, parts, self.facets)
+        for facet, definition in zip(context['facets']['facets'], self.facets):
+            facet['multiple'] = definition.multiple
+            for option in facet['options']:
+                option['url'] = self._toggle_url(facet, option['value'])
+        return context
 
-        if self.request.user.is_authenticated:
-            order, _ = get_active_order(self.request.user)
-            context['cartItems'] = order.get_cart_items
-        else:
-            context['cartItems'] = 0
+    def get_fragment_context(self):
+        self.object_list = self.get_queryset()
+        return self.get_context_data()
+
+    def get_page_context(self, fragments):
+        context = super().get_page_context(fragments)
+        context['cartItems'] = get_request_cart(self.request).count
         return context
 
 
-class ProductDetailView(DetailView):
+class ProductDetailView(CatalogPageCacheMixin, DetailView):
     model = Product
     template_name = 'store/product_detail.html'
+    fragment_templates = {
+        'summary': 'store/fragments/product_summary.html',
+        'reviews': 'store/fragments/product_reviews.html',
+    }
+    shows_stock_levels = True  # "N items available".
     context_object_name = 'product'
     slug_field = 'slug'
     slug_url_kwarg = 'slug'  # Fixed: was slug_url_arg (typo)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['review_form'] = ReviewForm()
         context['reviews'] = self.object.reviews.select_related('user').all()
+        return context
 
-        if self.request.user.is_authenticated:
-            order, _ = get_active_order(self.request.user)
-            context['cartItems'] = order.get_cart_items
-        else:
-            context['cartItems'] = 0
+    def get_fragment_context(self):
+        self.object = self.get_object()
+        return self.get_context_data(object=self.object)
+
+    def get_fragments(self):
+        fragments = super().get_fragments()
+        # The page around the fragments needs these without loading the product.
+        fragments['name'], fragments['slug'] = self.object.name, self.object.slug
+        return fragments
+
+    def get_page_context(self, fragments):
+        context = super().get_page_context(fragments)
+        context['review_form'] = ReviewForm()
+        context['cartItems'] = get_request_cart(self.request).count
         return context
 
 
 class CartView(LoginRequiredMixin, View):
     def get(self, request):
-        order, _ = get_active_order(request.user)
-        order_items = order.orderitem_set.select_related('product').all()
+        cart = get_request_cart(request)
+        order_items = cart.order.orderitem_set.select_related('product').all()
+        resolve_discounted_prices(item.product for item in order_items)
         context = {
-            'order': order,
+            'order': cart.order,
             'order_items': order_items,
-            'cartItems': order.get_cart_items,
+            'cart': cart,
+            'cartItems': cart.count,
         }
         return render(request, 'store/cart.html', context)
 
 
 class CheckoutView(LoginRequiredMixin, View):
     def get(self, request):
-        order, _ = get_active_order(request.user)
-        order_items = order.orderitem_set.select_related('product').all()
+        cart = get_request_cart(request)
+        order_items = cart.order.orderitem_set.select_related('product').all()
+        resolve_discounted_prices(item.product for item in order_items)
+        # Hold the cart's stock while the customer completes checkout.
+        unavailable = hold_order_stock(cart.order) if cart.count else []
         shipping_info = ShippingInfo.objects.filter(
             customer=request.user, is_default=True
         ).first()
         context = {
-            'order': order,
+            'order': cart.order,
             'order_items': order_items,
-            'cartItems': order.get_cart_items,
+            'cart': cart,
+            'cartItems': cart.count,
             'shipping_info': shipping_info,
+            'unavailable': unavailable,
         }
         return render(request, 'store/checkout.html', context)
 
 
 class UpdateCartView(LoginRequiredMixin, View):
+    actions = {'add': 1, 'remove': -1}
+
     def post(self, request):
         try:
             data = json.loads(request.body)
-            product_id = data['productId']
+            product_id = int(data['productId'])
             action = data['action']
-        except (json.JSONDecodeError, KeyError):
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
             return JsonResponse({'error': 'Invalid request data'}, status=400)
+        if action not in self.actions:
+            return JsonResponse({'error': 'Unknown action'}, status=400)
 
-        product = get_object_or_404(Product, id=product_id)
         order, _ = get_active_order(request.user)
-        order_item, _ = OrderItem.objects.get_or_create(order=order, product=product)
-
-        if action == 'add':
-            if product.stock <= order_item.quantity:
-                return JsonResponse({'error': 'Not enough stock available'}, status=400)
-            order_item.quantity += 1
-        elif action == 'remove':
-            order_item.quantity -= 1
-        else:
-            return JsonResponse({'error': 'Unknown action'}, status=400)
+        result = update_cart(order, [(product_id, self.actions[action])])
+        if result.rejected.get(product_id) == NOT_FOUND:
+            raise Http404('No Product matches the given query.')
+        if result.rejected:
+            return JsonResponse({'error': 'Not enough stock available'}, status=400)
 
-        if order_item.quantity <= 0:
-            order_item.delete()
-        else:
-            order_item.save()
+        return JsonResponse({
+            'message': 'Cart updated successfully',
+            'cartItems': result.totals.count,
+            'cartTotal': str(result.totals.total),
+        })
+
+
+class BulkUpdateCartView(LoginRequiredMixin, View):
+    """Apply a batch of ``{productId, delta}`` changes in one transaction."""
+    max_changes = 50
+    max_delta = 100
 
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+            changes = [(int(change['productId']), int(change['delta'])) for change in data['changes']]
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            return JsonResponse({'error': 'Invalid request data'}, status=400)
+        if len(changes) > self.max_changes:
+            return JsonResponse({'error': f'At most {self.max_changes} changes per request'}, status=400)
+        if any(abs(delta) > self.max_delta for _, delta in changes):
+            return JsonResponse({'error': f'Each delta must be between -{self.max_delta} and {self.max_delta}'}, status=400)
+
+        order, _ = get_active_order(request.user)
+        result = update_cart(order, changes)
         return JsonResponse({
             'message': 'Cart updated successfully',
-            'cartItems': order.get_cart_items,
-            'cartTotal': str(order.get_cart_total),
+            'cartItems': result.totals.count,
+            'cartTotal': str(result.totals.total),
+            'rejected': {str(product_id): reason for product_id, reason in result.rejected.items()},
         })
 
 
-class ProcessOrderView(LoginRequiredMixin, View):
+class ProcessOrderView(LoginRequiredMixin, IdempotencyMixin, View):
     def post(self, request):
         try:
             data = json.loads(request.body)
@@ -157,39 +267,47 @@ class ProcessOrderView(LoginRequiredMixin, View):
         order, _ = get_active_order(request.user)
 
         # Security: recalculate server-side and compare using Decimal
-        server_total = order.get_cart_total
+        server_total = compute_cart_summary(order).total
         if client_total != server_total:
             return JsonResponse({'error': 'Total amount mismatch'}, status=400)
 
-        with transaction.atomic():
-            # Use a secure random transaction ID
-            order.transaction_id = str(uuid.uuid4())
-            order.complete = True
-            order.save()
-            order.refresh_from_db()
-
-            # Save shipping info if provided and order needs it
-            shipping_data = data.get('shipping')
-            if order.shipping_info is None and shipping_data:  # Fixed: was order.shipping
-                ShippingInfo.objects.create(
-                    customer=request.user,
-                    country=shipping_data['country'],
-                    city=shipping_data['city'],
-                    state=shipping_data['state'],
-                    zipcode=shipping_data['zipcode'],
-                    address=shipping_data['address'],
-                    phone=shipping_data['phone'],
-                )
-
-            # Bulk-update stock instead of saving one product at a time
-            products_to_update = []
-            for item in order.orderitem_set.select_related('product').all():
-                item.product.stock -= item.quantity
-                products_to_update.append(item.product)
-            Product.objects.bulk_update(products_to_update, ['stock'])
+        try:
+            with transaction.atomic():
+                self.place_order(request, order, data)
+        except InsufficientStock as exc:
+            return JsonResponse({
+                'error': 'Some items are no longer in stock',
+                'unavailable': exc.product_ids,
+            }, status=409)
+        bump_cart_version(order.id)
 
         return JsonResponse({'message': 'Order processed successfully', 'order_id': order.id})
 
+    def place_order(self, request, order, data):
+        # Conditional decrements; raises InsufficientStock and rolls back if any line is short.
+        commit_order_stock(order)
+
+        # Use a secure random transaction ID
+        order.transaction_id = str(uuid.uuid4())
+        order.complete = True
+        order.save()
+        order.refresh_from_db()
+        # Queued in this transaction, so it only runs if the order is placed.
+        send_order_confirmation.delay(order_id=order.id)
+
+        # Save shipping info if provided and order needs it
+        shipping_data = data.get('shipping')
+        if order.shipping_info is None and shipping_data:  # Fixed: was order.shipping
+            ShippingInfo.objects.create(
+                customer=request.user,
+                country=shipping_data['country'],
+                city=shipping_data['city'],
+                state=shipping_data['state'],
+                zipcode=shipping_data['zipcode'],
+                address=shipping_data['address'],
+                phone=shipping_data['phone'],
+            )
+
 
 class AddReviewView(LoginRequiredMixin, View):
     def post(self, request, slug):
@@ -201,7 +319,7 @@ class AddReviewView(LoginRequiredMixin, View):
             review.product = product
             review.user = request.user
             review.save()
-            # Re-fetch updated values after update_rating()
+            # Re-fetch the rating the review's save() just moved
             product.refresh_from_db()
             return JsonResponse({
                 'message': 'Review added successfully',
@@ -228,81 +346,134 @@ class ShippingInfoView(LoginRequiredMixin, CreateView):
 # PayPal views
 # ---------------------------------------------------------------------------
 
-def _configure_paypal():
-    paypalrestsdk.configure({
-        'mode': settings.PAYPAL_MODE,
-        'client_id': settings.PAYPAL_CLIENT_ID,
-        'client_secret': settings.PAYPAL_CLIENT_SECRET,
-    })
+def _job_accepted(job):
+    return JsonResponse({
+        'job_id': job.id,
+        'status_url': reverse('store:payment_job', args=[job.id]),
+    }, status=202)
 
 
-class PayPalPaymentView(LoginRequiredMixin, View):
-    def post(self, request):
+class AsyncLoginRequiredMixin(AccessMixin):
+    """LoginRequiredMixin for async views; loads the user without blocking the loop."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        # Resolving the lazy request.user hits the session and user tables.
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(
+                request.get_full_path(), self.get_login_url(), self.get_redirect_field_name(),
+            )
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class PayPalPaymentView(AsyncLoginRequiredMixin, View):
+    async def post(self, request):
         try:
             data = json.loads(request.body)
-            order_id = data['order_id']
-        except (json.JSONDecodeError, KeyError):
+            order_id = int(data['order_id'])
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
             return JsonResponse({'error': 'Invalid request data'}, status=400)
 
-        order = get_object_or_404(Order, id=order_id, customer=request.user)
-        _configure_paypal()
+        order = await Order.objects.filter(id=order_id, customer=request.user).afirst()
+        if order is None:
+            raise Http404('No Order matches the given query.')
 
         # Use request.build_absolute_uri — no more hardcoded localhost
         return_url = request.build_absolute_uri('/store/payment_success/')
         cancel_url = request.build_absolute_uri('/store/payment_cancelled/')
-        total = str(order.get_total_price_for_order)  # property, no ()
-
-        payment = paypalrestsdk.Payment({
-            'intent': 'sale',
-            'payer': {'payment_method': 'paypal'},
-            'redirect_urls': {'return_url': return_url, 'cancel_url': cancel_url},
-            'transactions': [{
-                'item_list': {
-                    'items': [{
-                        'name': f'Order {order.id}',
-                        'sku': 'item',
-                        'price': total,
-                        'currency': 'USD',
-                        'quantity': 1,
-                    }]
-                },
-                'amount': {'total': total, 'currency': 'USD'},
-                'description': f'Payment for Order {order.id}',
-            }],
-        })
-
-        if payment.create():
-            approval_url = next(
-                (link.href for link in payment.links if link.rel == 'approval_url'),
-                None,
+        try:
+            payment = await get_paypal_client().create_payment(
+                payment_request(order, return_url, cancel_url)
             )
-            return JsonResponse({'payment_id': payment.id, 'approval_url': approval_url})
-        return JsonResponse({'error': payment.error}, status=400)
+        except PayPalError as exc:
+            if not exc.transient:
+                return JsonResponse({'error': exc.message}, status=400)
+            # PayPal is struggling; let the worker retry and the client poll.
+            job = await sync_to_async(create_paypal_payment.delay)(
+                user_id=request.user.id, order_id=order.id,
+                return_url=return_url, cancel_url=cancel_url,
+            )
+            return _job_accepted(job)
+        return JsonResponse({'payment_id': payment['id'], 'approval_url': approval_url(payment)})
 
 
-class PaymentSuccessView(LoginRequiredMixin, View):
-    def get(self, request):
+class PaymentSuccessView(AsyncLoginRequiredMixin, IdempotencyMixin, View):
+    # PayPal redirects here with GET; executing twice must not charge twice.
+    idempotent_methods = ('GET',)
+
+    def _idempotency_key(self, request):
+        # The browser redirect carries no Idempotency-Key header, so the
+        # payment itself is the key (scoped to the user like any other).
+        payment_id = request.GET.get('paymentId')
+        if request.method not in self.idempotent_methods or not payment_id:
+            return None
+        return f'paypal-execute:{payment_id}'
+
+    async def get(self, request):
         payment_id = request.GET.get('paymentId')
         payer_id = request.GET.get('PayerID')
+        if not payment_id or not payer_id:
+            return JsonResponse({'error': 'Invalid request data'}, status=400)
 
-        _configure_paypal()
-        payment = paypalrestsdk.Payment.find(payment_id)
+        try:
+            payment = await get_paypal_client().execute_payment(payment_id, payer_id)
+        except PayPalError as exc:
+            if not exc.transient:
+                return JsonResponse({'error': 'Payment execution failed'}, status=400)
+            job = await sync_to_async(execute_paypal_payment.delay)(
+                user_id=request.user.id, payment_id=payment_id, payer_id=payer_id,
+            )
+            return _job_accepted(job)
+
+        try:
+            order = await sync_to_async(mark_order_paid)(request.user.id, payment)
+        except ValueError:
+            return JsonResponse({'error': 'Could not parse order ID'}, status=400)
+        except Order.DoesNotExist:
+            raise Http404('No Order matches the given query.')
+        return JsonResponse({'message': 'Payment successful', 'order_id': order.id})
 
-        if payment.execute({'payer_id': payer_id}):
-            # Parse order ID safely from description
-            try:
-                order_id = int(payment.transactions[0].description.split()[-1])
-            except (IndexError, ValueError):
-                return JsonResponse({'error': 'Could not parse order ID'}, status=400)
 
-            order = get_object_or_404(Order, id=order_id, customer=request.user)
-            order.payment_status = 'Paid'
-            order.save()
-            return JsonResponse({'message': 'Payment successful', 'order_id': order.id})
+class PaymentJobStatusView(LoginRequiredMixin, View):
+    """Outcome of a queued PayPal job, polled by the checkout page."""
+    job_names = (create_paypal_payment.job_name, execute_paypal_payment.job_name)
 
-        return JsonResponse({'error': 'Payment execution failed'}, status=400)
+    def get(self, request, job_id):
+        job = get_object_or_404(
+            Job, id=job_id, name__in=self.job_names, payload__user_id=request.user.id,
+        )
+        data = {'status': job.status, 'result': job.result}
+        if job.status == 'failed':
+            data['error'] = 'Payment could not be processed'
+        return JsonResponse(data)
 
 
 class PaymentCancelledView(LoginRequiredMixin, View):
     def get(self, request):
         return JsonResponse({'message': 'Payment was cancelled'})
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+class MetricsView(View):
+    """
+    Request metrics of this process in the Prometheus text format, or as JSON
+    with ``?format=json``. Open to staff and to scrapers sending
+    ``Authorization: Bearer <METRICS_TOKEN>``.
+    """
+
+    def has_access(self, request):
+        if request.user.is_staff:
+            return True
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        header = request.headers.get('Authorization', '')
+        return bool(token) and hmac.compare_digest(header, f'Bearer {token}')
+
+    def get(self, request):
+        if not self.has_access(request):
+            return HttpResponse(status=403)
+        if request.GET.get('format') == 'json':
+            return JsonResponse(registry.snapshot())
+        return HttpResponse(registry.render_prometheus(), content_type='text/plain; version=0.0.4')
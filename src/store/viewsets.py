@@ -1,44 +1,224 @@
-from rest_framework import viewsets, permissions, filters
+import uuid
+
+from django.core.files.storage import default_storage
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_date
+from django.urls import reverse
+from rest_framework import viewsets, permissions, filters, status
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 
-from .models import Product, Order, ShippingInfo, Review
+from .catalog_io import CONTENT_TYPES, FORMATS, export_catalog, format_for
+from .conditional import make_etag, not_modified, product_validators, set_validators
+from .facets import cached_facet_counts, filter_facets
+from .filters import ProductSearchFilter, filter_by_price_range
+from .models import Job, Product, Order, ShippingInfo, Review
+from .navigation import get_category_navigation
+from .order_export import ROWS, export_response
+from .page_cache import get_catalog_version, get_stock_version
+from .pagination import KeysetPagination
 from .serializers import (
-    ProductSerializer, OrderSerializer,
+    CategoryNavigationSerializer, ProductSerializer, ProductDetailSerializer, OrderSerializer,
     ShippingInfoSerializer, ReviewSerializer,
 )
+from .shipping import quote_destinations
+from .tasks import import_catalog_file
+
+MAX_SHIPPING_QUOTES = 50
+
+
+class CategoryViewSet(viewsets.ViewSet):
+    """Every category with its product and in-stock counts, from the navigation cache."""
+    permission_classes = [permissions.AllowAny]
+
+    def list(self, request):
+        etag = make_etag(get_catalog_version(), 'categories')
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+        serializer = CategoryNavigationSerializer(get_category_navigation(), many=True)
+        return set_validators(Response(serializer.data), etag)
+
+
+class CatalogViewSet(viewsets.ViewSet):
+    """Staff-only bulk catalog export and import (see store.catalog_io)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def unknown_format(self):
+        return Response(
+            {'error': f'type must be one of {", ".join(FORMATS)}.'}, status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """The whole catalog, streamed; ``?type=csv`` (default) or ``?type=jsonl``."""
+        file_format = request.query_params.get('type', 'csv')
+        if file_format not in FORMATS:
+            return self.unknown_format()
+        response = StreamingHttpResponse(
+            export_catalog(file_format), content_type=CONTENT_TYPES[file_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="catalog.{file_format}"'
+        return response
+
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser], url_path='imports')
+    def imports(self, request):
+        """Queue the import of an uploaded ``file``; poll the returned ``status_url``."""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Upload the catalog as "file".'}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('type') or format_for(upload.name)
+        if file_format not in FORMATS:
+            return self.unknown_format()
+        name = default_storage.save(f'catalog_imports/{uuid.uuid4().hex}.{file_format}', upload)
+        job = import_catalog_file.delay(name=name, file_format=file_format)
+        return Response({
+            'job_id': job.id,
+            'status_url': reverse('store:catalog-import-status', args=[job.id]),
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'imports/(?P<job_id>[0-9]+)', url_name='import-status')
+    def import_status(self, request, job_id):
+        job = get_object_or_404(Job, pk=job_id, name=import_catalog_file.job_name)
+        return Response({'status': job.status, 'result': job.result, 'error': job.last_error or None})
 
 
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     """Read-only product listing. Write access is admin-only via the admin panel."""
-    queryset = Product.objects.select_related('category').prefetch_related('discount', 'reviews')
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['name', 'description', 'category__name']
-    ordering_fields = ['price', 'rating', 'created_at']
+    pagination_class = KeysetPagination
+    filter_backends = [ProductSearchFilter, filters.OrderingFilter]
+    ordering_fields = ['price', 'effective_price', 'rating', 'created_at']
     lookup_field = 'slug'
 
+    def get_queryset(self):
+        queryset = Product.objects.all()
+        if self.action == 'reviews':
+            return queryset.only('id', 'slug')
+        if self.action == 'list':
+            fields = ProductSerializer.get_requested_fields(self.request)
+            queryset = ProductSerializer.narrow_queryset(queryset, fields)
+        else:
+            fields = ProductDetailSerializer.get_requested_fields(self.request)
+            queryset = ProductDetailSerializer.narrow_queryset(queryset, fields)
+        queryset = filter_by_price_range(queryset, self.request.query_params)
+        if self.action == 'list':
+            queryset = filter_facets(queryset, self.request.query_params)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        # Any change to what a list could show bumps the catalog or stock version.
+        etag = make_etag(get_catalog_version(), get_stock_version(), request.get_full_path())
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('facets'):
+            response.data['facets'] = self.get_facet_counts()
+        return set_validators(response, etag)
+
+    def get_facet_counts(self):
+        """Counts for ``?facets=1``: the search and price range apply, the facets are counted."""
+        params = self.request.query_params
+        queryset = self.filter_queryset(filter_by_price_range(Product.objects.all(), params))
+        parts = [(name, params.get(name)) for name in ('search', 'min_price', 'max_price')]
+        return cached_facet_counts(queryset, params, parts)
+
+    def retrieve(self, request, *args, **kwargs):
+        updated_at = (
+            self.filter_queryset(self.get_queryset())
+            .filter(slug=kwargs[self.lookup_field])
+            .values_list('updated_at', flat=True)
+            .first()
+        )
+        if updated_at is None:
+            return super().retrieve(request, *args, **kwargs)  # The 404.
+        etag, last_modified = product_validators(updated_at)
+        return not_modified(request, etag, last_modified) or set_validators(
+            super().retrieve(request, *args, **kwargs), etag, last_modified,
+        )
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return ProductDetailSerializer
+        if self.action == 'reviews':
+            return ReviewSerializer
+        return ProductSerializer
+
+    @action(detail=True, methods=['get'])
+    def reviews(self, request, slug=None):
+        """Paginated reviews of a single product."""
+        product = self.get_object()
+        page = self.paginate_queryset(product.reviews.select_related('user'))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
 
 class OrderViewSet(viewsets.ModelViewSet):
     """Customers can only see and manage their own orders."""
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
-            return Order.objects.all().select_related('customer', 'shipping_info')
-        return Order.objects.filter(customer=user).select_related('shipping_info')
+            queryset = Order.objects.all().select_related('customer', 'shipping_info')
+        else:
+            queryset = Order.objects.filter(customer=user).select_related('shipping_info')
+        return queryset.prefetch_related('orderitem_set__product')
 
     def perform_create(self, serializer):
         serializer.save(customer=self.request.user)
 
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        """
+        Every order, streamed for finance: ``?type=csv`` (default) or ``jsonl``,
+        ``?rows=orders`` (default) or ``items`` for one row per order line, and
+        optionally ``?since=``/``?until=`` dates bounding ``created_at``.
+        """
+        params = request.query_params
+        file_format, rows = params.get('type', 'csv'), params.get('rows', 'orders')
+        if file_format not in FORMATS or rows not in ROWS:
+            return Response(
+                {'error': f'type must be one of {", ".join(FORMATS)} and rows one of {", ".join(ROWS)}.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        orders = Order.objects.all()
+        for param, lookup in (('since', 'created_at__date__gte'), ('until', 'created_at__date__lte')):
+            if params.get(param):
+                day = parse_date(params[param])
+                if day is None:
+                    return Response(
+                        {'error': f'{param} must be a date (YYYY-MM-DD).'}, status=status.HTTP_400_BAD_REQUEST,
+                    )
+                orders = orders.filter(**{lookup: day})
+        return export_response(file_format, orders, rows)
+
+    @action(detail=True, methods=['get'], url_path='shipping-quotes')
+    def shipping_quotes(self, request, pk=None):
+        """Quote this order's shipping to every ``?country=`` code in one call."""
+        codes = []
+        for value in request.query_params.getlist('country'):
+            codes.extend(code.strip().upper() for code in value.split(',') if code.strip())
+        if not codes or len(codes) > MAX_SHIPPING_QUOTES:
+            return Response(
+                {'error': f'Pass between 1 and {MAX_SHIPPING_QUOTES} country codes.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        quotes = quote_destinations(self.get_object(), codes)
+        return Response({'quotes': {code: str(cost) for code, cost in quotes.items()}})
+
 
 class ShippingInfoViewSet(viewsets.ModelViewSet):
     """Customers manage their own shipping addresses."""
     serializer_class = ShippingInfoSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return ShippingInfo.objects.filter(customer=self.request.user)
@@ -51,6 +231,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
     """Users can read all reviews but only write/edit their own."""
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ['created_at', 'rating']
 
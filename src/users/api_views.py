@@ -4,19 +4,22 @@ from .serializers import ProfileSerializer
 from .api_permissions import IsAdminOrOwnsAccount
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
+from store.pagination import KeysetPagination
 
 
 class ProfileViewSet(viewsets.ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [IsAdminOrOwnsAccount, IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = 'user_id'
     lookup_field = 'username'
 
     def get_queryset(self):
         user = self.request.user
         if user.is_staff or user.is_superuser:
-            return Profile.objects.all().order_by('user__id')
-        return Profile.objects.filter(user=user)
+            return Profile.objects.select_related('user').order_by('user_id')
+        return Profile.objects.filter(user=user).select_related('user')
 
     def get_object(self):
         queryset = self.get_queryset()
@@ -7,3 +7,4 @@ class UsersConfig(AppConfig):
 
     def ready(self):
         import users.signals
+        import users.tasks  # registers the background job handlers
@@ -1,55 +1,70 @@
-import os
-from pathlib import Path
+import uuid
 
-from PIL import Image
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import FileExtensionValidator
 
-BASE_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_IMAGE = 'profile/default.jpg'
 
 
 def change_users_images_name(instance, filename):
     """
-    Rename uploaded profile images and remove any old image for this user.
-    Safely handles the case where the profile/ directory doesn't exist yet.
+    Store each upload under the user's own folder with a fresh name, so the
+    path is known without scanning the media directory and browsers never
+    see a stale cached avatar. Profile.save() deletes the previous file.
     """
-    ext = filename.split('.')[-1]
-    folder = BASE_DIR / 'media' / 'profile'
+    ext = filename.split('.')[-1].lower()
+    return f'profile/{instance.user_id}/{uuid.uuid4().hex[:12]}.{ext}'
 
-    # Guard: directory may not exist on first upload
-    if folder.exists():
-        for img in os.listdir(folder):
-            if str(instance.user) in img:
-                try:
-                    os.remove(folder / img)
-                except FileNotFoundError:
-                    pass  # Already gone — that's fine
 
-    return f'profile/{instance.user}.{ext}'
+def _delete_files(storage, names):
+    for name in names:
+        storage.delete(name)
 
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     image = models.ImageField(
         upload_to=change_users_images_name,
-        default='profile/default.jpg',
+        default=DEFAULT_IMAGE,
         validators=[FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png'])],
     )
+    # 300x300 derivative of image, written by the users.make_profile_thumbnail job.
+    thumbnail = models.ImageField(blank=True, editable=False)
+
+    # Image and thumbnail names as last persisted.
+    _persisted_files = (DEFAULT_IMAGE, '')
 
     def __str__(self):
         return f'{self.user.username} Profile'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._persisted_files = (instance.__dict__.get('image'), instance.__dict__.get('thumbnail'))
+        return instance
+
     def save(self, *args, **kwargs):
-        """Resize oversized profile images to max 300×300 after saving."""
-        super().save(*args, **kwargs)
-        try:
-            img = Image.open(self.image.path)
-            if img.height > 300 or img.width > 300:
-                img.thumbnail((300, 300))
-                img.convert('RGB').save(self.image.path)
-        except (FileNotFoundError, OSError):
-            pass  # Image may not exist on disk (e.g. in tests)
+        """Swap in a new image cheaply; resizing happens in the background."""
+        from .tasks import make_profile_thumbnail
+
+        old_image, old_thumbnail = (str(name or '') for name in self._persisted_files)
+        replaced = self.image.name != old_image
+        if replaced:
+            self.thumbnail = ''
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if replaced:
+                if self.image.name != DEFAULT_IMAGE:
+                    make_profile_thumbnail.delay(profile_id=self.pk, image_name=self.image.name)
+                stale = [name for name in (old_image, old_thumbnail) if name and name != DEFAULT_IMAGE]
+                # Only once the new name is committed; a rollback keeps the old file.
+                transaction.on_commit(lambda: _delete_files(self.image.storage, stale))
+        self._persisted_files = (self.image.name, self.thumbnail.name)
+
+    @property
+    def avatar_url(self):
+        return (self.thumbnail or self.image).url
 
     def full_name(self):
         return f'{self.user.first_name} {self.user.last_name}'.strip()
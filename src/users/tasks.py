@@ -0,0 +1,48 @@
+"""
+Background job handlers for the users app (run by store's ``run_worker``).
+"""
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from store.jobs import PermanentJobError, job
+
+from .models import Profile
+
+THUMBNAIL_SIZE = (300, 300)
+# Uploads beyond this are refused instead of being decoded.
+MAX_SOURCE_PIXELS = 40_000_000
+
+
+def thumbnail_name(image_name):
+    path = PurePosixPath(image_name)
+    return str(path.with_name(f'{path.stem}_thumb.jpg'))
+
+
+@job('users.make_profile_thumbnail')
+def make_profile_thumbnail(profile_id, image_name):
+    profile = Profile.objects.filter(pk=profile_id, image=image_name).first()
+    if profile is None:
+        return {'skipped': True}  # Replaced again before this job ran.
+
+    storage = profile.image.storage
+    with storage.open(image_name) as source:
+        try:
+            image = Image.open(source)  # Reads the header only.
+        except (OSError, Image.DecompressionBombError) as exc:
+            raise PermanentJobError(f'Unreadable image {image_name}') from exc
+        if image.width * image.height > MAX_SOURCE_PIXELS:
+            raise PermanentJobError(f'{image_name} is {image.width}x{image.height}, too large to resize')
+        # JPEGs decode straight at a reduced scale instead of at full size.
+        image.draft('RGB', THUMBNAIL_SIZE)
+        image.thumbnail(THUMBNAIL_SIZE)
+        output = BytesIO()
+        image.convert('RGB').save(output, 'JPEG', quality=85)
+
+    saved = storage.save(thumbnail_name(image_name), ContentFile(output.getvalue()))
+    if not Profile.objects.filter(pk=profile_id, image=image_name).update(thumbnail=saved):
+        storage.delete(saved)
+        return {'skipped': True}
+    return {'thumbnail': saved}
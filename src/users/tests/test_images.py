@@ -0,0 +1,64 @@
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from store.jobs import run_pending
+from users.models import Profile
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def png_upload(width, height, name='avatar.png'):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), 'purple').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ProfileImageTest(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bob = User.objects.create_user('bob')
+        cls.bobby = User.objects.create_user('bobby')
+
+    def upload(self, user, width=1200, height=900):
+        profile, _ = Profile.objects.get_or_create(user=user)
+        profile = Profile.objects.get(pk=profile.pk)
+        profile.image = png_upload(width, height)
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        return profile
+
+    def test_upload_is_stored_under_the_user_and_resized_later(self):
+        profile = self.upload(self.bob)
+        self.assertTrue(profile.image.name.startswith(f'profile/{self.bob.pk}/'))
+        self.assertEqual(profile.image.width, 1200)
+        self.assertEqual(profile.avatar_url, profile.image.url)
+
+        run_pending()
+        profile = Profile.objects.get(pk=profile.pk)
+        self.assertLessEqual(max(profile.thumbnail.width, profile.thumbnail.height), 300)
+        self.assertEqual(profile.avatar_url, profile.thumbnail.url)
+
+    def test_replacing_deletes_only_the_previous_files(self):
+        neighbour = self.upload(self.bobby)
+        first = self.upload(self.bob)
+        run_pending()
+        first = Profile.objects.get(pk=first.pk)
+        old_files = [first.image.name, first.thumbnail.name]
+
+        self.upload(self.bob, 200, 200)
+        storage = first.image.storage
+        self.assertFalse(any(storage.exists(name) for name in old_files))
+        self.assertTrue(storage.exists(neighbour.image.name))
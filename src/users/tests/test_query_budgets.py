@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+from store.testing import QueryBudget, QueryBudgetMixin
+from users.models import Profile
+
+
+class UsersQueryBudgetTest(QueryBudgetMixin, TestCase):
+    app = 'users'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('member', first_name='Mem', last_name='Ber')
+        cls.staff = User.objects.create_user('admin', is_staff=True)
+        others = [User.objects.create_user(f'member{n}') for n in range(5)]
+        for user in [cls.user, cls.staff] + others:
+            Profile.objects.create(user=user)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_budgets(self):
+        return [
+            QueryBudget('users:profile', 'get', '/accounts/profile/', 8, user=self.user),
+            QueryBudget('users:delete-user', 'get', '/accounts/profile/member/delete', 4, user=self.user),
+            QueryBudget('users:rest_profile-list', 'get', '/accounts/api/', 3, user=self.user),
+            QueryBudget('users:rest_profile-list', 'get', '/accounts/api/', 3, user=self.staff),
+            QueryBudget('users:rest_profile-detail', 'get', '/accounts/api/profile/member/', 3, user=self.staff),
+        ]